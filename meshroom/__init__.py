@@ -1,7 +1,6 @@
 __version__ = "2021.1.0"
 __version_name__ = __version__
 
-from distutils import util
 import logging
 import os
 import sys
@@ -22,7 +21,38 @@ if not isFrozen:
 # Allow override from env variable
 __version_name__ = os.environ.get("REZ_MESHROOM_VERSION", __version_name__)
 
-useMultiChunks = util.strtobool(os.environ.get("MESHROOM_USE_MULTI_CHUNKS", "True"))
+
+def strtobool(value):
+    """
+    Convert a string representation of truth to 1 (y, yes, t, true, on, 1) or 0 (n, no, f, false, off, 0).
+    Same as distutils.util.strtobool, which is slow to import.
+
+    Raises:
+        ValueError: if 'value' is anything else
+    """
+    value = value.lower()
+    if value in ('y', 'yes', 't', 'true', 'on', '1'):
+        return 1
+    if value in ('n', 'no', 'f', 'false', 'off', '0'):
+        return 0
+    raise ValueError('invalid truth value {!r}'.format(value))
+
+
+useMultiChunks = strtobool(os.environ.get("MESHROOM_USE_MULTI_CHUNKS", "True"))
+# Lock node chunks during computation to share results between processes (see meshroom.core.uidLock)
+useUidLocks = strtobool(os.environ.get("MESHROOM_USE_UID_LOCKS", "True"))
+# Only import node plugin modules when their node types are used (see meshroom.core.NodesDescRegistry)
+useLazyNodes = strtobool(os.environ.get("MESHROOM_USE_LAZY_NODES", "True"))
+# Save graph snapshots next to ".mg" files, used by read-only tools (see meshroom.core.snapshot)
+useGraphSnapshots = strtobool(os.environ.get("MESHROOM_USE_GRAPH_SNAPSHOTS", "False"))
+# Prefetch the inputs of the next chunk while computing (see meshroom.core.prefetch)
+useInputsPrefetch = strtobool(os.environ.get("MESHROOM_USE_INPUTS_PREFETCH", "False"))
+# Limit the memory, CPU and runtime of chunk processes (see meshroom.core.resourceLimits)
+useResourceLimits = strtobool(os.environ.get("MESHROOM_USE_RESOURCE_LIMITS", "False"))
+# Pin concurrent chunk processes to disjoint core sets (see meshroom.core.coreAllocator)
+useCoreAllocation = strtobool(os.environ.get("MESHROOM_USE_CORE_ALLOCATION", "False"))
+# Compute the nodes implemented in Python in worker processes (see meshroom.core.outOfProcess)
+useOutOfProcessNodes = strtobool(os.environ.get("MESHROOM_USE_OUT_OF_PROCESS_NODES", "False"))
 
 
 def setupEnvironment(backend=Backend.STANDALONE):
@@ -49,6 +49,9 @@ class CoreDictModel:
         assert obj in self._objects.values()
         del self._objects[getattr(obj, self._keyAttrName)]
 
+    def contains(self, obj):
+        return obj in self._objects.values()
+
     def clear(self):
         self._objects.clear()
 
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Long-lived compute server, to avoid paying Python startup, plugins loading and graph loading
+for each computed chunk.
+
+The server keeps the node plugins and the loaded graphs in memory and accepts requests over
+a local Unix socket. A graph is reloaded when the modification time of its file changes.
+Requests and responses are JSON documents, one per line:
+ - {"command": "compute", "graphFile": ..., "nodes": [...], "iteration": -1, "forceCompute": false, "extern": false}
+ - {"command": "compute", "graphFile": ..., "toNode": ..., "forceCompute": false, "forceStatus": false}
+ - {"command": "status", "graphFile": ..., "nodes": [...]}
+ - {"command": "ping"}, {"command": "shutdown"}
+Responses: {"success": bool, "error": str, ...}, preceded by the output of the computation: {"output": str}
+
+Status requests are served concurrently, while computations are serialized: the execution state
+(running processes, inputs prefetcher...) is global to the server process. Status requests are served
+from their own instances of the graphs, updated from the cache, and never touch the computed nodes.
+
+The server requires Unix sockets: on other platforms, clients compute locally (see ServerUnavailableError).
+
+This module does not import meshroom.core at module level: clients stay lightweight.
+"""
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+from contextlib import contextmanager
+
+try:
+    import socketserver
+except ImportError:
+    # python 2
+    import SocketServer as socketserver
+
+defaultSocketPath = os.environ.get('MESHROOM_SERVER_SOCKET', os.path.join(os.path.expanduser('~'), '.meshroom', 'server.sock'))
+
+
+class ServerUnavailableError(Exception):
+    """ No compute server is listening on the socket. """
+
+
+def sendRequest(request, socketPath=None, timeout=None, output=None):
+    """
+    Send a request to a compute server and wait for its response.
+
+    Args:
+        output (file): where to write the output of the computation streamed by the server (discarded if None)
+
+    Raises:
+        ServerUnavailableError: if no server is running
+    """
+    socketPath = socketPath or defaultSocketPath
+    if not hasattr(socket, 'AF_UNIX'):
+        raise ServerUnavailableError('Unix sockets are not supported on this platform.')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socketPath)
+    except (IOError, OSError) as e:
+        sock.close()
+        raise ServerUnavailableError('No compute server on "{}": {}'.format(socketPath, str(e)))
+    response = None
+    try:
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        f = sock.makefile('rb')
+        try:
+            for line in iter(f.readline, b''):
+                message = json.loads(line.decode('utf-8'))
+                if 'output' not in message:
+                    response = message
+                    break
+                if output:
+                    output.write(message['output'])
+                    output.flush()
+        finally:
+            f.close()
+    finally:
+        sock.close()
+    if response is None:
+        raise RuntimeError('Connection closed by the compute server.')
+    return response
+
+
+class OutputStream(object):
+    """
+    File-like object streaming the written text to the client of a request.
+    """
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        if not text:
+            return
+        with self._lock:
+            try:
+                self._wfile.write((json.dumps({'output': text}) + '\n').encode('utf-8'))
+                self._wfile.flush()
+            except (IOError, OSError):
+                # the client is gone: the computation goes on
+                pass
+
+    def flush(self):
+        pass
+
+
+@contextmanager
+def forwardedOutput(output):
+    """ Forward the standard output and the log messages of the server to 'output' (if any). """
+    if output is None:
+        yield
+        return
+    handler = logging.StreamHandler(output)
+    handler.setFormatter(logging.Formatter('[%(asctime)s][%(levelname)s] %(message)s'))
+    logging.getLogger().addHandler(handler)
+    stdout = sys.stdout
+    sys.stdout = output
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+        logging.getLogger().removeHandler(handler)
+
+
+class GraphCache(object):
+    """
+    Loaded graphs, reloaded when their file changes.
+    """
+    def __init__(self):
+        self._graphs = {}  # (filepath, cacheDir): (mtime, graph, lock)
+        self._lock = threading.Lock()
+
+    def get(self, filepath, cacheDir=None):
+        """ Return the up-to-date graph loaded from 'filepath' and the lock protecting its updates. """
+        from meshroom.core.graph import loadGraph
+        filepath = os.path.abspath(filepath)
+        mtime = os.path.getmtime(filepath)
+        key = (filepath, cacheDir)
+        with self._lock:
+            cached = self._graphs.get(key)
+            if cached and cached[0] == mtime:
+                return cached[1], cached[2]
+            logging.info('Load graph "{}".'.format(filepath))
+            graph = loadGraph(filepath)
+            if cacheDir:
+                graph.cacheDir = cacheDir
+                graph.update()
+            self._graphs[key] = (mtime, graph, threading.Lock())
+            return graph, self._graphs[key][2]
+
+
+class ComputeRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line.decode('utf-8'))
+            response = self.server.processRequest(request, OutputStream(self.wfile))
+        except Exception as e:
+            logging.exception('Error on request')
+            response = {'success': False, 'error': str(e)}
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+if hasattr(socket, 'AF_UNIX'):
+    # socketserver.UnixStreamServer is only defined when Unix sockets are supported
+    class ComputeServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        """
+        Serve compute and status requests on a Unix socket, one thread per request.
+        """
+        daemon_threads = True
+
+        def __init__(self, socketPath=None):
+            self.socketPath = socketPath or defaultSocketPath
+            self.graphs = GraphCache()
+            # graphs of the status requests, not modified by the computations
+            self.statusGraphs = GraphCache()
+            # serialize the computations (see module documentation)
+            self._computeLock = threading.Lock()
+            folder = os.path.dirname(self.socketPath)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            if os.path.exists(self.socketPath):
+                try:
+                    sendRequest({'command': 'ping'}, self.socketPath, timeout=5)
+                except ServerUnavailableError:
+                    # stale socket of a stopped server
+                    os.remove(self.socketPath)
+                else:
+                    raise RuntimeError('A compute server is already running on "{}".'.format(self.socketPath))
+            socketserver.UnixStreamServer.__init__(self, self.socketPath, ComputeRequestHandler)
+
+        def _nodes(self, graph, nodeNames):
+            nodes = []
+            for nodeName in nodeNames:
+                node = graph.node(nodeName)
+                if node is None:
+                    raise RuntimeError('Node "{}" does not exist in graph "{}".'.format(nodeName, graph.filepath))
+                nodes.append(node)
+            return nodes
+
+        def processRequest(self, request, output=None):
+            """
+            Process a request and return its response.
+
+            Args:
+                request (dict): the request
+                output (file): where to write the output of a computation
+            """
+            command = request.get('command')
+            if command == 'ping':
+                return {'success': True, 'pid': os.getpid()}
+            if command == 'shutdown':
+                threading.Thread(target=self.shutdown).start()
+                return {'success': True}
+            if command not in ('status', 'compute'):
+                raise RuntimeError('Unknown command "{}".'.format(command))
+
+            if command == 'status':
+                graph, graphLock = self.statusGraphs.get(request['graphFile'], request.get('cacheDir'))
+                with graphLock:
+                    # chunks may have been computed by other processes
+                    graph.updateStatusFromCache(force=True)
+                nodes = self._nodes(graph, request['nodes']) if request.get('nodes') else graph.dfsOnFinish()[0]
+                return {'success': True,
+                        'status': {node.name: [chunk.status.status.name for chunk in node.chunks] for node in nodes}}
+
+            graph, graphLock = self.graphs.get(request['graphFile'], request.get('cacheDir'))
+            with self._computeLock, graphLock, forwardedOutput(output):
+                graph.updateStatusFromCache(force=True)
+                self._compute(graph, request)
+            return {'success': True}
+
+        def _compute(self, graph, request):
+            """ Execute a compute request, as meshroom_compute does. """
+            from meshroom.core.graph import executeGraph
+            from meshroom.core.node import Status
+            forceCompute = request.get('forceCompute', False)
+            iteration = request.get('iteration', -1)
+            if not request.get('nodes'):
+                toNodes = self._nodes(graph, [request['toNode']]) if request.get('toNode') else None
+                executeGraph(graph, toNodes=toNodes, forceCompute=forceCompute, forceStatus=request.get('forceStatus', False))
+                return
+            submittedStatuses = [Status.RUNNING]
+            if not request.get('extern'):
+                # farm tasks ("extern") are supposed to have the SUBMITTED status
+                submittedStatuses.append(Status.SUBMITTED)
+            for node in self._nodes(graph, request['nodes']):
+                chunks = [node.chunks[iteration]] if iteration != -1 else node.chunks
+                if not request.get('forceStatus') and not forceCompute:
+                    for chunk in chunks:
+                        if chunk.status.status in submittedStatuses:
+                            print('Warning: Node is already submitted with status "{}". See file: "{}"'.format(
+                                chunk.status.status.name, chunk.statusFile))
+                if iteration != -1:
+                    chunks[0].process(forceCompute)
+                else:
+                    node.process(forceCompute)
+
+        def server_close(self):
+            socketserver.UnixStreamServer.server_close(self)
+            if os.path.exists(self.socketPath):
+                os.remove(self.socketPath)
+
+
+def runServer(socketPath=None):
+    """ Run a compute server until it receives a shutdown request. """
+    if not hasattr(socket, 'AF_UNIX'):
+        raise RuntimeError('The compute server requires Unix sockets, not supported on this platform.')
+    import meshroom.core  # load plugins once
+    server = ComputeServer(socketPath)
+    logging.info('Compute server listening on "{}".'.format(server.socketPath))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -4,9 +4,11 @@ import hashlib
 from contextlib import contextmanager
 import importlib
 import inspect
+import json
 import os
 import re
 import tempfile
+import time
 import uuid
 import logging
 import pkgutil
@@ -21,7 +23,7 @@ try:
 except:
     pass
 
-from meshroom.core.submitter import BaseSubmitter
+import meshroom
 from . import desc
 from . import pyCompatibility
 
@@ -29,13 +31,16 @@ from . import pyCompatibility
 logging.basicConfig(format='[%(asctime)s][%(levelname)s] %(message)s', level=logging.INFO)
 
 # make a UUID based on the host ID and current time
-sessionUid = str(uuid.uuid1())
+# worker processes share the session of the process they compute for (see meshroom.core.outOfProcess)
+sessionUid = os.environ.get('MESHROOM_SESSION_UID') or str(uuid.uuid1())
 
 cacheFolderName = 'MeshroomCache'
 defaultCacheFolder = os.environ.get('MESHROOM_CACHE', os.path.join(tempfile.gettempdir(), cacheFolderName))
-nodesDesc = {}
-submitters = {}
-pipelineTemplates = {}
+# Node types of the plugin modules (see NodesManifest), not persisted if empty
+nodesManifestFile = os.environ.get('MESHROOM_NODES_MANIFEST', os.path.join(os.path.expanduser('~'), '.meshroom', 'nodesManifest.json'))
+# Duration (in seconds) of the loading steps of this module: {step name: duration}
+loadingTimes = {}
+_moduleStartTime = time.time()
 
 
 def hashValue(value):
@@ -44,6 +49,17 @@ def hashValue(value):
     return hashObject.hexdigest()
 
 
+@contextmanager
+def loadingStep(name):
+    """ Measure the duration of a loading step into 'loadingTimes'. """
+    startTime = time.time()
+    try:
+        yield
+    finally:
+        loadingTimes[name] = loadingTimes.get(name, 0.0) + time.time() - startTime
+        logging.debug('Loading step "{}": {:.3f}s'.format(name, loadingTimes[name]))
+
+
 @contextmanager
 def add_to_path(p):
     import sys
@@ -56,6 +72,41 @@ def add_to_path(p):
         sys.path = old_path
 
 
+def _importPluginModule(package, pluginName, classType):
+    """
+    Import a plugin module of an imported package and return its valid plugin classes and the errors.
+    """
+    pluginModuleName = '.' + pluginName
+    packageName = package.packageName if hasattr(package, 'packageName') else package.__name__
+    packageVersion = getattr(package, "__version__", None)
+    try:
+        pluginMod = importlib.import_module(pluginModuleName, package=package.__name__)
+        plugins = [plugin for name, plugin in inspect.getmembers(pluginMod, inspect.isclass)
+                   if plugin.__module__ == '{}.{}'.format(package.__name__, pluginName)
+                   and issubclass(plugin, classType)]
+        if not plugins:
+            logging.warning("No class defined in plugin: {}".format(pluginModuleName))
+
+        for p in plugins:
+            if classType == desc.Node:
+                nodeErrors = validateNodeDesc(p)
+                if nodeErrors:
+                    return [], ["  * {}: The following parameters do not have valid default values/ranges: {}"
+                                .format(pluginName, ", ".join(nodeErrors))]
+            p.packageName = packageName
+            p.packageVersion = packageVersion
+        return plugins, []
+    except Exception as e:
+        return [], ['  * {}: {}'.format(pluginName, str(e))]
+
+
+def _logPluginErrors(packageName, errors):
+    if errors:
+        logging.warning('== The following "{package}" plugins could not be loaded ==\n'
+                        '{errorMsg}\n'
+                        .format(package=packageName, errorMsg='\n'.join(errors)))
+
+
 def loadPlugins(folder, packageName, classType):
     """
     """
@@ -68,42 +119,228 @@ def loadPlugins(folder, packageName, classType):
         # import node package
         package = importlib.import_module(packageName)
         packageName = package.packageName if hasattr(package, 'packageName') else package.__name__
-        packageVersion = getattr(package, "__version__", None)
 
         for importer, pluginName, ispkg in pkgutil.iter_modules(package.__path__):
-            pluginModuleName = '.' + pluginName
-
-            try:
-                pluginMod = importlib.import_module(pluginModuleName, package=package.__name__)
-                plugins = [plugin for name, plugin in inspect.getmembers(pluginMod, inspect.isclass)
-                           if plugin.__module__ == '{}.{}'.format(package.__name__, pluginName)
-                           and issubclass(plugin, classType)]
-                if not plugins:
-                    logging.warning("No class defined in plugin: {}".format(pluginModuleName))
-
-                importPlugin = True
-                for p in plugins:
-                    if classType == desc.Node:
-                        nodeErrors = validateNodeDesc(p)
-                        if nodeErrors:
-                            errors.append("  * {}: The following parameters do not have valid default values/ranges: {}"
-                                          .format(pluginName, ", ".join(nodeErrors)))
-                            importPlugin = False
-                            break
-                    p.packageName = packageName
-                    p.packageVersion = packageVersion
-                if importPlugin:
-                    pluginTypes.extend(plugins)
-            except Exception as e:
-                errors.append('  * {}: {}'.format(pluginName, str(e)))
+            plugins, pluginErrors = _importPluginModule(package, pluginName, classType)
+            pluginTypes.extend(plugins)
+            errors.extend(pluginErrors)
 
-    if errors:
-        logging.warning('== The following "{package}" plugins could not be loaded ==\n'
-                        '{errorMsg}\n'
-                        .format(package=packageName, errorMsg='\n'.join(errors)))
+    _logPluginErrors(packageName, errors)
     return pluginTypes
 
 
+class NodesDescRegistry(dict):
+    """
+    Registered node types: {nodeType name: desc.Node class}.
+
+    Node plugin modules can be registered lazily: their node types are listed from a manifest
+    and the modules are only imported (and validated) when one of their node types is accessed.
+    The manifest records the node types of each module, and is updated when a module changes.
+    """
+    def __init__(self, *args, **kwargs):
+        super(NodesDescRegistry, self).__init__(*args, **kwargs)
+        # nodeType name: (folder, package name, plugin module name, {"category": str, "version": str})
+        self._lazy = {}
+
+    def _load(self, nodeType):
+        """ Import the plugin module of a lazily registered node type. """
+        folder, packageName, pluginName, _ = self._lazy[nodeType]
+        with add_to_path(folder):
+            package = importlib.import_module(packageName)
+            plugins, errors = _importPluginModule(package, pluginName, desc.Node)
+        for p in plugins:
+            self._lazy.pop(p.__name__, None)
+            dict.__setitem__(self, p.__name__, p)
+        if nodeType in self._lazy:
+            del self._lazy[nodeType]
+            _logPluginErrors(packageName, errors or ['  * {}: Node type "{}" not found'.format(pluginName, nodeType)])
+        logging.debug('Node types loaded [{}]: {}'.format(packageName, ', '.join([p.__name__ for p in plugins])))
+
+    def __getitem__(self, nodeType):
+        if nodeType in self._lazy:
+            self._load(nodeType)
+        return dict.__getitem__(self, nodeType)
+
+    def __contains__(self, nodeType):
+        if nodeType in self._lazy:
+            # invalid node types are removed once loaded
+            self._load(nodeType)
+        return dict.__contains__(self, nodeType)
+
+    def __setitem__(self, nodeType, value):
+        self._lazy.pop(nodeType, None)
+        dict.__setitem__(self, nodeType, value)
+
+    def __delitem__(self, nodeType):
+        if nodeType in self._lazy:
+            del self._lazy[nodeType]
+        else:
+            dict.__delitem__(self, nodeType)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return dict.__len__(self) + len(self._lazy)
+
+    def __copy__(self):
+        registry = NodesDescRegistry(dict.items(self))
+        registry._lazy = dict(self._lazy)
+        return registry
+
+    def get(self, nodeType, default=None):
+        return self[nodeType] if nodeType in self else default
+
+    def keys(self):
+        """ Names of the registered node types, without loading them. """
+        return list(dict.keys(self)) + list(self._lazy.keys())
+
+    def loadAll(self):
+        for nodeType in list(self._lazy.keys()):
+            if nodeType in self._lazy:
+                self._load(nodeType)
+
+    def values(self):
+        self.loadAll()
+        return dict.values(self)
+
+    def items(self):
+        self.loadAll()
+        return dict.items(self)
+
+    def isLoaded(self, nodeType):
+        return dict.__contains__(self, nodeType)
+
+    def nodeTypeInfo(self, nodeType):
+        """ Return the category and version of a node type, without loading it. """
+        if nodeType in self._lazy:
+            return self._lazy[nodeType][3]
+        nodeDesc = dict.__getitem__(self, nodeType)
+        return {"category": nodeDesc.category, "version": nodeVersion(nodeDesc)}
+
+    def registerLazy(self, nodeType, folder, packageName, pluginName, info):
+        if dict.__contains__(self, nodeType) or nodeType in self._lazy:
+            raise RuntimeError("Node Desc {} is already registered.".format(nodeType))
+        self._lazy[nodeType] = (folder, packageName, pluginName, info)
+
+
+nodesDesc = NodesDescRegistry()
+
+
+class LazyRegistry(dict):
+    """
+    Registry filled by 'loader' on first access, so that its plugins are not loaded with this module.
+    Used for the submitters and the pipeline templates, which are not needed to compute nodes.
+    """
+    def __init__(self, loader):
+        super(LazyRegistry, self).__init__()
+        self._loader = loader
+
+    def load(self):
+        if self._loader:
+            # reset first: the loader registers its entries in this registry
+            loader, self._loader = self._loader, None
+            loader()
+
+    def isLoaded(self):
+        return self._loader is None
+
+    def __getitem__(self, key):
+        self.load()
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        self.load()
+        return dict.__contains__(self, key)
+
+    def __iter__(self):
+        self.load()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self.load()
+        return dict.__len__(self)
+
+    def __repr__(self):
+        self.load()
+        return dict.__repr__(self)
+
+    def get(self, key, default=None):
+        self.load()
+        return dict.get(self, key, default)
+
+    def keys(self):
+        self.load()
+        return dict.keys(self)
+
+    def values(self):
+        self.load()
+        return dict.values(self)
+
+    def items(self):
+        self.load()
+        return dict.items(self)
+
+
+class NodesManifest(object):
+    """
+    Cache of the node types defined by node plugin modules, invalidated when a module file changes.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.modules = {}
+        self.modified = False
+        self.key = '{}-{}'.format(getattr(sys.modules.get('meshroom'), '__version__', ''), sys.version_info[:2])
+        if not filepath:
+            return
+        try:
+            with open(filepath, 'r') as jsonFile:
+                data = json.load(jsonFile)
+            if data.get('key') == self.key:
+                self.modules = data.get('modules', {})
+        except (IOError, OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _moduleStamp(package, pluginName):
+        """ Return the modification times of a plugin module (and of its package) files. """
+        packageFolder = package.__path__[0]
+        paths = [os.path.join(packageFolder, pluginName + '.py'), os.path.join(packageFolder, pluginName),
+                 os.path.join(packageFolder, '__init__.py')]
+        return [os.path.getmtime(p) if os.path.exists(p) else None for p in paths]
+
+    def nodeTypes(self, package, pluginName):
+        """ Return the recorded node types of a plugin module, None if unknown or outdated. """
+        entry = self.modules.get('{}:{}'.format(package.__path__[0], pluginName))
+        if entry and entry['stamp'] == self._moduleStamp(package, pluginName):
+            return entry['nodeTypes']
+        return None
+
+    def record(self, package, pluginName, nodeTypes):
+        self.modules['{}:{}'.format(package.__path__[0], pluginName)] = {
+            'stamp': self._moduleStamp(package, pluginName),
+            'nodeTypes': {p.__name__: {'category': p.category, 'version': nodeVersion(p)} for p in nodeTypes},
+        }
+        self.modified = True
+
+    def save(self):
+        if not self.modified or not self.filepath:
+            return
+        try:
+            folder = os.path.dirname(self.filepath)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            writingFilepath = self.filepath + '.writing.' + str(uuid.uuid4())
+            with open(writingFilepath, 'w') as jsonFile:
+                json.dump({'key': self.key, 'modules': self.modules}, jsonFile, indent=4)
+            if os.name == 'nt' and os.path.exists(self.filepath):
+                os.remove(self.filepath)
+            os.rename(writingFilepath, self.filepath)
+            self.modified = False
+        except Exception as e:
+            logging.debug('Failed to save nodes manifest: "{}".'.format(str(e)))
+
+
 def validateNodeDesc(nodeDesc):
     """
     Check that the node has a valid description before being loaded. For the description
@@ -292,14 +529,51 @@ def loadNodes(folder, packageName):
     return loadPlugins(folder, packageName, desc.Node)
 
 
+def loadNodesLazily(folder, packageName, manifest):
+    """
+    Register the node types of a package without importing their modules, using the manifest.
+    Modules that are unknown or modified since the manifest was updated are imported and recorded.
+
+    Returns:
+        list: the names of the registered node types
+    """
+    errors = []
+    nodeTypeNames = []
+    with add_to_path(folder):
+        package = importlib.import_module(packageName)
+        for importer, pluginName, ispkg in pkgutil.iter_modules(package.__path__):
+            nodeTypes = manifest.nodeTypes(package, pluginName)
+            if nodeTypes is not None:
+                for nodeType, info in nodeTypes.items():
+                    nodesDesc.registerLazy(nodeType, folder, packageName, pluginName, info)
+                nodeTypeNames.extend(nodeTypes.keys())
+                continue
+            plugins, pluginErrors = _importPluginModule(package, pluginName, desc.Node)
+            errors.extend(pluginErrors)
+            if not pluginErrors:
+                manifest.record(package, pluginName, plugins)
+            for nodeType in plugins:
+                registerNodeType(nodeType)
+            nodeTypeNames.extend([p.__name__ for p in plugins])
+    _logPluginErrors(packageName, errors)
+    return nodeTypeNames
+
+
 def loadAllNodes(folder):
     global nodesDesc
+    manifest = NodesManifest(nodesManifestFile) if meshroom.useLazyNodes else None
     for importer, package, ispkg in pkgutil.walk_packages([folder]):
         if ispkg:
-            nodeTypes = loadNodes(folder, package)
-            for nodeType in nodeTypes:
-                registerNodeType(nodeType)
-            logging.debug('Nodes loaded [{}]: {}'.format(package, ', '.join([nodeType.__name__ for nodeType in nodeTypes])))
+            if manifest:
+                nodeTypeNames = loadNodesLazily(folder, package, manifest)
+            else:
+                nodeTypes = loadNodes(folder, package)
+                for nodeType in nodeTypes:
+                    registerNodeType(nodeType)
+                nodeTypeNames = [nodeType.__name__ for nodeType in nodeTypes]
+            logging.debug('Nodes loaded [{}]: {}'.format(package, ', '.join(nodeTypeNames)))
+    if manifest:
+        manifest.save()
 
 
 def registerSubmitter(s):
@@ -310,11 +584,11 @@ def registerSubmitter(s):
 
 
 def loadSubmitters(folder, packageName):
+    from meshroom.core.submitter import BaseSubmitter
     return loadPlugins(folder, packageName, BaseSubmitter)
 
 
 def loadPipelineTemplates(folder):
-    global pipelineTemplates
     for file in os.listdir(folder):
         if file.endswith(".mg") and file not in pipelineTemplates:
             pipelineTemplates[os.path.splitext(file)[0]] = os.path.join(folder, file)
@@ -329,14 +603,20 @@ additionalNodesPath = [i for i in additionalNodesPath if i]
 # - Nodes
 nodesFolders = [os.path.join(meshroomFolder, 'nodes')] + additionalNodesPath
 
-for f in nodesFolders:
-    loadAllNodes(folder=f)
+with loadingStep('nodes'):
+    for f in nodesFolders:
+        loadAllNodes(folder=f)
+
 
-# - Submitters
-subs = loadSubmitters(os.environ.get("MESHROOM_SUBMITTERS_PATH", meshroomFolder), 'submitters')
+# - Submitters: loaded on first access
+def _loadAllSubmitters():
+    with loadingStep('submitters'):
+        subs = loadSubmitters(os.environ.get("MESHROOM_SUBMITTERS_PATH", meshroomFolder), 'submitters')
+        for sub in subs:
+            registerSubmitter(sub())
 
-for sub in subs:
-    registerSubmitter(sub())
+
+submitters = LazyRegistry(_loadAllSubmitters)
 
 # Load pipeline templates: check in the default folder and any folder the user might have
 # added to the environment variable
@@ -344,5 +624,13 @@ additionalPipelinesPath = os.environ.get("MESHROOM_PIPELINE_TEMPLATES_PATH", "")
 additionalPipelinesPath = [i for i in additionalPipelinesPath if i]
 pipelineTemplatesFolders = [os.path.join(meshroomFolder, 'pipelines')] + additionalPipelinesPath
 
-for f in pipelineTemplatesFolders:
-    loadPipelineTemplates(f)
+
+def _loadAllPipelineTemplates():
+    with loadingStep('pipelineTemplates'):
+        for f in pipelineTemplatesFolders:
+            loadPipelineTemplates(f)
+
+
+pipelineTemplates = LazyRegistry(_loadAllPipelineTemplates)
+
+loadingTimes['meshroom.core'] = time.time() - _moduleStartTime
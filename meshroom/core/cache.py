@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Filesystem operations on Meshroom cache folders.
+"""
+import io
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+import time
+
+from meshroom.core import hashValue, stats
+from meshroom.core.node import getWritingFilepath, renameWritingToFinalPath
+
+# Text files written in the cache that may embed absolute cache paths
+relocatableFileExtensions = ('.sfm', '.json', '.txt', '.mtl', '.cal', '.status')
+# Files without extension holding paths
+relocatableFileNames = ('status',)
+# Do not rewrite text files bigger than this size (in bytes)
+relocatableFileMaxSize = 256 * 1024 * 1024
+
+
+def _pathVariants(path):
+    """ Return the different textual representations of a path that can be found in cache files. """
+    path = path.rstrip("/\\")
+    variants = set([path, path.replace("\\", "/"), os.path.normpath(path)])
+    # paths serialized in json files have escaped backslashes
+    variants.update([json.dumps(v)[1:-1] for v in list(variants)])
+    # replace longest variants first
+    return sorted(variants, key=len, reverse=True)
+
+
+# A cache path only matches as a whole path component: not "/a/cache" in "/a/cache2"
+_pathEndPattern = r'(?=[/\\\s"\'<>,;)\]}]|$)'
+
+
+def isRelocatableFile(filepath):
+    """ Whether the given cache file is a known text file that may contain cache paths. """
+    filename = os.path.basename(filepath)
+    return filename in relocatableFileNames or os.path.splitext(filename)[1] in relocatableFileExtensions
+
+
+def rewriteCachePaths(cacheDir, oldCacheDir):
+    """
+    Replace 'oldCacheDir' by 'cacheDir' in status files and known text outputs of the given cache folder.
+
+    Files are rewritten atomically and keep their modification time,
+    so that they are not considered as newer than the files that depend on them.
+
+    Args:
+        cacheDir (str): the current cache folder to process
+        oldCacheDir (str): the previous location of this cache folder
+
+    Returns:
+        int: the number of rewritten files
+    """
+    newPath = cacheDir.rstrip("/\\")
+    replacements = [(re.compile(re.escape(v) + _pathEndPattern, re.MULTILINE),
+                     json.dumps(newPath)[1:-1] if "\\\\" in v else newPath) for v in _pathVariants(oldCacheDir)]
+    nbRewrittenFiles = 0
+    # follow links to include node folders stored on other volumes (see CacheLayout)
+    for root, dirs, files in os.walk(cacheDir, followlinks=True):
+        for filename in files:
+            filepath = os.path.join(root, filename)
+            if not isRelocatableFile(filepath) or os.path.getsize(filepath) > relocatableFileMaxSize:
+                continue
+            try:
+                with io.open(filepath, "r", encoding="utf-8") as f:
+                    content = f.read()
+            except (UnicodeDecodeError, IOError, OSError):
+                # binary or unreadable file
+                continue
+            newContent = content
+            for oldPattern, newValue in replacements:
+                newContent = oldPattern.sub(lambda m: newValue, newContent)
+            if newContent == content:
+                continue
+            stat = os.stat(filepath)
+            writingFilepath = getWritingFilepath(filepath)
+            with io.open(writingFilepath, "w", encoding="utf-8") as f:
+                f.write(newContent)
+            if hasattr(stat, 'st_mtime_ns'):
+                os.utime(writingFilepath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            else:
+                # python 2: microsecond precision
+                os.utime(writingFilepath, (stat.st_atime, stat.st_mtime))
+            renameWritingToFinalPath(writingFilepath, filepath)
+            nbRewrittenFiles += 1
+    logging.info("Cache paths updated from '{}' to '{}' in {} file(s).".format(oldCacheDir, cacheDir, nbRewrittenFiles))
+    return nbRewrittenFiles
+
+
+def relocateCache(srcCacheDir, dstCacheDir, move=True, link=False):
+    """
+    Relocate a cache folder and update the cache paths embedded in its files.
+
+    Node uids do not depend on the cache folder, so computed nodes are still
+    considered as computed once their graph uses the new cache folder.
+
+    Args:
+        srcCacheDir (str): the current cache folder
+        dstCacheDir (str): the new cache folder
+        move (bool): whether to move the data; if False, data is expected to be already
+                     available in 'dstCacheDir' (e.g. copied by an external tool) and only paths are updated
+        link (bool): whether to leave a symbolic link to the new location in place of the source folder
+
+    Returns:
+        int: the number of rewritten files
+    """
+    srcCacheDir = os.path.abspath(srcCacheDir)
+    dstCacheDir = os.path.abspath(dstCacheDir)
+    if srcCacheDir == dstCacheDir:
+        return 0
+    if move:
+        if not os.path.isdir(srcCacheDir):
+            raise RuntimeError("Cache folder does not exist: '{}'.".format(srcCacheDir))
+        if os.path.exists(dstCacheDir):
+            if not os.path.isdir(dstCacheDir) or os.listdir(dstCacheDir):
+                raise RuntimeError("Destination cache folder is not empty: '{}'.".format(dstCacheDir))
+            os.rmdir(dstCacheDir)
+        parentFolder = os.path.dirname(dstCacheDir)
+        if not os.path.exists(parentFolder):
+            os.makedirs(parentFolder)
+        logging.info("Move cache folder '{}' to '{}'.".format(srcCacheDir, dstCacheDir))
+        shutil.move(srcCacheDir, dstCacheDir)
+    elif not os.path.isdir(dstCacheDir):
+        raise RuntimeError("Cache folder does not exist: '{}'.".format(dstCacheDir))
+
+    nbRewrittenFiles = rewriteCachePaths(dstCacheDir, srcCacheDir)
+
+    if link and not os.path.exists(srcCacheDir):
+        os.symlink(dstCacheDir, srcCacheDir)
+    return nbRewrittenFiles
+
+
+def folderSize(folder):
+    """ Return the total size in bytes of the files in 'folder'. """
+    size = 0
+    for root, dirs, files in os.walk(folder):
+        for filename in files:
+            try:
+                size += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return size
+
+
+class CacheLayout(object):
+    """
+    Distribute node internal folders over several volumes.
+
+    The internal folder of a node ('{cache}/{nodeType}/{uid0}') is created as a symbolic link
+    to a folder on one of the volumes, so that output paths based on '{cache}' stay unchanged.
+    The volume is selected with a rendezvous hashing on the node uid weighted by the free space
+    remaining on each volume after writing the predicted output size of the node (from the
+    output sizes of previous computations of the same node type).
+    The mapping is stable: existing folders are reused and the selected volume is saved in
+    the cache folder, to restore a lost link instead of recomputing the node.
+    """
+    layoutFilename = 'cacheLayout.json'
+    outputSizeKey = 'outputSize'
+
+    def __init__(self, volumes, history=None):
+        self.volumes = [os.path.abspath(v) for v in volumes]
+        self.history = history or stats.nodeTypesHistory
+        self._lock = threading.Lock()
+        # mapping of each cache folder, with the modification time of its file
+        self._mappings = {}
+
+    @property
+    def enabled(self):
+        return bool(self.volumes)
+
+    @staticmethod
+    def _freeSpace(volume):
+        try:
+            if hasattr(shutil, 'disk_usage'):
+                return shutil.disk_usage(volume).free
+            # python 2
+            st = os.statvfs(volume)
+            return st.f_bavail * st.f_frsize
+        except OSError:
+            return 0
+
+    def predictedOutputSize(self, nodeType):
+        """ Return the expected size in bytes of the outputs of a node of the given type. """
+        return self.history.getValue(nodeType, self.outputSizeKey, 0)
+
+    def selectVolume(self, key, predictedSize=0):
+        """
+        Select the volume for the given key (node folder identifier).
+
+        Args:
+            key (str): stable identifier of the node folder ("{nodeType}/{uid0}")
+            predictedSize (int): the expected size in bytes of the data to write
+
+        Returns:
+            str: the selected volume
+        """
+        bestVolume, bestScore = None, None
+        for volume in self.volumes:
+            remainingSpace = self._freeSpace(volume) - predictedSize
+            if remainingSpace <= 0:
+                continue
+            # uniform hash value in ]0, 1[
+            h = (int(hashValue(key + volume)[:8], 16) + 1) / float(0xffffffff + 2)
+            score = -remainingSpace / math.log(h)
+            if bestScore is None or score > bestScore:
+                bestVolume, bestScore = volume, score
+        if bestVolume is None:
+            # no volume with enough space: fallback on the largest free space
+            bestVolume = max(self.volumes, key=self._freeSpace)
+        return bestVolume
+
+    def _layoutFilepath(self, cacheDir):
+        return os.path.join(cacheDir, self.layoutFilename)
+
+    def _loadMapping(self, cacheDir):
+        filepath = self._layoutFilepath(cacheDir)
+        try:
+            mtime = os.path.getmtime(filepath)
+        except OSError:
+            return {}
+        cached = self._mappings.get(cacheDir)
+        if cached and cached[0] == mtime:
+            return dict(cached[1])
+        try:
+            with open(filepath, 'r') as jsonFile:
+                mapping = json.load(jsonFile)
+        except Exception as e:
+            logging.warning('Failed to load cache layout "{}": {}'.format(filepath, str(e)))
+            return {}
+        self._mappings[cacheDir] = (mtime, mapping)
+        return dict(mapping)
+
+    def _saveMapping(self, cacheDir, mapping):
+        filepath = self._layoutFilepath(cacheDir)
+        writingFilepath = getWritingFilepath(filepath)
+        with open(writingFilepath, 'w') as jsonFile:
+            json.dump(mapping, jsonFile, indent=4)
+        renameWritingToFinalPath(writingFilepath, filepath)
+
+    @staticmethod
+    def _nodeKey(node):
+        return '/'.join([node.nodeType, node._uids.get(0, '')])
+
+    @staticmethod
+    def _link(folder, target):
+        parentFolder = os.path.dirname(folder)
+        if not os.path.exists(parentFolder):
+            os.makedirs(parentFolder)
+        if os.path.lexists(folder):
+            # broken link
+            os.remove(folder)
+        os.symlink(target, folder)
+
+    def restoreNodeFolder(self, node):
+        """
+        Restore the lost link of the internal folder of the given node to its data, if any.
+
+        Returns:
+            str: the folder where the node data is stored, None if unknown
+        """
+        folder = node.internalFolder.rstrip('/\\')
+        if os.path.exists(folder):
+            return os.path.realpath(folder)
+        with self._lock:
+            target = self._loadMapping(node.graph.cacheDir).get(self._nodeKey(node))
+            if not target or not os.path.isdir(target):
+                return None
+            self._link(folder, target)
+            logging.info('Node folder "{}" restored from "{}".'.format(folder, target))
+            return target
+
+    def createNodeFolder(self, node):
+        """
+        Create the internal folder of the given node on its volume.
+
+        Returns:
+            str: the folder where the node data is stored
+        """
+        folder = node.internalFolder.rstrip('/\\')
+        cacheDir = node.graph.cacheDir
+        key = self._nodeKey(node)
+        with self._lock:
+            if os.path.exists(folder):
+                return os.path.realpath(folder)
+            mapping = self._loadMapping(cacheDir)
+            target = mapping.get(key)
+            if not target or not os.path.isdir(target):
+                volume = self.selectVolume(key, self.predictedOutputSize(node.nodeType))
+                # separate projects on a shared volume
+                target = os.path.join(volume, hashValue(cacheDir)[:12], node.nodeType, node._uids.get(0, ''))
+            if not os.path.exists(target):
+                os.makedirs(target)
+            self._link(folder, target)
+            mapping[key] = target
+            self._saveMapping(cacheDir, mapping)
+            logging.debug('Node folder "{}" stored in "{}".'.format(folder, target))
+            return target
+
+    def recordOutputSize(self, node):
+        """ Add the size of the given computed node outputs to its node type history. """
+        self.history.addValue(node.nodeType, self.outputSizeKey, folderSize(node.internalFolder))
+
+
+cacheLayout = CacheLayout([v for v in os.environ.get('MESHROOM_CACHE_VOLUMES', '').split(os.pathsep) if v])
+
+
+# Archive of the data of a node, left in place of its internal folder content
+archiveFilename = 'archive.tar.gz'
+# Files kept out of node archives, used to display node status without restoring the data
+archiveKeptFiles = re.compile(r'^(\d+\.)?(status|statistics|log)$')
+
+
+def _isArchiveKeptFile(filename):
+    return filename == archiveFilename or bool(archiveKeptFiles.match(filename))
+
+
+def archiveFilepath(node):
+    return os.path.join(node.internalFolder, archiveFilename)
+
+
+def isArchived(node):
+    """ Whether the data of the given node is packed in an archive. """
+    return os.path.exists(archiveFilepath(node))
+
+
+def archiveNode(node):
+    """
+    Pack the content of the given computed node internal folder in a single compressed archive.
+
+    Status, statistics and log files are kept aside, so the node is still reported as computed.
+    Its data is restored on demand with restoreNode().
+
+    Returns:
+        bool: whether the node has been archived
+    """
+    if not node.isComputed:
+        raise RuntimeError('Node "{}" is not computed and cannot be archived.'.format(node.name))
+    folder = node.internalFolder
+    if isArchived(node):
+        return False
+    filepath = archiveFilepath(node)
+    writingFilepath = getWritingFilepath(filepath)
+    archivedPaths = []
+    import tarfile
+    with tarfile.open(writingFilepath, 'w:gz') as archive:
+        for entry in sorted(os.listdir(folder)):
+            if _isArchiveKeptFile(entry) or entry == os.path.basename(writingFilepath):
+                continue
+            archive.add(os.path.join(folder, entry), arcname=entry)
+            archivedPaths.append(os.path.join(folder, entry))
+    renameWritingToFinalPath(writingFilepath, filepath)
+    for path in archivedPaths:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    logging.info('Node "{}" archived ({} entries, {}).'.format(node.name, len(archivedPaths),
+                                                               stats.bytes2human(os.path.getsize(filepath))))
+    return True
+
+
+def restoreNode(node, timeout=3600):
+    """
+    Unpack the archived data of the given node in its internal folder.
+
+    The archive is renamed before extraction, so that a single process restores it;
+    other processes wait for the end of the extraction.
+
+    Returns:
+        bool: whether the node data has been restored by this call
+    """
+    filepath = archiveFilepath(node)
+    restoringFilepath = filepath + '.restoring'
+    try:
+        os.rename(filepath, restoringFilepath)
+    except OSError:
+        # not archived, or already being restored by another process
+        startTime = time.time()
+        while os.path.exists(restoringFilepath):
+            if time.time() - startTime > timeout:
+                raise RuntimeError('Timeout while waiting for the restoration of node "{}".'.format(node.name))
+            time.sleep(0.5)
+        return False
+    import tarfile
+    try:
+        with tarfile.open(restoringFilepath, 'r:gz') as archive:
+            archive.extractall(node.internalFolder)
+    except Exception:
+        # leave the archive in place for a next attempt
+        os.rename(restoringFilepath, filepath)
+        raise
+    os.remove(restoringFilepath)
+    logging.info('Node "{}" restored from archive.'.format(node.name))
+    return True
+
+
+def restoreNodes(nodes, nbThreads=4):
+    """
+    Restore the archived data of the given nodes in parallel.
+
+    Returns:
+        list: the restored nodes
+    """
+    nodes = [node for node in nodes if isArchived(node)]
+    if not nodes:
+        return []
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(nbThreads, len(nodes)))
+    try:
+        restored = pool.map(restoreNode, nodes)
+    finally:
+        pool.close()
+        pool.join()
+    return [node for node, r in zip(nodes, restored) if r]
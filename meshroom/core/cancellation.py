@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Cancellation of the processes of running chunks.
+
+The process tree of a chunk is first asked to terminate (SIGTERM), so that processes can release their
+resources (GPU, temporary files...). Processes still alive after a grace period are killed (SIGKILL),
+and all of them are waited for, so that no process keeps holding memory or devices. Orphaned descendants
+are reaped by the system (they are only zombies, holding no resources, until then).
+Cancellation runs in a background thread, so that the caller (e.g. the UI thread) gets control back
+immediately.
+"""
+import logging
+import os
+import threading
+
+from meshroom.core.lazyImport import psutil
+
+# Time (in seconds) given to processes to terminate before being killed
+gracePeriod = float(os.environ.get('MESHROOM_STOP_GRACE_PERIOD', '10'))
+
+
+def processTree(process):
+    """ Return the process and all its descendants (descendants first). """
+    try:
+        return process.children(recursive=True) + [process]
+    except psutil.NoSuchProcess:
+        return []
+
+
+def terminateProcessTree(process, timeout=None):
+    """
+    Terminate a process and all its descendants, killing those still alive after 'timeout' seconds.
+
+    Returns:
+        list of psutil.Process: the processes that had to be killed
+    """
+    timeout = gracePeriod if timeout is None else timeout
+    processes = processTree(process)
+    for p in processes:
+        try:
+            p.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    gone, alive = psutil.wait_procs(processes, timeout=timeout)
+    # descendants started while terminating
+    alive.extend(p for p in processTree(process) if p not in processes)
+    for p in alive:
+        try:
+            p.kill()
+        except psutil.NoSuchProcess:
+            pass
+    gone, stillAlive = psutil.wait_procs(alive, timeout=timeout)
+    for p in stillAlive:
+        if isAlive(p):
+            logging.warning('Process {} could not be killed.'.format(p.pid))
+    return alive
+
+
+def isAlive(process):
+    """ Whether a process is running, zombies (dead processes not reaped by their parent yet) excluded. """
+    try:
+        return process.is_running() and process.status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+
+def cancelProcessTree(process, timeout=None):
+    """
+    Terminate a process tree (see terminateProcessTree) in a background thread.
+
+    Returns:
+        threading.Thread: the thread terminating the processes
+    """
+    thread = threading.Thread(target=terminateProcessTree, args=(process, timeout))
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Allocation of disjoint CPU core sets to the chunks computed concurrently on a host.
+
+Each process computing a chunk reserves cores by holding an exclusive lock on one file per core
+in a host-local folder. Locks are released when the chunk ends, or automatically by the system
+if the process dies, so concurrent meshroom_compute processes (local farm, workers...) share the
+cores of the host without any server. Cores are taken in a single NUMA node when possible.
+
+The chunk process is pinned to its cores and its thread pools (OpenMP, BLAS...) are sized accordingly.
+Pinning is done by running the command with taskset, or by the parent process once the command is started
+if taskset is not available: no Python code runs in the forked child of the (multithreaded) parent.
+"""
+import glob
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+
+import meshroom
+from meshroom.core.desc import Level
+from meshroom.core.lazyImport import psutil
+
+# Host-local folder of the core lock files
+coresFolder = os.environ.get('MESHROOM_CORES_FOLDER', os.path.join(tempfile.gettempdir(), 'meshroom_cores'))
+
+# Fraction of the host cores allocated to a chunk, depending on its node cpu level.
+# Intensive chunks get half of the cores, so that two of them run concurrently on disjoint cores.
+# A chunk gets fewer cores if not enough cores are free (see CoreAllocator.allocate).
+levelCores = {Level.NONE: 0.0, Level.NORMAL: 0.25, Level.INTENSIVE: 0.5}
+
+# Environment variables setting the number of threads of the common thread pools
+threadsEnvVars = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+def _parseCpuList(text):
+    """ Parse a Linux cpu list ("0-3,8,10-11"). """
+    cores = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        bounds = part.split('-')
+        cores.extend(range(int(bounds[0]), int(bounds[-1]) + 1))
+    return cores
+
+
+def availableCores():
+    """ Return the cores this process is allowed to run on. """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    try:
+        return sorted(psutil.Process().cpu_affinity())
+    except Exception:
+        return list(range(multiprocessing.cpu_count()))
+
+
+def numaNodes(cores=None):
+    """ Return the available cores grouped by NUMA node (a single group if the topology is unknown). """
+    cores = cores if cores is not None else availableCores()
+    groups = []
+    for nodeFolder in sorted(glob.glob('/sys/devices/system/node/node[0-9]*'), key=lambda f: int(re.findall(r'\d+$', f)[0])):
+        try:
+            with open(os.path.join(nodeFolder, 'cpulist'), 'r') as f:
+                nodeCores = [c for c in _parseCpuList(f.read()) if c in cores]
+        except (IOError, OSError, ValueError):
+            continue
+        if nodeCores:
+            groups.append(nodeCores)
+    grouped = set(c for group in groups for c in group)
+    if not groups or grouped != set(cores):
+        return [list(cores)]
+    return groups
+
+
+# Paths of the executables found in the PATH (see _findExecutable)
+_executables = {}
+
+
+def _findExecutable(name):
+    """ Return the path of the executable 'name' found in the PATH, None if not found. The lookup is cached. """
+    if name not in _executables:
+        _executables[name] = None
+        for folder in os.environ.get('PATH', os.defpath).split(os.pathsep):
+            path = os.path.join(folder, name)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                _executables[name] = path
+                break
+    return _executables[name]
+
+
+def _tasksetExecutable():
+    """ Return the path of the taskset executable, None if not available. """
+    return _findExecutable('taskset')
+
+
+class CoreSet(object):
+    """ Cores reserved by this process, released with release(). """
+    def __init__(self, cores, lockFiles):
+        self.cores = cores
+        self._lockFiles = lockFiles
+
+    def __len__(self):
+        return len(self.cores)
+
+    def release(self):
+        for f in self._lockFiles:
+            f.close()
+        self._lockFiles = []
+
+    def environment(self, env):
+        """ Set the number of threads of the thread pools to the number of cores in 'env'. """
+        for var in threadsEnvVars:
+            env[var] = str(len(self.cores))
+        return env
+
+    def command(self, args):
+        """
+        Return the command 'args' run with taskset, pinned to the reserved cores before it starts.
+        The command is returned unchanged if taskset is not available (see pin).
+        """
+        taskset = _tasksetExecutable()
+        if not taskset:
+            return args
+        return [taskset, '-c', ','.join(str(c) for c in self.cores)] + list(args)
+
+    def pin(self, process):
+        """ Pin a process started without taskset to the reserved cores, from the parent process. """
+        if _tasksetExecutable():
+            return
+        try:
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(process.pid, self.cores)
+            else:
+                psutil.Process(process.pid).cpu_affinity(self.cores)
+        except (OSError, AttributeError, psutil.Error) as e:
+            logging.warning('Failed to pin process {} to cores {}: {}'.format(process.pid, self.cores, str(e)))
+
+
+class CoreAllocator(object):
+    """
+    Reserve disjoint sets of cores between the processes of a host.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+
+    def _tryLock(self, core):
+        import fcntl
+        f = open(os.path.join(self.folder, '{}.lock'.format(core)), 'a')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            f.close()
+            return None
+        return f
+
+    def allocate(self, nbCores):
+        """
+        Reserve up to 'nbCores' free cores, in a single NUMA node when possible.
+
+        Returns:
+            CoreSet: the reserved cores, None if no core is free
+        """
+        if not os.path.exists(self.folder):
+            try:
+                os.makedirs(self.folder)
+            except OSError:
+                pass
+        groups = numaNodes()
+        # prefer the node with enough free cores (or with the most free cores)
+        candidates = []
+        for group in groups:
+            locks = []
+            for core in group:
+                if len(locks) == nbCores:
+                    break
+                f = self._tryLock(core)
+                if f:
+                    locks.append((core, f))
+            candidates.append(locks)
+        candidates.sort(key=len, reverse=True)
+        selected = candidates[0] if candidates else []
+        # span several nodes if no single node has enough free cores
+        for locks in candidates[1:]:
+            for core, f in locks:
+                if len(selected) < nbCores:
+                    selected.append((core, f))
+                else:
+                    f.close()
+        if not selected:
+            return None
+        return CoreSet([core for core, _ in selected], [f for _, f in selected])
+
+
+def chunkCores(chunk):
+    """
+    Reserve the cores of a chunk process, depending on its node cpu level.
+
+    Returns:
+        CoreSet: the reserved cores, None if core allocation is disabled or no core is free
+    """
+    if not meshroom.useCoreAllocation or not hasattr(os, 'sched_setaffinity'):
+        return None
+    fraction = levelCores.get(chunk.node.nodeDesc.cpu, 0.0)
+    if not fraction:
+        return None
+    nbCores = max(1, int(round(fraction * len(availableCores()))))
+    coreSet = coreAllocator.allocate(nbCores)
+    if coreSet is None:
+        logging.warning('No free core for "{}": run without core allocation.'.format(chunk.name))
+    return coreSet
+
+
+coreAllocator = CoreAllocator(coresFolder)
@@ -1,13 +1,15 @@
 from meshroom.common import BaseObject, Property, Variant, VariantList, JSValue
 from meshroom.core import pyCompatibility
+from meshroom import strtobool
+from meshroom.core.lazyImport import psutil
 
 from enum import Enum  # available by default in python3. For python2: "pip install enum34"
 import math
 import os
-import psutil
+import re
 import ast
-import distutils.util
 import shlex
+import subprocess
 
 class Attribute(BaseObject):
     """
@@ -232,8 +234,8 @@ class BoolParam(Param):
     def validateValue(self, value):
         try:
             if isinstance(value, pyCompatibility.basestring):
-                # use distutils.util.strtobool to handle (1/0, true/false, on/off, y/n)
-                return bool(distutils.util.strtobool(value))
+                # use strtobool to handle (1/0, true/false, on/off, y/n)
+                return bool(strtobool(value))
             return bool(value)
         except:
             raise ValueError('BoolParam only supports bool value (param:{}, value:{}, type:{})'.format(self.name, value, type(value)))
@@ -477,6 +479,84 @@ class StaticNodeSize(object):
         return self._size
 
 
+class RetryPolicy(object):
+    """
+    Policy deciding whether a failed chunk is computed again and after which delay.
+
+    A failure is transient if the return code of the chunk process is one of 'transientReturnCodes'
+    or if one of 'transientLogPatterns' is found in the failure reason or at the end of the chunk log.
+    """
+    # size of the end of the log file searched for transient errors
+    logTailSize = 64 * 1024
+
+    def __init__(self, maxAttempts=None, backoff=10.0, backoffFactor=2.0, maxDelay=600.0,
+                 transientReturnCodes=(-9, 137),
+                 transientLogPatterns=(r'Stale file handle', r'Input/output error', r'Resource temporarily unavailable',
+                                       r'No space left on device', r'Memory limit exceeded', r'hung process killed')):
+        """
+        Args:
+            maxAttempts (int): maximum number of computations of a chunk, None to use MESHROOM_RETRY_MAX_ATTEMPTS
+            backoff (float): delay before the first retry, in seconds
+            backoffFactor (float): factor applied to the delay on each new retry
+            maxDelay (float): maximum delay between two attempts, in seconds
+            transientReturnCodes (tuple of int): process return codes of transient failures (killed by the system...)
+            transientLogPatterns (tuple of str): regular expressions matching transient errors
+        """
+        self.maxAttempts = maxAttempts
+        self.backoff = backoff
+        self.backoffFactor = backoffFactor
+        self.maxDelay = maxDelay
+        self.transientReturnCodes = transientReturnCodes
+        self.transientLogPatterns = [re.compile(p) for p in transientLogPatterns]
+
+    def getMaxAttempts(self):
+        if self.maxAttempts is not None:
+            return self.maxAttempts
+        return int(os.environ.get('MESHROOM_RETRY_MAX_ATTEMPTS', '1'))
+
+    def delay(self, attempt):
+        """ Return the delay (in seconds) before the attempt following 'attempt' (starting at 1). """
+        return min(self.maxDelay, self.backoff * self.backoffFactor ** (attempt - 1))
+
+    def _logTail(self, chunk):
+        try:
+            with open(chunk.logFile, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - self.logTailSize))
+                return f.read().decode('utf-8', 'replace')
+        except (IOError, OSError):
+            return ''
+
+    def isTransient(self, chunk):
+        """ Whether the failure of 'chunk' is transient and may succeed when computed again. """
+        status = chunk.status
+        if getattr(status, 'returnCode', None) in self.transientReturnCodes:
+            return True
+        texts = [status.statusReason, self._logTail(chunk)]
+        return any(pattern.search(text) for pattern in self.transientLogPatterns for text in texts if text)
+
+
+class ProgressPattern(object):
+    """
+    Regular expression extracting the progress of a chunk from the lines of its process output
+    (see meshroom.core.progress). Named groups of the expression:
+     - 'percent': the progress, in percent
+     - 'done' (and optionally 'total'): the number of processed items (out of 'total')
+    An expression without these groups counts one processed item per matching line.
+    """
+    def __init__(self, pattern, total=None):
+        """
+        Args:
+            pattern (str): the regular expression
+            total (int or function): the total number of items, or a function returning it from the chunk
+        """
+        self.regex = re.compile(pattern)
+        self.total = total
+
+    def getTotal(self, chunk):
+        return self.total(chunk) if callable(self.total) else self.total
+
+
 class Node(object):
     """
     """
@@ -484,6 +564,12 @@ class Node(object):
     cpu = Level.NORMAL
     gpu = Level.NONE
     ram = Level.NORMAL
+    # explicit limits of chunk processes: {'memory': bytes, 'cpus': float, 'runtime': seconds} (see meshroom.core.resourceLimits)
+    resourceLimits = None
+    # retry of chunks on transient failures
+    retryPolicy = RetryPolicy()
+    # patterns of the process output giving the progress of chunks, in addition to the textual progress bars
+    progressPatterns = []
     packageName = ''
     packageVersion = ''
     inputs = []
@@ -535,7 +621,7 @@ class CommandLineNode(Node):
     parallelization = None
     commandLineRange = ''
 
-    def buildCommandLine(self, chunk):
+    def buildCommandLine(self, chunk, cmdVars=None):
         cmdPrefix = ''
         # if rez available in env, we use it
         if 'REZ_ENV' in os.environ and chunk.node.packageVersion:
@@ -546,7 +632,7 @@ class CommandLineNode(Node):
         cmdSuffix = ''
         if chunk.node.isParallelized and chunk.node.size > 1:
             cmdSuffix = ' ' + self.commandLineRange.format(**chunk.range.toDict())
-        return cmdPrefix + chunk.node.nodeDesc.commandLine.format(**chunk.node._cmdVars) + cmdSuffix
+        return cmdPrefix + chunk.node.nodeDesc.commandLine.format(**(cmdVars or chunk.node._cmdVars)) + cmdSuffix
 
     def stopProcess(self, chunk):
         # the same node could exists several times in the graph and
@@ -554,42 +640,104 @@ class CommandLineNode(Node):
         if not hasattr(chunk, "subprocess"):
             return
         if chunk.subprocess:
-            # kill process tree
-            processes = chunk.subprocess.children(recursive=True) + [chunk.subprocess]
-            try:
-                for process in processes:
-                    process.terminate()
-            except psutil.NoSuchProcess:
-                pass
+            from meshroom.core.cancellation import cancelProcessTree
+            # terminate the process tree, then kill it after a grace period
+            cancelProcessTree(chunk.subprocess)
+
+    def _runProcess(self, chunk, cmd, logCapture, cores):
+        """
+        Run the command line of a chunk once, within its resource limits and under the watchdog.
+
+        Returns:
+            bool: whether the process has been killed by the watchdog
+        """
+        from meshroom.core import watchdog
+        from meshroom.core.resourceLimits import chunkLimiter
+        env = cores.environment(os.environ.copy()) if cores else None
+        limiter = chunkLimiter(chunk)
+        if limiter:
+            print(' - resourceLimits: {}'.format(limiter.limits))
+        args = shlex.split(cmd)
+
+        chunk.status.statusReason = ''
+        # no preexec_fn: limits and affinity are applied by this process, which may run other threads
+        chunk.subprocess = psutil.Popen(cores.command(args) if cores else args,
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+        if cores:
+            cores.pin(chunk.subprocess)
+        logCapture.read(chunk.subprocess.stdout)
+        if limiter:
+            limiter.attach(chunk.subprocess)
+            limiter.start(chunk.subprocess)
+        chunkWatchdog = None
+        if watchdog.inactivityTimeout:
+            chunkWatchdog = watchdog.ChunkWatchdog(chunk.name, chunk.subprocess, chunk.logFile, watchdog.inactivityTimeout)
+            chunkWatchdog.start()
+
+        # store process static info into the status file
+        # chunk.status.env = node.proc.environ()
+        # chunk.status.createTime = node.proc.create_time()
+
+        chunk.statThread.proc = chunk.subprocess
+        chunk.subprocess.wait()
+        logCapture.wait()
+
+        chunk.status.returnCode = chunk.subprocess.returncode
+        if limiter:
+            chunk.status.statusReason = limiter.finish(chunk.subprocess.returncode) or ''
+        if chunkWatchdog:
+            chunkWatchdog.stopRequest()
+            chunkWatchdog.join()
+            if chunkWatchdog.hung:
+                chunk.status.statusReason = chunkWatchdog.reason
+                return True
+        return False
 
     def processChunk(self, chunk):
+        from meshroom.core import watchdog
+        from meshroom.core.coreAllocator import chunkCores
+        from meshroom.core.logCapture import LogCapture
+        from meshroom.core.progress import ChunkProgress
+        from meshroom.core.scratch import chunkStaging
+        cores = chunkCores(chunk)
+        staging = chunkStaging(chunk)
         try:
-            with open(chunk.logFile, 'w') as logF:
-                cmd = self.buildCommandLine(chunk)
+            with LogCapture(chunk.logFile) as logCapture:
+                progress = ChunkProgress(chunk, self.progressPatterns)
+                logCapture.listeners.append(progress.feed)
+                cmd = self.buildCommandLine(chunk, staging.cmdVars() if staging else None)
                 chunk.status.commandLine = cmd
+                chunk.status.cores = cores.cores if cores else []
                 chunk.saveStatusFile()
                 print(' - commandLine: {}'.format(cmd))
                 print(' - logFile: {}'.format(chunk.logFile))
-                chunk.subprocess = psutil.Popen(shlex.split(cmd), stdout=logF, stderr=logF)
-
-                # store process static info into the status file
-                # chunk.status.env = node.proc.environ()
-                # chunk.status.createTime = node.proc.create_time()
-
-                chunk.statThread.proc = chunk.subprocess
-                stdout, stderr = chunk.subprocess.communicate()
-                chunk.subprocess.wait()
-
-                chunk.status.returnCode = chunk.subprocess.returncode
-
-            if chunk.subprocess.returncode != 0:
-                with open(chunk.logFile, 'r') as logF:
-                    logContent = ''.join(logF.readlines())
-                raise RuntimeError('Error on node "{}":\nLog:\n{}'.format(chunk.name, logContent))
+                if cores:
+                    print(' - cores: {}'.format(cores.cores))
+                if staging:
+                    print(' - scratch: {}'.format(staging.folder))
+                # restart the process if it hangs
+                for restart in range(watchdog.maxRestarts + 1):
+                    if restart:
+                        print(' - restart hung process ({}/{})'.format(restart, watchdog.maxRestarts))
+                        logCapture.write('\n[Meshroom] Restart hung process ({}/{})\n'.format(restart, watchdog.maxRestarts))
+                    if not self._runProcess(chunk, cmd, logCapture, cores):
+                        break
+                progress.publish(force=True)
+
+            if chunk.status.returnCode != 0 or chunk.status.statusReason:
+                logContent = logCapture.tailText()
+                reason = ' ({})'.format(chunk.status.statusReason) if chunk.status.statusReason else ''
+                raise RuntimeError('Error on node "{}"{}:\nLog:\n{}'.format(chunk.name, reason, logContent))
+            if staging:
+                staging.commitOutputs()
         except:
             raise
         finally:
             chunk.subprocess = None
+            if cores:
+                cores.release()
+            if staging:
+                staging.cleanup()
 
 
 # Test abstract node
@@ -15,8 +15,11 @@ import meshroom.core
 from meshroom.common import BaseObject, DictModel, Slot, Signal, Property
 from meshroom.core import Version, pyCompatibility
 from meshroom.core.attribute import Attribute, ListAttribute
+from meshroom.core.cache import relocateCache
 from meshroom.core.exception import StopGraphVisit, StopBranchVisit
-from meshroom.core.node import nodeFactory, Status, Node, CompatibilityNode
+from meshroom.core.node import nodeFactory, Status, Node, CompatibilityNode, runningProcesses, getWritingFilepath, \
+    renameWritingToFinalPath
+from meshroom.core.prefetch import inputsPrefetcher
 
 # Replace default encoder to support Enums
 
@@ -176,6 +179,8 @@ class Graph(BaseObject):
             ReleaseVersion = "releaseVersion"
             FileVersion = "fileVersion"
             Graph = "graph"
+            # cache folder of the project, when it is not the default one next to the project file
+            CacheFolder = "cacheFolder"
 
         class Features(Enum):
             """ File Features. """
@@ -240,8 +245,34 @@ class Graph(BaseObject):
         """ Get loaded file supported features based on its version. """
         return Graph.IO.getFeaturesForVersion(self.header.get(Graph.IO.Keys.FileVersion, "0.0"))
 
+    @staticmethod
+    def _linkedNodeNames(value):
+        """ Return the names of the nodes referenced by the link expressions in a serialized attribute value. """
+        if isinstance(value, dict):
+            return set().union(*[Graph._linkedNodeNames(v) for v in value.values()]) if value else set()
+        if isinstance(value, list):
+            return set().union(*[Graph._linkedNodeNames(v) for v in value]) if value else set()
+        if Attribute.isLinkExpression(value):
+            return {value[1:-1].split('.')[0]}
+        return set()
+
+    @staticmethod
+    def _ancestorsData(graphData, nodeNames):
+        """ Return the serialized data of the given nodes and their ancestors, from the link expressions of their inputs. """
+        toVisit = list(nodeNames)
+        data = {}
+        while toVisit:
+            nodeName = toVisit.pop()
+            if nodeName in data or nodeName not in graphData:
+                continue
+            nodeData = graphData[nodeName]
+            data[nodeName] = nodeData
+            if isinstance(nodeData, dict):
+                toVisit.extend(Graph._linkedNodeNames(nodeData.get("inputs", {})))
+        return data
+
     @Slot(str)
-    def load(self, filepath, setupProjectFile=True, importProject=False):
+    def load(self, filepath, setupProjectFile=True, importProject=False, nodeNames=None):
         """
         Load a meshroom graph ".mg" file.
 
@@ -249,6 +280,7 @@ class Graph(BaseObject):
             filepath: project filepath to load
             setupProjectFile: Store the reference to the project file and setup the cache directory.
                               If false, it only loads the graph of the project file as a template.
+            nodeNames: only load these nodes and their ancestors, which is enough to compute them.
         """
         if not importProject:
             self.clear()
@@ -265,6 +297,9 @@ class Graph(BaseObject):
         if not isinstance(graphData, dict):
             raise RuntimeError('loadGraph error: Graph is not a dict. File: {}'.format(filepath))
 
+        if nodeNames:
+            graphData = self._ancestorsData(graphData, nodeNames)
+
         self.header = fileData.get(Graph.IO.Keys.Header, {})
         nodesVersions = self.header.get(Graph.IO.Keys.NodesVersions, {})
 
@@ -985,6 +1020,35 @@ class Graph(BaseObject):
         self.dfs(visitor=visitor, startNodes=startNodes)
         return nodes, edges
 
+    def dfsFailedToProcess(self, startNodes=None):
+        """
+        Return the chunks to resubmit after a failed computation, in order to compute the given nodes.
+
+        Only chunks in Status.ERROR or Status.STOPPED are resubmitted, along with the chunks of the
+        downstream nodes that have not run yet. Computed, running and still pending chunks are excluded.
+
+        Args:
+            startNodes: list of starting nodes. Use all leaves if empty.
+
+        Returns:
+            tuple: the nodes and edges to process (see dfsToProcess) and the indices of the chunks
+                   to process per node name (None for all the chunks of a node)
+        """
+        nodes, edges = self.dfsToProcess(startNodes=startNodes)
+        failedStatuses = (Status.ERROR, Status.STOPPED)
+        notRunStatuses = (Status.NONE, Status.SUBMITTED) + failedStatuses
+        iterations = {}
+        for node in nodes:
+            # nodes are sorted in computation order: dependencies are already evaluated
+            dependsOnResubmitted = any(u is node and v.name in iterations for u, v in edges)
+            statuses = notRunStatuses if dependsOnResubmitted else failedStatuses
+            chunks = [chunk for chunk in node.chunks if chunk.status.status in statuses]
+            if chunks:
+                iterations[node.name] = None if len(chunks) == len(node.chunks) else [chunk.index for chunk in chunks]
+        nodes = [node for node in nodes if node.name in iterations]
+        edges = [(u, v) for u, v in edges if u.name in iterations and v.name in iterations]
+        return nodes, edges, iterations
+
     @Slot(Node, result=bool)
     def canCompute(self, node):
         """
@@ -1220,6 +1284,13 @@ class Graph(BaseObject):
         if path != self._filepath and setupProjectFile:
             self._setFilepath(path)
 
+        if meshroom.useGraphSnapshots and not template and path == self._filepath:
+            from meshroom.core.snapshot import saveSnapshot
+            try:
+                saveSnapshot(self)
+            except Exception as e:
+                logging.warning('Failed to save graph snapshot: {}'.format(str(e)))
+
     def getNonDefaultInputAttributes(self):
         """
         Instead of getting all the inputs attribute keys, only get the keys of
@@ -1268,9 +1339,15 @@ class Graph(BaseObject):
         #  * cache folder is located next to the graph file
         #  * graph name if the basename of the graph file
         self.name = os.path.splitext(os.path.basename(filepath))[0]
-        self.cacheDir = os.path.join(os.path.abspath(os.path.dirname(filepath)), meshroom.core.cacheFolderName)
+        # the cache folder may have been relocated (see relocateCache)
+        self.cacheDir = self.header.get(Graph.IO.Keys.CacheFolder) or self.defaultCacheDir(filepath)
         self.filepathChanged.emit()
 
+    @staticmethod
+    def defaultCacheDir(filepath):
+        """ Return the default cache folder of a project file, next to it. """
+        return os.path.join(os.path.abspath(os.path.dirname(filepath)), meshroom.core.cacheFolderName)
+
     def _unsetFilepath(self):
         self._filepath = ""
         self.name = ""
@@ -1292,6 +1369,48 @@ class Graph(BaseObject):
         for node in self._nodes:
             node.updateStatisticsFromCache()
 
+    def reconcileStatusFromOutputs(self, startNodes=None, nbThreads=8):
+        """
+        Restore the SUCCESS status of nodes without status whose outputs already exist on disk,
+        are complete and are not older than their inputs (e.g. after a loss of status files).
+
+        Outputs are checked in parallel. A node is only restored if all the nodes it depends on
+        are computed (or restored), so that outdated branches are still recomputed.
+
+        Args:
+            startNodes (list of Node): the nodes to reconcile with their dependencies (all graph nodes if None)
+            nbThreads (int): the number of threads used to check outputs on disk
+
+        Returns:
+            list of Node: the nodes that have been restored
+        """
+        nodes, _ = self.dfsOnFinish(startNodes=startNodes, dependenciesOnly=True)
+        candidates = [node for node in nodes if node.canReconcileStatus()]
+        if not candidates:
+            return []
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(max(1, min(nbThreads, len(candidates))))
+        try:
+            upToDate = dict(zip(candidates, pool.map(lambda n: n.outputsAreUpToDate(), candidates)))
+        finally:
+            pool.close()
+            pool.join()
+
+        restoredNodes = []
+        # nodes are ordered from roots to leaves, so dependencies are restored first
+        for node in candidates:
+            if not upToDate[node]:
+                continue
+            inputNodes = node.getInputNodes(recursive=False, dependenciesOnly=True)
+            if not all(n.hasStatus(Status.SUCCESS) for n in inputNodes):
+                continue
+            if node.reconcileStatus(checkOutputs=False):
+                restoredNodes.append(node)
+        logging.info("Status restored from existing outputs on {} node(s): {}".format(
+            len(restoredNodes), ", ".join(n.name for n in restoredNodes)))
+        return restoredNodes
+
     def updateNodesPerUid(self):
         """ Update the duplicate nodes (sharing same uid) list of each node. """
         # First step is to construct a map uid/nodes
@@ -1350,8 +1469,9 @@ class Graph(BaseObject):
 
     def stopExecution(self):
         """ Request graph execution to be stopped by terminating running chunks"""
-        for chunk in self.iterChunksByStatus(Status.RUNNING):
-            if not chunk.isExtern():
+        # only visit the chunks running in this process, not the whole graph
+        for chunk in list(runningProcesses.values()):
+            if chunk.node.graph is self and not chunk.isExtern():
                 chunk.stopProcess()
 
     @Slot()
@@ -1422,6 +1542,51 @@ class Graph(BaseObject):
         self.updateStatusFromCache(force=True)
         self.cacheDirChanged.emit()
 
+    def relocateCache(self, cacheDir, move=True, link=False, fromCacheDir=None):
+        """
+        Relocate the cache folder of this graph and use it as the new cache directory.
+
+        Args:
+            cacheDir (str): the new cache folder
+            move (bool): whether to move the current cache folder data to 'cacheDir',
+                         or only update paths of data already available in 'cacheDir'
+            link (bool): whether to leave a symbolic link to 'cacheDir' in place of the previous folder
+            fromCacheDir (str): (optional) the previous cache folder, if different from the current one
+                                (e.g. if the project has been moved with its cache)
+
+        Returns:
+            int: the number of files in which cache paths have been updated
+
+        See Also:
+            meshroom.core.cache.relocateCache
+        """
+        nbRewrittenFiles = relocateCache(fromCacheDir or self._cacheDir, cacheDir, move=move, link=link)
+        if os.path.abspath(cacheDir) == os.path.abspath(self._cacheDir):
+            # same cache folder: only reload status files
+            self.updateStatusFromCache(force=True)
+        else:
+            self.cacheDir = os.path.abspath(cacheDir)
+        if self._filepath:
+            # without a link, the project file records the new location to keep using it once reopened
+            if link or os.path.abspath(cacheDir) == self.defaultCacheDir(self._filepath):
+                self.header.pop(Graph.IO.Keys.CacheFolder, None)
+            else:
+                self.header[Graph.IO.Keys.CacheFolder] = self._cacheDir
+            self._saveHeader()
+        return nbRewrittenFiles
+
+    def _saveHeader(self):
+        """ Update the header of the project file, leaving the rest of the file unchanged. """
+        with open(self._filepath) as jsonFile:
+            data = json.load(jsonFile)
+        if data.get(Graph.IO.Keys.Header) == self.header:
+            return
+        data[Graph.IO.Keys.Header] = self.header
+        writingFilepath = getWritingFilepath(self._filepath)
+        with open(writingFilepath, 'w') as jsonFile:
+            json.dump(data, jsonFile, indent=4)
+        renameWritingToFinalPath(writingFilepath, self._filepath)
+
     def setVerbose(self, v):
         with GraphModification(self):
             for node in self._nodes:
@@ -1443,11 +1608,12 @@ class Graph(BaseObject):
     canComputeLeaves = Property(bool, lambda self: self._canComputeLeaves, notify=canComputeLeavesChanged)
 
 
-def loadGraph(filepath):
+def loadGraph(filepath, nodeNames=None):
     """
+    Load a graph from a ".mg" file, restricted to the given nodes and their ancestors if 'nodeNames' is specified.
     """
     graph = Graph("")
-    graph.load(filepath)
+    graph.load(filepath, nodeNames=nodeNames)
     graph.update()
     return graph
 
@@ -1487,29 +1653,48 @@ def executeGraph(graph, toNodes=None, forceCompute=False, forceStatus=False):
     for node in nodes:
         node.beginSequence(forceCompute)
 
-    for n, node in enumerate(nodes):
-        try:
-            multiChunks = len(node.chunks) > 1
-            for c, chunk in enumerate(node.chunks):
-                if multiChunks:
-                    print('\n[{node}/{nbNodes}]({chunk}/{nbChunks}) {nodeName}'.format(
-                        node=n+1, nbNodes=len(nodes),
-                        chunk=c+1, nbChunks=len(node.chunks), nodeName=node.nodeType))
-                else:
-                    print('\n[{node}/{nbNodes}] {nodeName}'.format(
-                        node=n + 1, nbNodes=len(nodes), nodeName=node.nodeType))
-                chunk.process(forceCompute)
-        except Exception as e:
-            logging.error("Error on node computation: {}".format(e))
-            graph.clearSubmittedNodes()
-            raise
+    # chunks in execution order, to prefetch the inputs of the next one
+    plannedChunks = [chunk for node in nodes for chunk in node.chunks]
+    chunkIndex = 0
+
+    try:
+        for n, node in enumerate(nodes):
+            try:
+                multiChunks = len(node.chunks) > 1
+                for c, chunk in enumerate(node.chunks):
+                    if multiChunks:
+                        print('\n[{node}/{nbNodes}]({chunk}/{nbChunks}) {nodeName}'.format(
+                            node=n+1, nbNodes=len(nodes),
+                            chunk=c+1, nbChunks=len(node.chunks), nodeName=node.nodeType))
+                    else:
+                        print('\n[{node}/{nbNodes}] {nodeName}'.format(
+                            node=n + 1, nbNodes=len(nodes), nodeName=node.nodeType))
+                    chunkIndex += 1
+                    inputsPrefetcher.prefetch(plannedChunks[chunkIndex] if chunkIndex < len(plannedChunks) else None)
+                    chunk.process(forceCompute)
+            except Exception as e:
+                logging.error("Error on node computation: {}".format(e))
+                graph.clearSubmittedNodes()
+                raise
+    finally:
+        inputsPrefetcher.stop()
 
     for node in nodes:
         node.endSequence()
 
 
-def submitGraph(graph, submitter, toNodes=None):
-    nodesToProcess, edgesToProcess = graph.dfsToProcess(startNodes=toNodes)
+def submitGraph(graph, submitter, toNodes=None, failedOnly=False):
+    """
+    Submit the given graph via the given submitter.
+
+    Args:
+        failedOnly (bool): resubmit only the failed or stopped chunks and their downstream nodes
+    """
+    iterations = None
+    if failedOnly:
+        nodesToProcess, edgesToProcess, iterations = graph.dfsFailedToProcess(startNodes=toNodes)
+    else:
+        nodesToProcess, edgesToProcess = graph.dfsToProcess(startNodes=toNodes)
     flowEdges = graph.flowEdges(startNodes=toNodes)
     edgesToProcess = set(edgesToProcess).intersection(flowEdges)
 
@@ -1517,7 +1702,7 @@ def submitGraph(graph, submitter, toNodes=None):
         logging.warning('Nothing to compute')
         return
 
-    logging.info("Nodes to process: {}".format(edgesToProcess))
+    logging.info("Nodes to process: {}".format(nodesToProcess))
     logging.info("Edges to process: {}".format(edgesToProcess))
 
     sub = None
@@ -1525,25 +1710,27 @@ def submitGraph(graph, submitter, toNodes=None):
         sub = meshroom.core.submitters.get(submitter, None)
     elif len(meshroom.core.submitters) == 1:
         # if only one submitter available use it
-        sub = meshroom.core.submitters.values()[0]
+        sub = next(iter(meshroom.core.submitters.values()))
     if sub is None:
         raise RuntimeError("Unknown Submitter: '{submitter}'. Available submitters are: '{allSubmitters}'.".format(
             submitter=submitter, allSubmitters=str(meshroom.core.submitters.keys())))
 
     try:
-        res = sub.submit(nodesToProcess, edgesToProcess, graph.filepath)
+        if iterations is not None:
+            res = sub.submit(nodesToProcess, edgesToProcess, graph.filepath, iterations=iterations)
+        else:
+            res = sub.submit(nodesToProcess, edgesToProcess, graph.filepath)
         if res:
             for node in nodesToProcess:
-                node.submit()  # update node status
+                node.submit(iterations=iterations.get(node.name) if iterations else None)  # update node status
     except Exception as e:
         logging.error("Error on submit : {}".format(e))
 
 
-def submit(graphFile, submitter, toNode=None):
+def submit(graphFile, submitter, toNode=None, failedOnly=False):
     """
     Submit the given graph via the given submitter.
     """
     graph = loadGraph(graphFile)
     toNodes = graph.findNodes(toNode) if toNode else None
-    submitGraph(graph, submitter, toNodes)
-
+    submitGraph(graph, submitter, toNodes, failedOnly=failedOnly)
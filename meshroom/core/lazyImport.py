@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Modules imported on first use.
+
+Some modules are slow to import and only needed to compute nodes (e.g. psutil):
+they are not imported with meshroom.core, but on the first access to one of their attributes.
+"""
+import importlib
+
+
+class LazyModule(object):
+    """ Proxy to a module, imported on first attribute access. """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        # only called for the attributes of the module
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return "<lazy module '{}'>".format(self._name)
+
+
+psutil = LazyModule('psutil')
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Minimal render farm running on the local machine.
+
+A Job is a set of command line Tasks with dependencies. Submitted jobs are saved on disk
+and executed by a scheduler running in a detached process, so that they survive the
+application which submitted them. Tasks are run in parallel, within the resources of
+the local machine, and their processes are limited as the chunks they compute
+(see meshroom.core.resourceLimits).
+
+Run a saved job with:
+    python -c "import sys; from meshroom.core.localFarm import main; sys.exit(main(sys.argv[1:]))" JOB_FOLDER
+"""
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from enum import Enum
+
+import meshroom
+from meshroom.core.desc import Level
+from meshroom.core.lazyImport import psutil
+from meshroom.core.resourceLimits import ResourceLimits, processLimiter
+from meshroom.core.submitter import coalesceNodes
+
+# Folder where submitted jobs are saved
+jobsFolder = os.environ.get('MESHROOM_LOCALFARM_JOBS', os.path.join(os.path.expanduser('~'), '.meshroom', 'localFarm'))
+
+# Fraction of the local machine resources used by a task, depending on its node requirements
+levelRequirements = {
+    'cpu': {Level.NONE: 0.0, Level.NORMAL: 0.25, Level.INTENSIVE: 1.0},
+    'ram': {Level.NONE: 0.0, Level.NORMAL: 0.25, Level.INTENSIVE: 0.75},
+    'gpu': {Level.NONE: 0.0, Level.NORMAL: 1.0, Level.INTENSIVE: 1.0},
+}
+
+
+def nodeRequirements(nodeDesc):
+    """ Return the fraction of the local machine resources required by a task computing the given node type. """
+    return {
+        'cpu': levelRequirements['cpu'][nodeDesc.cpu],
+        'ram': levelRequirements['ram'][nodeDesc.ram],
+        'gpu': levelRequirements['gpu'][nodeDesc.gpu],
+    }
+
+
+def meshroomComputeCommand():
+    """ Return the command line to run meshroom_compute with the current installation. """
+    if meshroom.isFrozen:
+        return [os.path.join(os.path.dirname(sys.executable), 'meshroom_compute')]
+    rootFolder = os.path.dirname(os.path.dirname(os.path.abspath(meshroom.__file__)))
+    return [sys.executable, os.path.join(rootFolder, 'bin', 'meshroom_compute')]
+
+
+def computeChunkCommand(graphFile, node, iteration=-1):
+    """ Return the command line computing a node (or one of its chunks) of a saved graph, as a farm task would. """
+    cmd = meshroomComputeCommand() + [graphFile, '--node', node.name, '--extern']
+    if iteration >= 0:
+        cmd += ['--iteration', str(iteration)]
+    return cmd
+
+
+def computeNodesCommand(graphFile, nodes):
+    """ Return the command line computing several nodes of a saved graph back to back. """
+    cmd = meshroomComputeCommand() + [graphFile, '--extern']
+    for node in nodes:
+        cmd += ['--node', node.name]
+    return cmd
+
+
+def createGraphJob(nodes, edges, graphFile, folder=None, iterations=None):
+    """
+    Create a job computing the given nodes of a saved graph.
+
+    Parallelized nodes are split in one task per chunk,
+    chains of cheap nodes are grouped in a single task (see meshroom.core.submitter.coalesceNodes).
+
+    Args:
+        nodes (list): the nodes to compute
+        edges (list): the (node, dependency) pairs between the nodes to compute
+        graphFile (str): the filepath of the saved graph
+        folder (str): the job folder
+        iterations (dict): indices of the chunks to compute per node name, None to compute all chunks
+
+    Returns:
+        Job: the job
+    """
+    name = os.path.splitext(os.path.basename(graphFile))[0] + ' [Meshroom]'
+    job = Job(name, folder=folder)
+    nodeNameToTasks = {}
+    iterations = iterations or {}
+    # only coalesce nodes computed entirely
+    groups = coalesceNodes(nodes, edges) if not any(iterations.values()) else [[node] for node in nodes]
+    for group in groups:
+        node = group[0]
+        requirements = nodeRequirements(node.nodeDesc)
+        limits = ResourceLimits.fromNodeDesc(node.nodeDesc)
+        chunkIndices = iterations.get(node.name)
+        if len(group) > 1:
+            requirements = {key: max(nodeRequirements(n.nodeDesc)[key] for n in group) for key in requirements}
+            limits = ResourceLimits.combine([ResourceLimits.fromNodeDesc(n.nodeDesc) for n in group])
+            tasks = [Task('_'.join(n.name for n in group), computeNodesCommand(graphFile, group),
+                          requirements=requirements, limits=limits)]
+        elif node.isParallelized:
+            tasks = [Task('{}_{}'.format(node.name, chunk.index),
+                          computeChunkCommand(graphFile, node, chunk.index),
+                          requirements=requirements, limits=limits)
+                     for chunk in node.chunks if chunkIndices is None or chunk.index in chunkIndices]
+        else:
+            tasks = [Task(node.name, computeChunkCommand(graphFile, node), requirements=requirements, limits=limits)]
+        for task in tasks:
+            job.addTask(task)
+        for n in group:
+            nodeNameToTasks[n.name] = tasks
+
+    for u, v in edges:
+        for task in nodeNameToTasks[u.name]:
+            for dependency in nodeNameToTasks[v.name]:
+                if dependency is not task:
+                    task.dependsOn(dependency)
+    return job
+
+
+# Python code running the scheduler of a saved job
+schedulerCode = 'import sys; from meshroom.core.localFarm import main; sys.exit(main(sys.argv[1:]))'
+
+
+class TaskStatus(Enum):
+    WAITING = 0
+    RUNNING = 1
+    SUCCESS = 2
+    ERROR = 3
+    CANCELED = 4
+
+
+class Task(object):
+    """
+    A command line to execute once its dependencies are successfully executed.
+
+    The 'requirements' (fractions of the local resources) decide when the task can start,
+    the 'limits' (ResourceLimits) are enforced on its process.
+    """
+    def __init__(self, name, command, dependencies=None, requirements=None, limits=None):
+        self.name = name
+        self.command = command
+        self.dependencies = list(dependencies or [])
+        self.requirements = requirements or {}
+        self.limits = limits or ResourceLimits()
+        self.status = TaskStatus.WAITING
+        self.returnCode = None
+        self.statusReason = ''
+        self.process = None
+        self.limiter = None
+
+    def dependsOn(self, task):
+        if task.name not in self.dependencies:
+            self.dependencies.append(task.name)
+
+    def toDict(self):
+        return {
+            'name': self.name,
+            'command': self.command,
+            'dependencies': self.dependencies,
+            'requirements': self.requirements,
+            'limits': self.limits.toDict(),
+            'status': self.status.name,
+            'returnCode': self.returnCode,
+            'statusReason': self.statusReason,
+        }
+
+    @classmethod
+    def fromDict(cls, d):
+        task = cls(d['name'], d['command'], d.get('dependencies'), d.get('requirements'),
+                   ResourceLimits.fromDict(d['limits']) if d.get('limits') else None)
+        task.status = TaskStatus[d.get('status', TaskStatus.WAITING.name)]
+        task.returnCode = d.get('returnCode')
+        task.statusReason = d.get('statusReason', '')
+        return task
+
+
+class Job(object):
+    """
+    A set of tasks, saved in its own folder.
+    """
+    jobFilename = 'job.json'
+
+    def __init__(self, name, folder=None, environment=None):
+        self.name = name
+        self.folder = folder or os.path.join(jobsFolder, '{}_{}'.format(time.strftime('%Y%m%d_%H%M%S'), uuid.uuid4().hex[:8]))
+        self.environment = environment or {}
+        self.tasks = []
+
+    @property
+    def filepath(self):
+        return os.path.join(self.folder, self.jobFilename)
+
+    def addTask(self, task):
+        self.tasks.append(task)
+        return task
+
+    def task(self, name):
+        return next((t for t in self.tasks if t.name == name), None)
+
+    def taskLogFile(self, task):
+        return os.path.join(self.folder, '{}.log'.format(task.name))
+
+    def toDict(self):
+        return {
+            'name': self.name,
+            'environment': self.environment,
+            'tasks': [task.toDict() for task in self.tasks],
+        }
+
+    def save(self):
+        from meshroom.core.node import getWritingFilepath, renameWritingToFinalPath
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        writingFilepath = getWritingFilepath(self.filepath)
+        with open(writingFilepath, 'w') as jsonFile:
+            json.dump(self.toDict(), jsonFile, indent=4)
+        renameWritingToFinalPath(writingFilepath, self.filepath)
+
+    @classmethod
+    def load(cls, folder):
+        with open(os.path.join(folder, cls.jobFilename), 'r') as jsonFile:
+            d = json.load(jsonFile)
+        job = cls(d['name'], folder=folder, environment=d.get('environment'))
+        job.tasks = [Task.fromDict(t) for t in d.get('tasks', [])]
+        return job
+
+    def submit(self):
+        """
+        Save the job and start its execution in a detached process.
+
+        Returns:
+            int: the pid of the scheduler process
+        """
+        self.save()
+        env = os.environ.copy()
+        # make this meshroom package importable by the scheduler
+        rootFolder = os.path.dirname(os.path.dirname(os.path.abspath(meshroom.__file__)))
+        env['PYTHONPATH'] = os.pathsep.join([p for p in [rootFolder, env.get('PYTHONPATH')] if p])
+        kwargs = {}
+        if sys.platform == 'win32':
+            # DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP
+            kwargs['creationflags'] = 0x00000008 | 0x00000200
+        else:
+            kwargs['preexec_fn'] = os.setsid
+        with open(os.path.join(self.folder, 'scheduler.log'), 'a') as logFile:
+            process = subprocess.Popen([sys.executable, '-c', schedulerCode, self.folder],
+                                       stdin=subprocess.PIPE if sys.version_info[0] < 3 else subprocess.DEVNULL,
+                                       stdout=logFile, stderr=subprocess.STDOUT, env=env, close_fds=True, **kwargs)
+        logging.info('Job "{}" submitted to local farm: {}'.format(self.name, self.folder))
+        return process.pid
+
+
+class Scheduler(object):
+    """
+    Execute the tasks of a job in parallel, in dependency order and within the local resources.
+    """
+    pollInterval = 0.5
+
+    def __init__(self, job, maxTasks=None):
+        self.job = job
+        self.maxTasks = maxTasks or int(os.environ.get('MESHROOM_LOCALFARM_MAX_TASKS', 0)) or multiprocessing.cpu_count()
+        self._stopRequested = False
+
+    def _usedResources(self, running):
+        used = {}
+        for task in running:
+            for key, value in task.requirements.items():
+                used[key] = used.get(key, 0.0) + value
+        return used
+
+    def _canStart(self, task, running):
+        if not running:
+            # always allow a task to run alone, whatever its requirements
+            return True
+        if len(running) >= self.maxTasks:
+            return False
+        used = self._usedResources(running)
+        return all(used.get(key, 0.0) + value <= 1.0 for key, value in task.requirements.items())
+
+    def _isReady(self, task):
+        return all(self.job.task(d).status == TaskStatus.SUCCESS for d in task.dependencies if self.job.task(d))
+
+    def _cancelDependents(self, failedTask):
+        for task in self.job.tasks:
+            if task.status == TaskStatus.WAITING and failedTask.name in task.dependencies:
+                task.status = TaskStatus.CANCELED
+                logging.warning('Task "{}" canceled: dependency "{}" failed.'.format(task.name, failedTask.name))
+                self._cancelDependents(task)
+
+    def _startTask(self, task):
+        env = os.environ.copy()
+        env.update(self.job.environment)
+        logging.info('Start task "{}": {}'.format(task.name, ' '.join(task.command)))
+        task.limiter = processLimiter(task.name, task.limits)
+        task.statusReason = ''
+        with open(self.job.taskLogFile(task), 'a') as logFile:
+            task.process = psutil.Popen(task.command, stdout=logFile, stderr=subprocess.STDOUT, env=env)
+        if task.limiter:
+            task.limiter.attach(task.process)
+            task.limiter.start(task.process)
+        task.status = TaskStatus.RUNNING
+
+    def _finishTask(self, task, returnCode):
+        """ Release the limiter of an ended task, and return whether it succeeded. """
+        task.returnCode = returnCode
+        if task.limiter:
+            task.statusReason = task.limiter.finish(returnCode) or ''
+            task.limiter = None
+        if task.statusReason:
+            logging.warning('Task "{}": {}'.format(task.name, task.statusReason))
+        return returnCode == 0 and not task.statusReason
+
+    def stop(self, *args):
+        self._stopRequested = True
+
+    def run(self):
+        """
+        Execute the job tasks.
+
+        Returns:
+            bool: whether all tasks succeeded
+        """
+        # restart interrupted tasks
+        for task in self.job.tasks:
+            if task.status == TaskStatus.RUNNING:
+                task.status = TaskStatus.WAITING
+        running = []
+        while not self._stopRequested:
+            for task in list(running):
+                returnCode = task.process.poll()
+                if returnCode is None:
+                    continue
+                running.remove(task)
+                task.status = TaskStatus.SUCCESS if self._finishTask(task, returnCode) else TaskStatus.ERROR
+                logging.info('Task "{}" finished with status {}.'.format(task.name, task.status.name))
+                if task.status == TaskStatus.ERROR:
+                    self._cancelDependents(task)
+                self.job.save()
+
+            waiting = [t for t in self.job.tasks if t.status == TaskStatus.WAITING]
+            if not waiting and not running:
+                break
+            started = False
+            for task in waiting:
+                if self._isReady(task) and self._canStart(task, running):
+                    self._startTask(task)
+                    running.append(task)
+                    started = True
+            if started:
+                self.job.save()
+            time.sleep(self.pollInterval)
+
+        if self._stopRequested:
+            for task in running:
+                task.process.terminate()
+            for task in running:
+                self._finishTask(task, task.process.wait())
+                task.status = TaskStatus.CANCELED
+            self.job.save()
+        return all(t.status == TaskStatus.SUCCESS for t in self.job.tasks)
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    job = Job.load(args[0])
+    scheduler = Scheduler(job)
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    logging.info('Run job "{}" ({} tasks).'.format(job.name, len(job.tasks)))
+    success = scheduler.run()
+    logging.info('Job "{}" finished: {}.'.format(job.name, 'SUCCESS' if success else 'ERROR'))
+    return 0 if success else 1
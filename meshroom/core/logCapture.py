@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Streaming capture of the output of chunk processes into their log file.
+
+The output of the process is read through a pipe by a background thread, as soon as it is written
+(including incomplete lines such as progress bars), which:
+ - writes it to the log file, rotating the file into gzip-compressed backups when it grows too large,
+ - drops output written faster than a maximum rate (the number of dropped bytes is logged),
+ - keeps the last lines in memory to report errors without reading back the log file,
+ - forwards it to listeners (see meshroom.core.progress).
+
+readLog() reads a log file incrementally from a byte offset, e.g. to follow a running chunk.
+"""
+import codecs
+import collections
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+
+# Size (in MB) from which a log file is rotated, 0 to disable rotation
+maxLogSize = float(os.environ.get('MESHROOM_LOG_MAX_SIZE', '100'))
+# Number of compressed log backups kept on rotation
+logBackups = int(os.environ.get('MESHROOM_LOG_BACKUPS', '2'))
+# Maximum write rate (in MB/s) of a log file, 0 for no limit
+maxLogRate = float(os.environ.get('MESHROOM_LOG_MAX_RATE', '0'))
+# Number of last lines kept in memory for error reporting
+tailLines = int(os.environ.get('MESHROOM_LOG_TAIL_LINES', '1000'))
+
+
+def backupFilepath(logFile, index):
+    """ Return the path of the compressed backup 'index' (starting at 1, the most recent) of a log file. """
+    return '{}.{}.gz'.format(logFile, index)
+
+
+class LogCapture(object):
+    """
+    Log file of a chunk, fed with the output of its processes.
+    """
+    # maximum size of a read from the pipe
+    readSize = 64 * 1024
+
+    def __init__(self, logFile, maxSize=None, backups=None, maxRate=None, nbTailLines=None):
+        """
+        Args:
+            logFile (str): the log file, truncated along with its backups
+            maxSize (int): size (in bytes) from which the log file is rotated, 0 to disable rotation
+            backups (int): number of compressed backups kept on rotation
+            maxRate (float): maximum write rate (in bytes/s), 0 for no limit
+            nbTailLines (int): number of last lines kept in memory
+        """
+        self.logFile = logFile
+        self.maxSize = int(maxLogSize * 1024 * 1024) if maxSize is None else maxSize
+        self.backups = logBackups if backups is None else backups
+        self.maxRate = maxLogRate * 1024 * 1024 if maxRate is None else maxRate
+        self.tail = collections.deque(maxlen=tailLines if nbTailLines is None else nbTailLines)
+        # callables receiving the output text as it is written
+        self.listeners = []
+        self.droppedBytes = 0
+        self._partialLine = ''
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._allowance = self.maxRate
+        self._lastTime = time.time()
+        for index in range(1, self.backups + 1):
+            if os.path.exists(backupFilepath(logFile, index)):
+                os.remove(backupFilepath(logFile, index))
+        self._file = open(logFile, 'wb')
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def _rotate(self):
+        """ Compress the log file into the first backup, shifting the older ones. """
+        self._file.close()
+        if self.backups:
+            for index in range(self.backups - 1, 0, -1):
+                if os.path.exists(backupFilepath(self.logFile, index)):
+                    os.rename(backupFilepath(self.logFile, index), backupFilepath(self.logFile, index + 1))
+            with open(self.logFile, 'rb') as src, gzip.open(backupFilepath(self.logFile, 1), 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        self._file = open(self.logFile, 'wb')
+        self._size = 0
+
+    def _acceptData(self, size):
+        """ Whether 'size' bytes can be written without exceeding the maximum rate (token bucket). """
+        if not self.maxRate:
+            return True
+        now = time.time()
+        self._allowance = min(self.maxRate, self._allowance + (now - self._lastTime) * self.maxRate)
+        self._lastTime = now
+        if size > self._allowance:
+            return False
+        self._allowance -= size
+        return True
+
+    def write(self, data):
+        """ Write output (str or bytes, not necessarily complete lines) to the log file. """
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        with self._lock:
+            if self._closed:
+                # output of processes still writing to the pipe after close()
+                return
+            text = self._decoder.decode(data)
+            lines = (self._partialLine + text).split('\n')
+            self._partialLine = lines.pop()
+            self.tail.extend(line + '\n' for line in lines)
+            if self._acceptData(len(data)):
+                self._writeDroppedBytes()
+                self._writeData(data)
+            else:
+                self.droppedBytes += len(data)
+        for listener in self.listeners:
+            try:
+                listener(text)
+            except Exception as e:
+                logging.warning('Error in log listener of "{}": {}'.format(self.logFile, str(e)))
+
+    def _writeDroppedBytes(self):
+        if self.droppedBytes:
+            self._writeData('\n[Meshroom] {} bytes dropped (log rate limit exceeded)\n'.format(self.droppedBytes).encode('utf-8'))
+            self.droppedBytes = 0
+
+    def _writeData(self, data):
+        while self.maxSize and self._size + len(data) > self.maxSize:
+            # fill the log file up to its maximum size, at a line end when possible
+            part = data[:self.maxSize - self._size]
+            end = part.rfind(b'\n')
+            part = part[:end + 1] if end >= 0 else (part if not self._size else b'')
+            self._file.write(part)
+            data = data[len(part):]
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def read(self, pipe):
+        """ Capture the output of a process from its 'pipe' in a background thread, until wait() is called. """
+        self._thread = threading.Thread(target=self._readPipe, args=(pipe,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _readPipe(self, pipe):
+        fd = pipe.fileno()
+        while not self._closed:
+            data = os.read(fd, self.readSize)
+            if not data:
+                break
+            self.write(data)
+        pipe.close()
+
+    def wait(self, timeout=10.0):
+        """
+        Wait for the end of the capture of the process output.
+        Processes left running by the captured process may keep the pipe open: stop waiting after 'timeout' seconds,
+        the output they write after close() is then ignored.
+        """
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def tailText(self):
+        """ Return the last lines of the log. """
+        with self._lock:
+            return ''.join(self.tail) + self._partialLine
+
+    def close(self):
+        self.wait()
+        with self._lock:
+            # stop the capture of the pipe, which may still be open
+            self._closed = True
+            self._writeDroppedBytes()
+            self._file.close()
+
+
+def readLog(logFile, offset=0, maxSize=1024 * 1024):
+    """
+    Read a log file incrementally.
+
+    Args:
+        logFile (str): the log file
+        offset (int): the position (in bytes) from which to read, as returned by the previous call
+        maxSize (int): maximum size to read
+
+    Returns:
+        tuple: (text, offset, reset) the new complete lines, the offset of the next read, and whether the file
+        has been truncated or rotated since the previous call, in which case it is read from the beginning.
+        A line longer than 'maxSize' is returned in several parts.
+    """
+    try:
+        size = os.path.getsize(logFile)
+    except OSError:
+        return '', 0, offset > 0
+    reset = size < offset
+    if reset:
+        offset = 0
+    with open(logFile, 'rb') as f:
+        f.seek(offset)
+        data = f.read(maxSize)
+    end = data.rfind(b'\n')
+    if end >= 0:
+        # keep the incomplete last line for the next read
+        data = data[:end + 1]
+    elif len(data) < maxSize:
+        # incomplete line at the end of the file
+        data = b''
+    else:
+        # line longer than maxSize: return its beginning, without splitting a utf-8 character
+        start = len(data) - 1
+        while start > 0 and len(data) - start < 4 and (ord(data[start:start + 1]) & 0xC0) == 0x80:
+            start -= 1
+        if start > 0 and (ord(data[start:start + 1]) & 0xC0) == 0xC0:
+            data = data[:start]
+    return data.decode('utf-8', 'replace'), offset + len(data), reset
@@ -3,23 +3,29 @@
 import atexit
 import copy
 import datetime
+import glob
 import json
 import logging
 import os
 import platform
 import re
 import shutil
+import threading
 import time
 import types
 import uuid
 from collections import defaultdict, namedtuple
+from contextlib import contextmanager
 from enum import Enum
 
 import meshroom
 from meshroom.common import Signal, Variant, Property, BaseObject, Slot, ListModel, DictModel
-from meshroom.core import desc, stats, hashValue, pyCompatibility, nodeVersion, Version
+from meshroom.core import desc, stats, hashValue, pyCompatibility, nodeVersion, Version, outOfProcess
 from meshroom.core.attribute import attributeFactory, ListAttribute, GroupAttribute, Attribute
 from meshroom.core.exception import NodeUpgradeError, UnknownNodeTypeError
+from meshroom.core.prefetch import inputsPrefetcher
+from meshroom.core.progress import ChunkProgress
+from meshroom.core.uidLock import UidLock, chunkLockFilepath
 
 
 def getWritingFilepath(filepath):
@@ -40,6 +46,36 @@ def renameWritingToFinalPath(writingFilepath, filepath):
     os.rename(writingFilepath, filepath)
 
 
+def _filePatternPaths(path):
+    """ Return the existing paths matching a File attribute value.
+
+    Output values may contain per-view placeholders (<VIEW_ID>) or wildcards
+    that are resolved by the processing binaries.
+    """
+    if not path:
+        return []
+    pattern = re.sub(r'<[A-Z_]+>', '*', path)
+    if '*' in pattern or '?' in pattern:
+        return glob.glob(pattern)
+    return [path] if os.path.exists(path) else []
+
+
+def _pathMTime(path):
+    """ Return the modification time of a file, or the most recent one of a folder and its direct entries. """
+    mtime = os.path.getmtime(path)
+    if os.path.isdir(path):
+        for entry in os.listdir(path):
+            mtime = max(mtime, os.path.getmtime(os.path.join(path, entry)))
+    return mtime
+
+
+def _isCompletePath(path):
+    """ Whether an output path holds data: a non-empty file or a non-empty folder. """
+    if os.path.isdir(path):
+        return bool(os.listdir(path))
+    return os.path.getsize(path) > 0
+
+
 class Status(Enum):
     """
     """
@@ -79,6 +115,17 @@ class StatusData(BaseObject):
         self.elapsedTime = 0
         self.hostname = ""
         self.sessionUid = meshroom.core.sessionUid
+        # why the chunk has been stopped or failed, when known (a resource limit has been reached...)
+        self.statusReason = ""
+        # cores the chunk process has been pinned to (see meshroom.core.coreAllocator)
+        self.cores = []
+        # history of the computation attempts (see desc.RetryPolicy)
+        self.attempts = []
+        # live progress of the computation (see meshroom.core.progress)
+        self.progress = None
+        self.processedItems = 0
+        self.throughput = None
+        self.progressDateTime = ""
 
     def merge(self, other):
         self.startDateTime = min(self.startDateTime, other.startDateTime)
@@ -96,11 +143,23 @@ class StatusData(BaseObject):
         self.elapsedTime = 0
         self.hostname = ""
         self.sessionUid = meshroom.core.sessionUid
+        self.statusReason = ""
+        self.cores = []
+        self.attempts = []
+        self.resetProgress()
+
+    def resetProgress(self):
+        self.progress = None
+        self.processedItems = 0
+        self.throughput = None
+        self.progressDateTime = ""
 
     def initStartCompute(self):
         import platform
         self.sessionUid = meshroom.core.sessionUid
         self.hostname = platform.node()
+        self.statusReason = ""
+        self.resetProgress()
         self.startDateTime = datetime.datetime.now().strftime(self.dateTimeFormatting)
         # to get datetime obj: datetime.datetime.strptime(obj, self.dateTimeFormatting)
 
@@ -108,6 +167,26 @@ class StatusData(BaseObject):
         self.sessionUid = meshroom.core.sessionUid
         self.endDateTime = datetime.datetime.now().strftime(self.dateTimeFormatting)
 
+    def addAttempt(self, status):
+        """ Record the end of a computation attempt with the given status. """
+        self.attempts.append({
+            'status': status.name,
+            'hostname': self.hostname,
+            'startDateTime': self.startDateTime,
+            'endDateTime': datetime.datetime.now().strftime(self.dateTimeFormatting),
+            'returnCode': getattr(self, 'returnCode', None),
+            'statusReason': self.statusReason,
+        })
+
+    @property
+    def remainingTime(self):
+        """ Estimated remaining computation time (in seconds) from the last progress, None if unknown. """
+        if not self.progress or not self.startDateTime or not self.progressDateTime:
+            return None
+        startTime = datetime.datetime.strptime(self.startDateTime, self.dateTimeFormatting)
+        progressTime = datetime.datetime.strptime(self.progressDateTime, self.dateTimeFormatting)
+        return (progressTime - startTime).total_seconds() * (1.0 - self.progress) / self.progress
+
     @property
     def elapsedTimeStr(self):
         return str(datetime.timedelta(seconds=self.elapsedTime))
@@ -137,6 +216,13 @@ class StatusData(BaseObject):
         self.elapsedTime = d.get('elapsedTime', 0)
         self.hostname = d.get('hostname', '')
         self.sessionUid = d.get('sessionUid', '')
+        self.statusReason = d.get('statusReason', '')
+        self.cores = d.get('cores', [])
+        self.attempts = d.get('attempts', [])
+        self.progress = d.get('progress', None)
+        self.processedItems = d.get('processedItems', 0)
+        self.throughput = d.get('throughput', None)
+        self.progressDateTime = d.get('progressDateTime', '')
 
 
 class LogManager:
@@ -180,6 +266,7 @@ class LogManager:
         self.progressEnd = end
         self.currentProgressTics = 0
         self.progressBar = True
+        self.chunkProgress = ChunkProgress(self.chunk)
 
         with open(self.chunk.logFile, 'a') as f:
             if message:
@@ -210,11 +297,14 @@ class LogManager:
             f.close()
 
         self.currentProgressTics = tics
+        self.chunkProgress.update(items=value, total=self.progressEnd)
+        self.chunkProgress.publish()
 
     def completeProgressBar(self):
         assert self.progressBar
 
         self.progressBar = False
+        self.chunkProgress.publish(force=True)
 
     def textToLevel(self, text):
         if text == 'critical':
@@ -251,6 +341,11 @@ class NodeChunk(BaseObject):
         self.statistics = stats.Statistics()
         self.statusFileLastModTime = -1
         self._subprocess = None
+        # serialize the status changes of the threads working on the chunk (compute, stop, progress...)
+        self._statusLock = threading.RLock()
+        # set by stopProcess to interrupt the waits of the computation (see _stoppableWait)
+        self._stopEvent = threading.Event()
+        self._waiting = False
         # notify update in filepaths when node's internal folder changes
         self.node.internalFolderChanged.connect(self.nodeFolderChanged)
 
@@ -323,35 +418,49 @@ class NodeChunk(BaseObject):
         else:
             return os.path.join(self.node.graph.cacheDir, self.node.internalFolder, str(self.index) + '.log')
 
+    @Slot(int, result=Variant)
+    def readLog(self, offset):
+        """
+        Read the log file incrementally (see meshroom.core.logCapture.readLog).
+
+        Returns:
+            dict: {'text': the new lines, 'offset': the offset of the next read, 'reset': whether the log restarted}
+        """
+        from meshroom.core.logCapture import readLog
+        text, offset, reset = readLog(self.logFile, offset)
+        return {'text': text, 'offset': offset, 'reset': reset}
+
     def saveStatusFile(self):
         """
         Write node status on disk.
         """
-        data = self._status.toDict()
-        statusFilepath = self.statusFile
-        folder = os.path.dirname(statusFilepath)
-        try:
-            os.makedirs(folder)
-        except Exception as e:
-            pass
+        with self._statusLock:
+            data = self._status.toDict()
+            statusFilepath = self.statusFile
+            try:
+                self.node.createInternalFolder()
+            except Exception as e:
+                pass
 
-        statusFilepathWriting = getWritingFilepath(statusFilepath)
-        with open(statusFilepathWriting, 'w') as jsonFile:
-            json.dump(data, jsonFile, indent=4)
-        renameWritingToFinalPath(statusFilepathWriting, statusFilepath)
+            statusFilepathWriting = getWritingFilepath(statusFilepath)
+            with open(statusFilepathWriting, 'w') as jsonFile:
+                json.dump(data, jsonFile, indent=4)
+            renameWritingToFinalPath(statusFilepathWriting, statusFilepath)
 
     def upgradeStatusTo(self, newStatus, execMode=None):
-        if newStatus.value <= self._status.status.value:
-            logging.warning('Downgrade status on node "{}" from {} to {}'.format(self.name, self._status.status,
-                                                                                 newStatus))
-
-        if newStatus == Status.SUBMITTED:
-            self._status = StatusData(self.node.name, self.node.nodeType, self.node.packageName, self.node.packageVersion)
+        with self._statusLock:
+            if newStatus.value <= self._status.status.value:
+                logging.warning('Downgrade status on node "{}" from {} to {}'.format(self.name, self._status.status,
+                                                                                     newStatus))
+
+            if newStatus == Status.SUBMITTED:
+                self._status = StatusData(self.node.name, self.node.nodeType, self.node.packageName, self.node.packageVersion)
+            if execMode is not None:
+                self._status.execMode = execMode
+            self._status.status = newStatus
+            self.saveStatusFile()
         if execMode is not None:
-            self._status.execMode = execMode
             self.execModeNameChanged.emit()
-        self._status.status = newStatus
-        self.saveStatusFile()
         self.statusChanged.emit()
 
     def updateStatisticsFromCache(self):
@@ -370,9 +479,7 @@ class NodeChunk(BaseObject):
     def saveStatistics(self):
         data = self.statistics.toDict()
         statisticsFilepath = self.statisticsFile
-        folder = os.path.dirname(statisticsFilepath)
-        if not os.path.exists(folder):
-            os.makedirs(folder)
+        self.node.createInternalFolder()
         statisticsFilepathWriting = getWritingFilepath(statisticsFilepath)
         with open(statisticsFilepathWriting, 'w') as jsonFile:
             json.dump(data, jsonFile, indent=4)
@@ -400,6 +507,52 @@ class NodeChunk(BaseObject):
         if not forceCompute and self._status.status == Status.SUCCESS:
             logging.info("Node chunk already computed: {}".format(self.name))
             return
+        if not meshroom.useUidLocks:
+            self._processWithRetries(forceCompute)
+            return
+        # prevent other processes from computing the same chunk at the same time
+        lock = UidLock(chunkLockFilepath(self))
+        waiting = []
+
+        def onWait(owner):
+            waiting.append(owner)
+            logging.info('Node chunk "{}" is being computed by {}, waiting for the result.'.format(self.name, owner))
+
+        with self._stoppableWait() as stopEvent:
+            lock.acquire(waitCallback=onWait, stopEvent=stopEvent)
+        try:
+            # stopped while waiting for the other process (see stopProcess)
+            if stopEvent.is_set():
+                raise RuntimeError('Node chunk "{}" stopped while being computed by another process.'.format(self.name))
+            if waiting:
+                self.updateStatusFromCache()
+                if not forceCompute and self._status.status == Status.SUCCESS:
+                    logging.info("Node chunk computed by another process: {}".format(self.name))
+                    return
+            self._processWithRetries(forceCompute)
+        finally:
+            lock.release()
+
+    def _processWithRetries(self, forceCompute):
+        """ Process the chunk, retrying it on transient failures according to the retry policy of its node type. """
+        policy = self.node.nodeDesc.retryPolicy
+        self._status.attempts = []
+        attempt = 1
+        while True:
+            try:
+                self._process(forceCompute)
+                return
+            except Exception as e:
+                if self._status.status != Status.ERROR or attempt >= policy.getMaxAttempts() or not policy.isTransient(self):
+                    raise
+                delay = policy.delay(attempt)
+                logging.warning('Transient failure of "{}" (attempt {}/{}), retry in {}s: {}'.format(
+                    self.name, attempt, policy.getMaxAttempts(), delay, str(e).splitlines()[0] if str(e) else ''))
+                if self._waitOrStop(delay):
+                    raise RuntimeError('Node chunk "{}" stopped before its next attempt.'.format(self.name))
+                attempt += 1
+
+    def _process(self, forceCompute):
         global runningProcesses
         runningProcesses[self.name] = self
         self._status.initStartCompute()
@@ -408,12 +561,20 @@ class NodeChunk(BaseObject):
         self.statThread = stats.StatisticsThread(self)
         self.statThread.start()
         try:
-            self.node.nodeDesc.processChunk(self)
+            self.restoreArchivedInputs()
+            if outOfProcess.isOutOfProcess(self):
+                outOfProcess.processChunk(self)
+            else:
+                self.node.nodeDesc.processChunk(self)
         except Exception as e:
             if self._status.status != Status.STOPPED:
+                self._status.addAttempt(Status.ERROR)
                 self.upgradeStatusTo(Status.ERROR)
+            else:
+                self._status.addAttempt(Status.STOPPED)
             raise
         except (KeyboardInterrupt, SystemError, GeneratorExit) as e:
+            self._status.addAttempt(Status.STOPPED)
             self.upgradeStatusTo(Status.STOPPED)
             raise
         finally:
@@ -426,11 +587,75 @@ class NodeChunk(BaseObject):
             self.statistics = stats.Statistics()
             del runningProcesses[self.name]
 
+        self._status.addAttempt(Status.SUCCESS)
         self.upgradeStatusTo(Status.SUCCESS)
+        # used to estimate the duration of the next computations (see meshroom.core.submitter.coalesceNodes)
+        stats.nodeTypesHistory.addValue(self.node.nodeType, 'chunkDuration', self._status.elapsedTime)
+        if self.node.isComputed:
+            from meshroom.core.cache import cacheLayout
+            if cacheLayout.enabled:
+                cacheLayout.recordOutputSize(self.node)
+
+    @contextmanager
+    def _stoppableWait(self):
+        """
+        Context of a wait of the computation, when nothing is running: stopProcess sets
+        the yielded event and stops the chunk instead of the (not started) computation.
+        """
+        with self._statusLock:
+            self._stopEvent.clear()
+            self._waiting = True
+        try:
+            yield self._stopEvent
+        finally:
+            with self._statusLock:
+                self._waiting = False
+
+    def _waitOrStop(self, timeout):
+        """
+        Wait for 'timeout' seconds, unless the chunk is stopped in the meantime (see stopProcess).
+
+        Returns:
+            bool: whether the chunk has been stopped
+        """
+        with self._stoppableWait() as stopEvent:
+            return stopEvent.wait(timeout)
+
+    def restoreArchivedInputs(self):
+        """ Unpack the archived data of the input nodes (see meshroom.core.cache.archiveNode). """
+        from meshroom.core.cache import restoreNodes
+        nodes = [self.node]
+        if self.node.graph:
+            nodes.extend(self.node.graph.getInputNodes(self.node, recursive=False, dependenciesOnly=True))
+        restoreNodes(nodes)
+
+    def isStoppable(self):
+        """ Whether the computation of this chunk can be stopped, i.e. it does not run in this process. """
+        return outOfProcess.isOutOfProcess(self) or outOfProcess.overrides(self.node.nodeDesc, desc.Node, 'stopProcess')
 
     def stopProcess(self):
-        self.upgradeStatusTo(Status.STOPPED)
-        self.node.nodeDesc.stopProcess(self)
+        """
+        Stop the computation of this chunk, if it is running or submitted.
+
+        Raises:
+            NotImplementedError: if the chunk is running and cannot be stopped (see isStoppable)
+        """
+        with self._statusLock:
+            if self._waiting:
+                # nothing is running: the chunk waits for its next attempt or for another process
+                self.upgradeStatusTo(Status.STOPPED)
+                self._stopEvent.set()
+                return
+            # the status is checked and set atomically: a chunk which has just ended keeps its status
+            if self._status.status not in (Status.RUNNING, Status.SUBMITTED):
+                return
+            if self._status.status == Status.RUNNING and not self.isStoppable():
+                raise NotImplementedError('Node chunk "{}" is computed in this process and cannot be stopped.'.format(self.name))
+            self.upgradeStatusTo(Status.STOPPED)
+        if outOfProcess.isOutOfProcess(self):
+            outOfProcess.stopChunk(self)
+        else:
+            self.node.nodeDesc.stopProcess(self)
 
     def isExtern(self):
         return self._status.execMode == ExecMode.EXTERN
@@ -720,13 +945,113 @@ class BaseNode(BaseObject):
     def _isComputed(self):
         return self.hasStatus(Status.SUCCESS)
 
+    def _fileAttributesValues(self, attributes, isOutput):
+        """ Recursively collect the evaluated values of File attributes (in Lists and Groups included). """
+        values = []
+        for attr in attributes:
+            if attr.isOutput != isOutput or not attr.enabled:
+                continue
+            if isinstance(attr, (ListAttribute, GroupAttribute)):
+                values += self._fileAttributesValues(attr.value, isOutput)
+            elif isinstance(attr.attributeDesc, desc.File):
+                value = attr.getEvalValue()
+                if value:
+                    values.append(value)
+        return values
+
+    def getInputFileValues(self):
+        """ Return the evaluated values of this node's enabled File inputs. """
+        return self._fileAttributesValues(self._attributes, isOutput=False)
+
+    def getInputFilepaths(self):
+        """ Return the existing paths referenced by this node's File inputs. """
+        paths = []
+        for value in self.getInputFileValues():
+            paths += _filePatternPaths(value)
+        return paths
+
+    def outputsAreUpToDate(self):
+        """
+        Check on disk whether the outputs of this node are available without recomputation.
+
+        Outputs are considered up to date if every File output exists, is complete (non-empty)
+        and is not older than any of the node's input files.
+
+        Returns:
+            bool: whether all outputs are up to date
+        """
+        outputs = self._fileAttributesValues(self._attributes, isOutput=True)
+        if not outputs:
+            # nothing to check: the node status cannot be deduced from its outputs
+            return False
+        try:
+            outputsMTime = None
+            for value in outputs:
+                paths = _filePatternPaths(value)
+                if not paths:
+                    return False
+                for path in paths:
+                    if not _isCompletePath(path):
+                        return False
+                    mtime = _pathMTime(path)
+                    outputsMTime = mtime if outputsMTime is None else min(outputsMTime, mtime)
+            inputsMTime = max([_pathMTime(path) for path in self.getInputFilepaths()] or [0])
+        except (OSError, IOError):
+            # files removed while checking
+            return False
+        return outputsMTime >= inputsMTime
+
+    def canReconcileStatus(self):
+        """ Whether this node has chunks without status and no chunk in another state than SUCCESS. """
+        if not self._chunks or self.hasStatus(Status.SUCCESS):
+            return False
+        return all(chunk.status.status in (Status.NONE, Status.SUCCESS) for chunk in self._chunks)
+
+    def reconcileStatus(self, checkOutputs=True):
+        """
+        Restore the SUCCESS status of chunks with no status (e.g. lost status files)
+        if this node outputs are up to date on disk.
+
+        Args:
+            checkOutputs (bool): whether to check outputs on disk; can be disabled if already done by the caller
+
+        Returns:
+            bool: whether the status has been restored
+        """
+        if not self.canReconcileStatus():
+            return False
+        if checkOutputs and not self.outputsAreUpToDate():
+            return False
+        for chunk in self._chunks:
+            if chunk.status.status == Status.NONE:
+                chunk.upgradeStatusTo(Status.SUCCESS)
+        return True
+
     def clearData(self):
         """ Delete this Node internal folder.
         Status will be reset to Status.NONE
         """
-        if self.internalFolder and os.path.exists(self.internalFolder):
-            shutil.rmtree(self.internalFolder)
+        if not self.internalFolder:
+            return
+        folder = self.internalFolder.rstrip('/\\')
+        if os.path.islink(folder):
+            # internal folder stored on another volume (see meshroom.core.cache.CacheLayout)
+            target = os.path.realpath(folder)
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            os.remove(folder)
             self.updateStatusFromCache()
+        elif os.path.exists(folder):
+            shutil.rmtree(folder)
+            self.updateStatusFromCache()
+
+    def createInternalFolder(self):
+        """ Create this Node internal folder if needed, on the cache volume selected for this node if any. """
+        from meshroom.core.cache import cacheLayout
+        if cacheLayout.enabled:
+            cacheLayout.createNodeFolder(self)
+        elif not os.path.exists(self.internalFolder):
+            os.makedirs(self.internalFolder)
 
     def isAlreadySubmitted(self):
         for chunk in self._chunks:
@@ -837,11 +1162,16 @@ class BaseNode(BaseObject):
         """
         Update node status based on status file content/existence.
         """
+        from meshroom.core.cache import cacheLayout
+        if cacheLayout.enabled and self.internalFolder:
+            cacheLayout.restoreNodeFolder(self)
         for chunk in self._chunks:
             chunk.updateStatusFromCache()
 
-    def submit(self, forceCompute=False):
-        for chunk in self._chunks:
+    def submit(self, forceCompute=False, iterations=None):
+        """ Set the status of the chunks to submit, all chunks or the given chunk indices. """
+        chunks = self._chunks if iterations is None else [self._chunks[i] for i in iterations]
+        for chunk in chunks:
             if forceCompute or chunk.status.status != Status.SUCCESS:
                 chunk.upgradeStatusTo(Status.SUBMITTED, ExecMode.EXTERN)
 
@@ -853,8 +1183,13 @@ class BaseNode(BaseObject):
     def processIteration(self, iteration):
         self._chunks[iteration].process()
 
-    def process(self, forceCompute=False):
-        for chunk in self._chunks:
+    def process(self, forceCompute=False, nextChunk=None):
+        """ Process all the chunks, prefetching the inputs of 'nextChunk' (the next one in the plan) during the last one. """
+        chunks = list(self._chunks)
+        for chunk in chunks:
+            # chunks of a node share their inputs: prefetch the ones of the next node during the last chunk
+            if chunk is chunks[-1]:
+                inputsPrefetcher.prefetch(nextChunk)
             chunk.process(forceCompute)
 
     def endSequence(self):
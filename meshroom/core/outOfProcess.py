@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Out-of-process execution of the nodes implemented in Python.
+
+The processChunk method of Python nodes (Publish, SketchfabUpload, CameraInit...) normally runs in the
+calling process: in the UI, it shares the GIL with the interface, and two of them cannot run at the same
+time. When enabled, their chunks are computed by a meshroom_compute worker process instead, on a copy of
+the graph: the calling process keeps managing the chunk status, while the worker writes the log file and
+the progress in the status file, and its output is forwarded to the calling process. The progress written
+by the worker is forwarded to the chunk status while it runs.
+The task manager computes up to 'maxWorkers' of these chunks concurrently, along with the other chunks
+(see meshroom.core.taskManager.TaskThread).
+"""
+import collections
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+import meshroom
+from meshroom.core import desc
+from meshroom.core.lazyImport import psutil
+
+# Maximum number of chunks computed concurrently in worker processes by the task manager
+maxWorkers = int(os.environ.get('MESHROOM_OUT_OF_PROCESS_WORKERS', '4'))
+
+
+def overrides(nodeDesc, baseClass, methodName):
+    """ Whether the class of 'nodeDesc' overrides the method 'methodName' of 'baseClass'. """
+    method = getattr(type(nodeDesc), methodName)
+    baseMethod = getattr(baseClass, methodName)
+    # python 2: unbound methods are new objects on each access, compare their functions
+    return getattr(method, '__func__', method) is not getattr(baseMethod, '__func__', baseMethod)
+
+
+def isOutOfProcess(chunk):
+    """ Whether the chunk is computed by a worker process, i.e. its node type implements processChunk in Python. """
+    if not meshroom.useOutOfProcessNodes:
+        return False
+    return overrides(chunk.node.nodeDesc, desc.CommandLineNode, 'processChunk')
+
+
+# Status fields written by the worker and forwarded to the calling process while the chunk runs
+progressKeys = ('progress', 'processedItems', 'throughput', 'progressDateTime')
+
+
+def forwardProgress(chunk):
+    """ Update the progress of a running chunk from its status file, written by its worker. """
+    try:
+        with open(chunk.statusFile, 'r') as jsonFile:
+            data = json.load(jsonFile)
+    except (IOError, OSError, ValueError):
+        return
+    with chunk._statusLock:
+        if not chunk.isRunning() or data.get('status') != 'RUNNING':
+            return
+        for key in progressKeys:
+            if key in data:
+                setattr(chunk.status, key, data[key])
+    chunk.statusChanged.emit()
+
+
+def _forwardProgressLoop(chunk, stopEvent):
+    from meshroom.core.progress import publishInterval
+    lastModTime = None
+    while not stopEvent.wait(max(0.1, publishInterval / 2.0)):
+        try:
+            modTime = os.path.getmtime(chunk.statusFile)
+        except OSError:
+            continue
+        if modTime != lastModTime:
+            lastModTime = modTime
+            forwardProgress(chunk)
+
+
+def processChunk(chunk):
+    """ Compute a chunk in a worker process and wait for its end. """
+    from meshroom.core.localFarm import meshroomComputeCommand
+    graph = chunk.node.graph
+    fd, graphFile = tempfile.mkstemp(prefix='{}_'.format(chunk.node.name), suffix='.mg')
+    os.close(fd)
+    try:
+        graph.save(graphFile, setupProjectFile=False)
+        cmd = meshroomComputeCommand() + [graphFile, '--node', chunk.node.name, '--iteration', str(chunk.index),
+                                          '--cache', graph.cacheDir, '--chunkWorker']
+        env = os.environ.copy()
+        # the worker writes the status of the chunk on behalf of this process
+        env['MESHROOM_SESSION_UID'] = meshroom.core.sessionUid
+        # the worker imports the same meshroom package
+        rootFolder = os.path.dirname(os.path.dirname(os.path.abspath(meshroom.__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(p for p in (rootFolder, env.get('PYTHONPATH')) if p)
+        chunk.subprocess = psutil.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+        if chunk.statThread:
+            chunk.statThread.proc = chunk.subprocess
+        stopEvent = threading.Event()
+        progressThread = threading.Thread(target=_forwardProgressLoop, args=(chunk, stopEvent))
+        progressThread.daemon = True
+        progressThread.start()
+        tail = collections.deque(maxlen=100)
+        try:
+            for line in iter(chunk.subprocess.stdout.readline, b''):
+                line = line.decode('utf-8', 'replace')
+                sys.stdout.write(line)
+                tail.append(line)
+            chunk.subprocess.stdout.close()
+            returnCode = chunk.subprocess.wait()
+        finally:
+            stopEvent.set()
+            progressThread.join()
+        # retrieve what the worker has written in the status file (progress...)
+        chunk.updateStatusFromCache()
+        if returnCode != 0:
+            raise RuntimeError('Error on node "{}" (worker process exited with code {}):\n{}'.format(
+                chunk.name, returnCode, ''.join(tail)))
+    finally:
+        chunk.subprocess = None
+        os.remove(graphFile)
+
+
+def stopChunk(chunk):
+    """ Terminate the worker process of a chunk and its children (see meshroom.core.cancellation). """
+    from meshroom.core.cancellation import cancelProcessTree
+    process = getattr(chunk, 'subprocess', None)
+    if process:
+        cancelProcessTree(process)
+
+
+def runChunkWorker(chunk):
+    """ Worker side: run the processChunk implementation of the chunk node, its status being managed by the caller. """
+    chunk.updateStatusFromCache()
+    chunk.node.nodeDesc.processChunk(chunk)
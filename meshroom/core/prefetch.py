@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Prefetch the input files of the next chunk into the page cache while the current chunk runs.
+
+When chunks are computed back to back on a host, the inputs of the next chunk would otherwise
+be read cold from the (network) storage. The prefetch runs in a background thread, asks the
+kernel to read the files ahead with posix_fadvise(WILLNEED) (or reads them on platforms without
+it) and is throttled to a maximum bandwidth, so that it does not slow down the running chunk.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+
+import meshroom
+from meshroom.core import stats
+
+
+def inputFiles(node):
+    """
+    Return the existing files of the input File attributes of a node (see BaseNode.getInputFilepaths).
+    Folders are expanded to the files they contain.
+    """
+    files = []
+    for path in node.getInputFilepaths():
+        if os.path.isfile(path):
+            files.append(path)
+        elif os.path.isdir(path):
+            for root, dirs, filenames in os.walk(path):
+                files.extend(os.path.join(root, filename) for filename in sorted(filenames))
+    return files
+
+
+class InputsPrefetcher(object):
+    """
+    Prefetch the input files of a chunk in a background thread, with a bandwidth cap.
+    """
+    blockSize = 8 * 1024 * 1024
+    # Number of recently prefetched files, not prefetched again while unmodified
+    maxWarmFiles = 100000
+
+    def __init__(self, bandwidth):
+        """
+        Args:
+            bandwidth (float): maximum prefetch bandwidth, in bytes per second
+        """
+        self.bandwidth = bandwidth
+        self._thread = None
+        self._stopEvent = threading.Event()
+        self._warmFiles = collections.OrderedDict()  # path: (size, mtime)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(meshroom.useInputsPrefetch) and self.bandwidth > 0
+
+    def prefetch(self, chunk):
+        """ Prefetch the input files of the given chunk (if any), interrupting the previous prefetch. """
+        if not self.enabled:
+            return
+        self.stop()
+        if chunk is None:
+            return
+        try:
+            files = inputFiles(chunk.node)
+        except Exception as e:
+            logging.debug('Failed to list the inputs of "{}" to prefetch: {}'.format(chunk.name, str(e)))
+            return
+        if not files:
+            return
+        self._stopEvent = threading.Event()
+        self._thread = threading.Thread(target=self._prefetchFiles, args=(chunk.name, files, self._stopEvent))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Interrupt the running prefetch. """
+        self._stopEvent.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _isWarm(self, path, stamp):
+        with self._lock:
+            return self._warmFiles.get(path) == stamp
+
+    def _setWarm(self, path, stamp):
+        with self._lock:
+            self._warmFiles.pop(path, None)
+            self._warmFiles[path] = stamp
+            while len(self._warmFiles) > self.maxWarmFiles:
+                self._warmFiles.popitem(last=False)
+
+    @staticmethod
+    def _readAhead(f, offset, length):
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), offset, length, os.POSIX_FADV_WILLNEED)
+        else:
+            f.seek(offset)
+            f.read(length)
+
+    def _prefetchFiles(self, name, files, stopEvent):
+        startTime = time.time()
+        nbBytes = 0
+        for path in files:
+            try:
+                st = os.stat(path)
+                stamp = (st.st_size, st.st_mtime)
+                if self._isWarm(path, stamp):
+                    continue
+                with open(path, 'rb') as f:
+                    offset = 0
+                    while offset < st.st_size:
+                        length = min(self.blockSize, st.st_size - offset)
+                        self._readAhead(f, offset, length)
+                        offset += length
+                        nbBytes += length
+                        # bandwidth cap
+                        delay = float(nbBytes) / self.bandwidth - (time.time() - startTime)
+                        if stopEvent.wait(max(0.0, delay)):
+                            return
+                self._setWarm(path, stamp)
+            except (IOError, OSError) as e:
+                logging.debug('Failed to prefetch "{}": {}'.format(path, str(e)))
+        logging.debug('Inputs of "{}" prefetched: {} files, {} in {:.1f}s.'.format(
+            name, len(files), stats.bytes2human(nbBytes), time.time() - startTime))
+
+
+# Prefetch bandwidth in MB/s
+inputsPrefetcher = InputsPrefetcher(float(os.environ.get('MESHROOM_PREFETCH_BANDWIDTH', '100')) * 1024 * 1024)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Live progress of the chunks being computed.
+
+The output of a chunk process is parsed as it is written (see meshroom.core.logCapture) to extract:
+ - the textual progress bars of aliceVision ("|----|----|...|" rulers followed by one '*' per step),
+ - the progress patterns declared on the node description (see desc.ProgressPattern).
+The fractional progress and the throughput (processed items per second) are published in the chunk
+status, along with the time of the last progress, from which the remaining time can be estimated
+and stalled chunks detected.
+
+Progress is parsed in the thread reading the process output: the status is only written while the chunk
+is running, under the status lock of the chunk, so that the thread computing the chunk never sees (nor
+saves) a partially updated status and a late output never overwrites the final status.
+"""
+import collections
+import datetime
+import os
+import re
+import time
+
+# Minimum interval (in seconds) between two writings of the progress in the chunk status file
+publishInterval = float(os.environ.get('MESHROOM_PROGRESS_INTERVAL', '5'))
+
+
+class ChunkProgress(object):
+    """
+    Progress of a chunk computation, fed with the output of its process.
+    """
+    # ruler line of the textual progress bars, each '-' or '|' being one step
+    progressBarRuler = re.compile(r'^\|(-+\|)+$')
+    # time window (in seconds) of the throughput computation
+    throughputWindow = 60.0
+
+    def __init__(self, chunk, patterns=(), interval=None):
+        """
+        Args:
+            chunk (NodeChunk): the chunk whose status is updated
+            patterns (list of desc.ProgressPattern): the progress patterns of the node type
+            interval (float): minimum interval (in seconds) between two writings of the status file
+        """
+        self.chunk = chunk
+        self.patterns = patterns
+        self.interval = publishInterval if interval is None else interval
+        self.progress = None
+        self.items = 0
+        self._samples = collections.deque()  # (time, items)
+        self._partialLine = ''
+        self._progressBarSize = 0  # number of steps of the current progress bar, 0 outside of progress bars
+        self._lastPublishTime = 0.0
+        self._changed = False
+
+    @property
+    def throughput(self):
+        """ Number of items processed per second during the last 'throughputWindow' seconds, None if unknown. """
+        if len(self._samples) < 2:
+            return None
+        (t0, items0), (t1, items1) = self._samples[0], self._samples[-1]
+        return (items1 - items0) / (t1 - t0) if t1 > t0 else None
+
+    def update(self, items=None, total=None, progress=None):
+        """
+        Update the progress from a number of processed items (out of 'total') and/or a fractional progress.
+        """
+        now = time.time()
+        if items is not None:
+            self.items = items
+            self._samples.append((now, items))
+            while len(self._samples) > 2 and now - self._samples[0][0] > self.throughputWindow:
+                self._samples.popleft()
+            if total and progress is None:
+                progress = float(items) / total
+        if progress is not None:
+            self.progress = min(1.0, max(0.0, progress))
+        self._changed = True
+
+    def feed(self, text):
+        """ Parse output of the chunk process (not necessarily complete lines). """
+        lines = (self._partialLine + text).split('\n')
+        self._partialLine = lines.pop()
+        for line in lines:
+            self._parseLine(line.rstrip('\r'))
+        # the steps of a progress bar are written progressively on the same line
+        if self._progressBarSize and self._partialLine:
+            self.update(progress=self._partialLine.count('*') / float(self._progressBarSize))
+        self.publish()
+
+    def _parseLine(self, line):
+        if self._progressBarSize:
+            stripped = line.strip()
+            if stripped and stripped.count('*') == len(stripped):
+                self.update(progress=len(stripped) / float(self._progressBarSize))
+                self._progressBarSize = 0
+                return
+        if self.progressBarRuler.match(line.strip()):
+            self._progressBarSize = len(line.strip())
+            return
+        for pattern in self.patterns:
+            match = pattern.regex.search(line)
+            if not match:
+                continue
+            groups = match.groupdict()
+            total = int(groups['total']) if groups.get('total') else pattern.getTotal(self.chunk)
+            if groups.get('percent'):
+                self.update(progress=float(groups['percent']) / 100.0)
+            elif groups.get('done'):
+                self.update(items=int(groups['done']), total=total)
+            else:
+                # one processed item per matching line
+                self.update(items=self.items + 1, total=total)
+            return
+
+    def publish(self, force=False):
+        """ Write the progress in the chunk status file (at most every 'interval' seconds, unless forced). """
+        now = time.time()
+        if not self._changed or (not force and now - self._lastPublishTime < self.interval):
+            return
+        with self.chunk._statusLock:
+            if not self.chunk.isRunning():
+                # output read after the end of the chunk: keep its final status
+                return
+            status = self.chunk.status
+            status.progress = self.progress
+            status.processedItems = self.items
+            status.throughput = self.throughput
+            status.progressDateTime = datetime.datetime.now().strftime(status.dateTimeFormatting)
+            self.chunk.saveStatusFile()
+        self._lastPublishTime = now
+        self._changed = False
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Per-chunk resource limits (memory, CPU quota and maximum runtime) of command line processes.
+
+Limits are derived from the explicit 'resourceLimits' of the node description or from its
+'cpu' and 'ram' levels. On Linux, they are enforced through a cgroup v2 (memory.max, cpu.max)
+created for each chunk in a delegated cgroup (MESHROOM_CGROUP_ROOT), with 'memory' and 'cpu'
+enabled in its cgroup.subtree_control. Otherwise, the resident memory of the process tree is
+watched and the CPU quota is approximated by a CPU time limit (prlimit).
+The address space is only limited for the node types setting an explicit 'addressSpace' limit:
+GPU and memory-mapping binaries reserve much more virtual memory than they use.
+The maximum runtime is enforced by terminating the process.
+
+Limits are applied by the parent process once the chunk process is started (see ChunkLimiter.attach):
+no Python code runs in the forked child of the (multithreaded) parent.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import uuid
+
+import meshroom
+from meshroom.core.desc import Level
+from meshroom.core.lazyImport import psutil
+from meshroom.core.stats import bytes2human
+
+# Delegated cgroup v2 folder in which chunk cgroups are created
+cgroupRoot = os.environ.get('MESHROOM_CGROUP_ROOT', '')
+
+# Interval (in seconds) between two checks of the resident memory of a chunk without cgroup
+memoryCheckInterval = 1.0
+
+# Fraction of the local machine resources allowed to a chunk, depending on its node levels
+levelLimits = {
+    'cpu': {Level.NONE: None, Level.NORMAL: 0.5, Level.INTENSIVE: 1.0},
+    'ram': {Level.NONE: None, Level.NORMAL: 0.5, Level.INTENSIVE: 0.9},
+}
+
+
+def _totalMemory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return psutil.virtual_memory().total
+
+
+class ResourceLimits(object):
+    """
+    Limits of a chunk process; None values are not limited.
+
+    Args:
+        memory (int): maximum memory, in bytes
+        cpus (float): CPU quota, in number of CPUs
+        runtime (float): maximum duration, in seconds
+        addressSpace (int): maximum virtual memory, in bytes (only from an explicit node limit)
+    """
+    def __init__(self, memory=None, cpus=None, runtime=None, addressSpace=None):
+        self.memory = memory
+        self.cpus = cpus
+        self.runtime = runtime
+        self.addressSpace = addressSpace
+
+    def __bool__(self):
+        return any(v is not None for v in (self.memory, self.cpus, self.runtime, self.addressSpace))
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return 'ResourceLimits(memory={}, cpus={}, runtime={}, addressSpace={})'.format(
+            self.memory, self.cpus, self.runtime, self.addressSpace)
+
+    def toDict(self):
+        return {'memory': self.memory, 'cpus': self.cpus, 'runtime': self.runtime, 'addressSpace': self.addressSpace}
+
+    @classmethod
+    def fromDict(cls, d):
+        return cls(**d)
+
+    @classmethod
+    def combine(cls, limitsList):
+        """
+        Return the limits of a process computing several chunks back to back:
+        the largest memory and CPU limits, and the sum of the runtimes (a missing limit is not limited).
+        """
+        def largest(values):
+            return None if any(v is None for v in values) else max(values)
+        runtimes = [limits.runtime for limits in limitsList]
+        return cls(
+            memory=largest([limits.memory for limits in limitsList]),
+            cpus=largest([limits.cpus for limits in limitsList]),
+            runtime=None if any(r is None for r in runtimes) else sum(runtimes),
+            addressSpace=largest([limits.addressSpace for limits in limitsList]),
+        )
+
+    @classmethod
+    def fromNodeDesc(cls, nodeDesc):
+        """ Return the limits of a node type: its explicit 'resourceLimits', or the ones of its levels. """
+        explicit = nodeDesc.resourceLimits or {}
+        ramFraction = levelLimits['ram'].get(nodeDesc.ram)
+        cpuFraction = levelLimits['cpu'].get(nodeDesc.cpu)
+        return cls(
+            memory=explicit.get('memory', int(ramFraction * _totalMemory()) if ramFraction else None),
+            cpus=explicit.get('cpus', cpuFraction * multiprocessing.cpu_count() if cpuFraction else None),
+            runtime=explicit.get('runtime'),
+            addressSpace=explicit.get('addressSpace'),
+        )
+
+
+class ChunkLimiter(object):
+    """
+    Enforce the resource limits of a chunk process.
+
+    Usage:
+        limiter = ChunkLimiter(chunk.name, limits)
+        process = psutil.Popen(...)
+        limiter.attach(process)
+        limiter.start(process)
+        process.wait()
+        reason = limiter.finish(process.returncode)
+    """
+    def __init__(self, name, limits):
+        self.name = name
+        self.limits = limits
+        self.cgroup = None
+        self._watchThread = None
+        self._stopEvent = threading.Event()
+        self._runtimeExceeded = False
+        self._memoryExceeded = False
+        if limits and cgroupRoot and (limits.memory or limits.cpus):
+            self.cgroup = self._createCgroup()
+
+    def _createCgroup(self):
+        try:
+            with open(os.path.join(cgroupRoot, 'cgroup.subtree_control'), 'r') as f:
+                controllers = f.read().split()
+            folder = os.path.join(cgroupRoot, 'meshroom_{}'.format(uuid.uuid4().hex))
+            os.mkdir(folder)
+            if self.limits.memory and 'memory' in controllers:
+                with open(os.path.join(folder, 'memory.max'), 'w') as f:
+                    f.write(str(int(self.limits.memory)))
+                # do not swap instead of failing
+                if os.path.exists(os.path.join(folder, 'memory.swap.max')):
+                    with open(os.path.join(folder, 'memory.swap.max'), 'w') as f:
+                        f.write('0')
+            if self.limits.cpus and 'cpu' in controllers:
+                period = 100000
+                with open(os.path.join(folder, 'cpu.max'), 'w') as f:
+                    f.write('{} {}'.format(int(self.limits.cpus * period), period))
+            return folder
+        except (IOError, OSError) as e:
+            logging.warning('Failed to create the cgroup of "{}", use setrlimit: {}'.format(self.name, str(e)))
+            return None
+
+    def attach(self, process):
+        """ Apply the limits to the started chunk process (psutil.Popen), from the parent process. """
+        if self.cgroup:
+            try:
+                with open(os.path.join(self.cgroup, 'cgroup.procs'), 'w') as f:
+                    f.write(str(process.pid))
+                return
+            except (IOError, OSError) as e:
+                logging.warning('Failed to attach "{}" to its cgroup: {}'.format(self.name, str(e)))
+                self._removeCgroup()
+        rlimits = []
+        if self.limits.addressSpace:
+            rlimits.append((psutil.RLIMIT_AS, (int(self.limits.addressSpace), int(self.limits.addressSpace))))
+        if self.limits.cpus and self.limits.runtime:
+            cpuTime = int(self.limits.cpus * self.limits.runtime)
+            rlimits.append((psutil.RLIMIT_CPU, (cpuTime, cpuTime + 10)))
+        for resource, limits in rlimits:
+            try:
+                process.rlimit(resource, limits)
+            except (AttributeError, psutil.Error, OSError) as e:
+                # prlimit is only available on Linux
+                logging.debug('Failed to limit the resources of "{}": {}'.format(self.name, str(e)))
+
+    def _memoryUsage(self, process):
+        """ Return the resident memory of the process tree, in bytes. """
+        from meshroom.core.cancellation import processTree
+        memory = 0
+        for p in processTree(process):
+            try:
+                memory += p.memory_info().rss
+            except psutil.Error:
+                pass
+        return memory
+
+    def start(self, process):
+        """ Start watching the runtime, and the memory when not enforced by a cgroup, of the given process. """
+        watchMemory = bool(self.limits.memory and not self.cgroup)
+        if not self.limits.runtime and not watchMemory:
+            return
+
+        def watch():
+            from meshroom.core.cancellation import terminateProcessTree
+            startTime = time.time()
+            interval = min(memoryCheckInterval, self.limits.runtime) if self.limits.runtime else memoryCheckInterval
+            while not self._stopEvent.wait(interval):
+                if self.limits.runtime and time.time() - startTime > self.limits.runtime:
+                    self._runtimeExceeded = True
+                    logging.warning('Chunk "{}" exceeded its maximum runtime: terminate it.'.format(self.name))
+                elif watchMemory and self._memoryUsage(process) > self.limits.memory:
+                    self._memoryExceeded = True
+                    logging.warning('Chunk "{}" exceeded its memory limit: terminate it.'.format(self.name))
+                else:
+                    continue
+                try:
+                    terminateProcessTree(process)
+                except Exception:
+                    pass
+                return
+
+        self._watchThread = threading.Thread(target=watch)
+        self._watchThread.daemon = True
+        self._watchThread.start()
+
+    def _oomKilled(self):
+        try:
+            with open(os.path.join(self.cgroup, 'memory.events'), 'r') as f:
+                events = dict(line.split() for line in f if line.strip())
+            return int(events.get('oom_kill', 0)) > 0
+        except (IOError, OSError, ValueError):
+            return False
+
+    def finish(self, returnCode):
+        """
+        Stop watching the process and release the cgroup.
+
+        Returns:
+            str: the reason of the failure if a limit has been reached, None otherwise
+        """
+        self._stopEvent.set()
+        if self._watchThread:
+            self._watchThread.join()
+        reason = None
+        if self._runtimeExceeded:
+            reason = 'Maximum runtime exceeded ({}s).'.format(self.limits.runtime)
+        elif self._memoryExceeded or (self.cgroup and self._oomKilled()):
+            reason = 'Memory limit exceeded ({}).'.format(bytes2human(self.limits.memory))
+        elif returnCode and returnCode < 0 and -returnCode == getattr(signal, 'SIGXCPU', None):
+            reason = 'CPU time limit exceeded.'
+        elif returnCode and self.limits.addressSpace:
+            # allocation failures are not distinguishable from other errors with setrlimit
+            reason = 'Process failed while its address space was limited to {}.'.format(
+                bytes2human(self.limits.addressSpace))
+        self._removeCgroup()
+        return reason
+
+    def _removeCgroup(self):
+        if self.cgroup:
+            try:
+                # kill the remaining processes of the chunk
+                if os.path.exists(os.path.join(self.cgroup, 'cgroup.kill')):
+                    with open(os.path.join(self.cgroup, 'cgroup.kill'), 'w') as f:
+                        f.write('1')
+                os.rmdir(self.cgroup)
+            except OSError as e:
+                logging.debug('Failed to remove cgroup "{}": {}'.format(self.cgroup, str(e)))
+            self.cgroup = None
+
+
+def processLimiter(name, limits):
+    """ Return the limiter of a process, None if resource limits are disabled or not supported, or there is no limit. """
+    if not meshroom.useResourceLimits or os.name != 'posix' or not limits:
+        return None
+    return ChunkLimiter(name, limits)
+
+
+def chunkLimiter(chunk):
+    """ Return the limiter of a chunk process, None if resource limits are disabled or not supported. """
+    if not meshroom.useResourceLimits or os.name != 'posix':
+        return None
+    return processLimiter(chunk.name, ResourceLimits.fromNodeDesc(chunk.node.nodeDesc))
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Staging of chunk inputs and outputs on a host-local scratch folder.
+
+When the cache is on a network storage, the many small random reads and writes of the processing
+binaries are much faster on a local disk. When MESHROOM_SCRATCH_DIR is set, the resolved inputs of
+a command line chunk are hardlinked (or copied) into a private scratch folder, the command line is
+built with the staged paths and the outputs are written locally. On success, the outputs are moved
+into the node internal folder, each file being copied next to its final path and then renamed
+(like getWritingFilepath/renameWritingToFinalPath for status files), so that readers never see
+partial files. Status, log and statistics files are not staged.
+
+Inputs are staged once per node: the chunks of a node computed on the same host share its staged
+inputs, protected by a lock file (an exclusive lock to stage them, a shared lock while they are used).
+The last chunk using them removes them. Without flock (Windows), each chunk stages its own inputs.
+"""
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+from meshroom.core import pyCompatibility
+
+# Host-local scratch folder, staging is disabled when empty
+scratchDir = os.environ.get('MESHROOM_SCRATCH_DIR', '')
+
+
+def _linkOrCopy(src, dst):
+    """ Hardlink 'src' to 'dst' if they are on the same device, copy it otherwise. """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def _linkOrCopyTree(src, dst):
+    """ Hardlink or copy the files of the folder 'src' into the new folder 'dst'. """
+    for root, dirs, files in os.walk(src, followlinks=True):
+        dstRoot = os.path.normpath(os.path.join(dst, os.path.relpath(root, src)))
+        os.makedirs(dstRoot)
+        for filename in files:
+            _linkOrCopy(os.path.join(root, filename), os.path.join(dstRoot, filename))
+
+
+class ChunkStaging(object):
+    """
+    Scratch folder of a chunk, with the mapping between the original paths and the staged ones.
+    """
+    stagedMarker = '.staged'
+
+    def __init__(self, chunk, folder, inputsFolder=None):
+        """
+        Args:
+            chunk (NodeChunk): the staged chunk
+            folder (str): the private scratch folder of the chunk
+            inputsFolder (str): the folder of the staged inputs, shared by the chunks of the node
+                                (in the private folder if None)
+        """
+        self.chunk = chunk
+        self.folder = folder
+        self.outputFolder = os.path.join(folder, 'output')
+        self.inputsFolder = inputsFolder or os.path.join(folder, 'inputs')
+        self.internalFolder = os.path.normpath(chunk.node.internalFolder)
+        self._paths = [(self.internalFolder, self.outputFolder)]  # (original path, staged path)
+        self._inputsLock = None
+
+    def _stagedPaths(self):
+        """ Return the existing input files and folders of the chunk, with their path in the inputs folder. """
+        paths = []
+        staged = dict(self._paths)
+        for path in self.chunk.node.getInputFileValues():
+            path = os.path.normpath(path)
+            if path in staged or not os.path.exists(path) or path.startswith(self.internalFolder + os.sep):
+                continue
+            staged[path] = os.path.join(self.inputsFolder, str(len(staged)), os.path.basename(path))
+            paths.append((path, staged[path]))
+        return paths
+
+    def _stageFiles(self, paths):
+        # remove what a failed chunk may have partially staged
+        shutil.rmtree(self.inputsFolder, ignore_errors=True)
+        os.makedirs(self.inputsFolder)
+        for path, dst in paths:
+            os.makedirs(os.path.dirname(dst))
+            if os.path.isdir(path):
+                _linkOrCopyTree(path, dst)
+            else:
+                _linkOrCopy(path, dst)
+        open(os.path.join(self.inputsFolder, self.stagedMarker), 'w').close()
+
+    def stageInputs(self):
+        """
+        Hardlink or copy the existing input files and folders of the chunk into the scratch folder,
+        unless they have already been staged by another chunk of the node.
+        """
+        os.makedirs(self.outputFolder)
+        parentFolder = os.path.dirname(self.inputsFolder)
+        if not os.path.isdir(parentFolder):
+            os.makedirs(parentFolder)
+        paths = self._stagedPaths()
+        marker = os.path.join(self.inputsFolder, self.stagedMarker)
+        try:
+            import fcntl
+        except ImportError:
+            self._stageFiles(paths)
+        else:
+            self._inputsLock = open(self.inputsFolder + '.lock', 'a')
+            while True:
+                # a shared lock while the inputs are used, an exclusive one to stage them
+                fcntl.flock(self._inputsLock.fileno(), fcntl.LOCK_SH)
+                if os.path.exists(marker):
+                    break
+                fcntl.flock(self._inputsLock.fileno(), fcntl.LOCK_EX)
+                if not os.path.exists(marker):
+                    self._stageFiles(paths)
+                # lock conversions are not atomic: check again that the inputs have not been removed meanwhile
+        self._paths.extend(paths)
+
+    def stagedValue(self, value):
+        """ Replace the original paths by the staged ones in a command line variable. """
+        # longest paths first, so that nested paths are mapped to their own staged copy
+        for src, dst in sorted(self._paths, key=lambda p: len(p[0]), reverse=True):
+            value = re.sub(re.escape(src) + r'(?=[/\\"\s]|$)', dst.replace('\\', r'\\'), value)
+        return value
+
+    def cmdVars(self):
+        """ Return the command line variables of the chunk node, pointing to the staged paths. """
+        return {k: self.stagedValue(v) if isinstance(v, pyCompatibility.basestring) else v
+                for k, v in self.chunk.node._cmdVars.items()}
+
+    def commitOutputs(self):
+        """ Move the staged outputs into the node internal folder, each file being replaced atomically. """
+        from meshroom.core.node import getWritingFilepath, renameWritingToFinalPath
+        for root, dirs, files in os.walk(self.outputFolder):
+            dstRoot = os.path.join(self.internalFolder, os.path.relpath(root, self.outputFolder))
+            if not os.path.isdir(dstRoot):
+                os.makedirs(dstRoot)
+            for filename in files:
+                dst = os.path.join(dstRoot, filename)
+                writingFilepath = getWritingFilepath(dst)
+                shutil.copy2(os.path.join(root, filename), writingFilepath)
+                renameWritingToFinalPath(writingFilepath, dst)
+
+    def cleanup(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        if not self._inputsLock:
+            return
+        import fcntl
+        try:
+            # the last chunk using the shared inputs removes them
+            fcntl.flock(self._inputsLock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            shutil.rmtree(self.inputsFolder, ignore_errors=True)
+        except (IOError, OSError):
+            pass
+        finally:
+            self._inputsLock.close()
+            self._inputsLock = None
+
+
+def chunkStaging(chunk):
+    """
+    Create the scratch folder of a chunk and stage its inputs.
+
+    Returns:
+        ChunkStaging: the staging of the chunk, None if staging is disabled or the scratch folder unusable
+    """
+    if not scratchDir:
+        return None
+    try:
+        if not os.path.isdir(scratchDir):
+            os.makedirs(scratchDir)
+        folder = tempfile.mkdtemp(prefix='{}_'.format(chunk.name), dir=scratchDir)
+    except OSError as e:
+        logging.warning('Cannot create scratch folder in "{}": {}'.format(scratchDir, str(e)))
+        return None
+    try:
+        import fcntl
+    except ImportError:
+        # the inputs cannot be shared between chunks without lock
+        inputsFolder = None
+    else:
+        internalFolder = os.path.normpath(chunk.node.internalFolder)
+        inputsFolder = os.path.join(scratchDir, 'inputs', '{}_{}'.format(chunk.node.nodeType,
+                                                                          os.path.basename(internalFolder)))
+    staging = ChunkStaging(chunk, folder, inputsFolder)
+    try:
+        staging.stageInputs()
+    except (IOError, OSError, shutil.Error) as e:
+        logging.warning('Cannot stage the inputs of "{}", run without staging: {}'.format(chunk.name, str(e)))
+        staging.cleanup()
+        return None
+    return staging
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Precompiled graph snapshots, for read-only tools.
+
+A snapshot stores the resolved data of a graph (node types, attribute values, edges, uids,
+internal folders and chunks) in a json file next to its ".mg" file: '{graph}.mg.snapshot'.
+It avoids loading the plugins, creating the nodes and resolving the graph to query the
+status or the statistics of its nodes.
+
+A snapshot is valid as long as the content of the ".mg" file, the Meshroom and Python versions
+and the versions of its node types are unchanged.
+"""
+import hashlib
+import json
+import logging
+import os
+import sys
+
+import meshroom
+import meshroom.core
+from meshroom.core.node import StatusData, getWritingFilepath, renameWritingToFinalPath
+
+snapshotExtension = '.snapshot'
+snapshotVersion = 1
+
+
+def snapshotFilepath(graphFilepath):
+    return graphFilepath + snapshotExtension
+
+
+def fileHash(filepath):
+    """ Hash the content of a file using sha1. """
+    hashObject = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hashObject.update(block)
+    return hashObject.hexdigest()
+
+
+def _snapshotKey(graphHash):
+    return {
+        'version': snapshotVersion,
+        'graphHash': graphHash,
+        'meshroomVersion': meshroom.__version__,
+        'pythonVersion': list(sys.version_info[:2]),
+    }
+
+
+def _nodeTypeVersion(nodeType):
+    """ Return the version of a registered node type (without loading its plugin), None if unknown. """
+    if nodeType not in meshroom.core.nodesDesc.keys():
+        return None
+    return meshroom.core.nodesDesc.nodeTypeInfo(nodeType)['version']
+
+
+class ChunkSnapshot(object):
+    """ Files of a node chunk. """
+    def __init__(self, node, data):
+        self.node = node
+        self.name = data['name']
+        self.index = data['index']
+        # files of non parallelized nodes have no index prefix
+        self._prefix = '' if data['blockSize'] == 0 else str(self.index) + '.'
+
+    def _file(self, name):
+        return os.path.join(self.node.internalFolder, self._prefix + name)
+
+    @property
+    def statusFile(self):
+        return self._file('status')
+
+    @property
+    def statisticsFile(self):
+        return self._file('statistics')
+
+    @property
+    def logFile(self):
+        return self._file('log')
+
+    @property
+    def status(self):
+        """ Read the current status of the chunk from its status file. """
+        status = StatusData(self.node.name, self.node.nodeType)
+        try:
+            with open(self.statusFile, 'r') as jsonFile:
+                status.fromDict(json.load(jsonFile))
+        except (IOError, OSError, ValueError, KeyError):
+            status.reset()
+        return status
+
+    @property
+    def statistics(self):
+        """ Read the statistics of the chunk from its statistics file, as a dict. """
+        try:
+            with open(self.statisticsFile, 'r') as jsonFile:
+                return json.load(jsonFile)
+        except (IOError, OSError, ValueError):
+            return {}
+
+
+class NodeSnapshot(object):
+    """ Resolved data of a node. """
+    def __init__(self, graph, data):
+        self.graph = graph
+        self.name = data['name']
+        self.nodeType = data['nodeType']
+        self.version = data['version']
+        self.inputs = data['inputs']
+        self.outputs = data['outputs']
+        # json object keys are strings
+        self.uids = {int(uidIndex): value for uidIndex, value in data['uids'].items()}
+        self.dependencies = data['dependencies']
+        self._internalFolder = data['internalFolder']
+        self.chunks = [ChunkSnapshot(self, chunkData) for chunkData in data['chunks']]
+
+    @property
+    def internalFolder(self):
+        return self._internalFolder.format(cache=self.graph.cacheDir)
+
+
+class GraphSnapshot(object):
+    """
+    Resolved data of a graph, in topological order.
+    """
+    def __init__(self, data, cacheDir=None):
+        self.key = data['key']
+        self.nodeVersions = data['nodeVersions']
+        self.name = data['name']
+        self.cacheDir = cacheDir or data['cacheDir']
+        self.nodes = [NodeSnapshot(self, nodeData) for nodeData in data['nodes']]
+        self._nodesByName = {node.name: node for node in self.nodes}
+
+    @staticmethod
+    def fromGraph(graph, graphHash):
+        """ Return the snapshot data of a loaded and updated graph, read from a file with the given hash. """
+        nodes, _ = graph.dfsOnFinish()
+        nodesData = []
+        for node in nodes:
+            # keep the cache folder as a variable, to be able to override it
+            internalFolder = node._internalFolder.format(**dict(node._cmdVars, cache='{cache}'))
+            nodesData.append({
+                'name': node.name,
+                'nodeType': node.nodeType,
+                'version': _nodeTypeVersion(node.nodeType),
+                'inputs': {a.name: a.getExportValue() for a in node.attributes if a.isInput},
+                'outputs': {a.name: a.value for a in node.attributes if a.isOutput},
+                'uids': dict(node._uids),
+                'dependencies': sorted(set(n.name for n in node.getInputNodes(recursive=False, dependenciesOnly=True))),
+                'internalFolder': internalFolder,
+                'chunks': [{'name': chunk.name, 'index': chunk.index, 'blockSize': chunk.range.blockSize}
+                           for chunk in node.chunks],
+            })
+        return {
+            'key': _snapshotKey(graphHash),
+            'nodeVersions': {node.nodeType: _nodeTypeVersion(node.nodeType) for node in nodes},
+            'name': graph.name,
+            'cacheDir': graph.cacheDir,
+            'nodes': nodesData,
+        }
+
+    def isValid(self, graphHash):
+        """ Whether the snapshot is up-to-date with the graph file content and the node types. """
+        if self.key != _snapshotKey(graphHash):
+            return False
+        return all(_nodeTypeVersion(nodeType) == version for nodeType, version in self.nodeVersions.items())
+
+    def node(self, nodeName):
+        return self._nodesByName.get(nodeName)
+
+    def dfsOnFinish(self, startNodes=None):
+        """ Return the given nodes and their ancestors (all nodes by default), in topological order. """
+        if not startNodes:
+            return list(self.nodes)
+        visited = set()
+        toVisit = [node.name for node in startNodes]
+        while toVisit:
+            nodeName = toVisit.pop()
+            if nodeName in visited:
+                continue
+            visited.add(nodeName)
+            toVisit.extend(self._nodesByName[nodeName].dependencies)
+        return [node for node in self.nodes if node.name in visited]
+
+
+def saveSnapshot(graph, graphHash=None):
+    """
+    Save the snapshot of a graph next to its file.
+    'graphHash' is the hash of the file content the graph has been loaded from (default: current file content).
+    """
+    filepath = snapshotFilepath(graph.filepath)
+    data = GraphSnapshot.fromGraph(graph, graphHash or fileHash(graph.filepath))
+    writingFilepath = getWritingFilepath(filepath)
+    with open(writingFilepath, 'w') as f:
+        json.dump(data, f)
+    renameWritingToFinalPath(writingFilepath, filepath)
+
+
+def loadSnapshot(graphFilepath, cacheDir=None, create=True):
+    """
+    Load the snapshot of a graph file.
+    If it does not exist or is outdated, load the graph and save its snapshot if 'create' is True.
+
+    Returns:
+        GraphSnapshot: the up-to-date snapshot, or None
+    """
+    graphHash = fileHash(graphFilepath)
+    filepath = snapshotFilepath(graphFilepath)
+    try:
+        with open(filepath, 'r') as f:
+            snapshot = GraphSnapshot(json.load(f), cacheDir)
+        if snapshot.isValid(graphHash):
+            return snapshot
+        logging.debug('Outdated graph snapshot: "{}".'.format(filepath))
+    except (IOError, OSError):
+        pass
+    except Exception as e:
+        logging.warning('Invalid graph snapshot "{}": {}'.format(filepath, str(e)))
+
+    if not create:
+        return None
+    from meshroom.core.graph import loadGraph
+    graph = loadGraph(graphFilepath)
+    try:
+        saveSnapshot(graph, graphHash)
+    except (IOError, OSError) as e:
+        logging.warning('Failed to save graph snapshot "{}": {}'.format(filepath, str(e)))
+    return GraphSnapshot(GraphSnapshot.fromGraph(graph, graphHash), cacheDir)
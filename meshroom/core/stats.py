@@ -1,12 +1,15 @@
 from collections import defaultdict
 import subprocess
+import json
 import logging
-import psutil
 import time
 import threading
 import platform
 import os
 import sys
+import uuid
+
+from meshroom.core.lazyImport import psutil
 
 if sys.version_info[0] == 2:
     # On Python 2 use C implementation for performance and to avoid lots of warnings
@@ -314,3 +317,72 @@ class StatisticsThread(threading.Thread):
     def stopRequest(self):
         """ Request the thread to exit as soon as possible. """
         self._stopFlag.set()
+
+
+class NodeTypesHistory(object):
+    """
+    Persistent per node type statistics (e.g. output size) accumulated over computations,
+    used to predict the resources needed by upcoming computations.
+
+    Values are stored as running means: {nodeType: {key: [mean, count]}}.
+    The history is shared by the processes of the host (and of the farm if the file is on a shared folder):
+    updates are serialized with a lock file. An empty filepath disables the history.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    def load(self):
+        if not self.filepath or not os.path.exists(self.filepath):
+            return {}
+        try:
+            with open(self.filepath, 'r') as jsonFile:
+                return json.load(jsonFile)
+        except Exception as e:
+            logging.debug('Failed to load node types history: "{}".'.format(str(e)))
+            return {}
+
+    def getValue(self, nodeType, key, default=None):
+        """ Return the mean value of 'key' for the given node type, 'default' if unknown. """
+        value = self.load().get(nodeType, {}).get(key)
+        return value[0] if value else default
+
+    def _lock(self):
+        """ Acquire the lock serializing the updates of the history file (None where flock is not available). """
+        try:
+            import fcntl
+        except ImportError:
+            return None
+        lockFile = open(self.filepath + '.lock', 'a')
+        fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+        return lockFile
+
+    def addValue(self, nodeType, key, value):
+        """ Accumulate a new 'value' for 'key' in the history of the given node type. """
+        if not self.filepath:
+            return
+        lockFile = None
+        try:
+            folder = os.path.dirname(self.filepath)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            lockFile = self._lock()
+            data = self.load()
+            mean, count = data.setdefault(nodeType, {}).get(key, [0, 0])
+            data[nodeType][key] = [(mean * count + value) / float(count + 1), count + 1]
+            # written atomically: readers never see a partial file
+            writingFilepath = self.filepath + '.writing.' + str(uuid.uuid4())
+            with open(writingFilepath, 'w') as jsonFile:
+                json.dump(data, jsonFile, indent=4)
+            if platform.system() == 'Windows' and os.path.exists(self.filepath):
+                os.remove(self.filepath)
+            os.rename(writingFilepath, self.filepath)
+        except Exception as e:
+            logging.debug('Failed to save node types history: "{}".'.format(str(e)))
+        finally:
+            if lockFile:
+                lockFile.close()
+
+
+# Disabled unless MESHROOM_NODE_TYPES_HISTORY is set to the history filepath (e.g. ~/.meshroom/nodeTypesHistory.json):
+# computations do not write into the user folder by default
+nodeTypesHistory = NodeTypesHistory(os.path.expanduser(os.environ.get('MESHROOM_NODE_TYPES_HISTORY', '')))
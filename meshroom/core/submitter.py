@@ -1,7 +1,65 @@
 #!/usr/bin/env python
 # coding:utf-8
+import os
+from collections import defaultdict
 
 from meshroom.common import BaseObject, Property
+from meshroom.core import stats
+
+# Nodes whose estimated duration (in seconds) is below this value are grouped in a single task when possible
+cheapNodeMaxDuration = float(os.environ.get('MESHROOM_SUBMIT_CHEAP_NODE_DURATION', 10))
+
+
+def estimatedDuration(node):
+    """ Return the expected duration of the computation of the given node from the history of its node type, None if unknown. """
+    chunkDuration = stats.nodeTypesHistory.getValue(node.nodeType, 'chunkDuration')
+    if chunkDuration is None:
+        return None
+    return chunkDuration * len(node.chunks)
+
+
+def coalesceNodes(nodes, edges, maxDuration=None):
+    """
+    Group chains of cheap sequential nodes, to compute them back to back in a single task.
+
+    A node is appended to the group of its dependency if both are cheap and not parallelized,
+    and the dependency is its only dependency and has no other dependent node.
+
+    Args:
+        nodes (list): the nodes to submit, in computation order
+        edges (list): the (node, dependency) pairs between the nodes to submit
+        maxDuration (float): maximum estimated duration of a cheap node
+
+    Returns:
+        list: the groups of nodes (list of nodes in computation order)
+    """
+    maxDuration = cheapNodeMaxDuration if maxDuration is None else maxDuration
+    dependencies = defaultdict(set)
+    dependents = defaultdict(set)
+    for u, v in edges:
+        dependencies[u].add(v)
+        dependents[v].add(u)
+
+    def isCheap(node):
+        if node.isParallelized:
+            return False
+        duration = estimatedDuration(node)
+        return duration is not None and duration <= maxDuration
+
+    groups = []
+    nodeGroup = {}
+    for node in nodes:
+        if isCheap(node) and len(dependencies[node]) == 1:
+            parent = next(iter(dependencies[node]))
+            group = nodeGroup.get(parent)
+            if group and group[-1] is parent and len(dependents[parent]) == 1 and isCheap(parent):
+                group.append(node)
+                nodeGroup[node] = group
+                continue
+        group = [node]
+        groups.append(group)
+        nodeGroup[node] = group
+    return groups
 
 
 class BaseSubmitter(BaseObject):
@@ -9,8 +67,11 @@ class BaseSubmitter(BaseObject):
         super(BaseSubmitter, self).__init__(parent)
         self._name = name
 
-    def submit(self, nodes, edges, filepath):
+    def submit(self, nodes, edges, filepath, iterations=None):
         """ Submit the given graph
+         Args:
+             iterations (dict): indices of the chunks to compute per node name, None to compute all chunks
+                                (only given when resubmitting failed chunks, see Graph.dfsFailedToProcess)
          Returns:
              bool: whether the submission succeeded
         """
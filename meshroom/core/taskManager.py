@@ -1,10 +1,16 @@
+import datetime
+import json
 import logging
+import os
+import threading
 from threading import Thread
 from enum import Enum
 
 import meshroom
-from meshroom.common import BaseObject, DictModel, Property, Signal, Slot
-from meshroom.core.node import Status
+from meshroom.common import BaseObject, DictModel, Property, Signal, Slot, Variant
+from meshroom.core import outOfProcess
+from meshroom.core.node import Status, ExecMode, StatusData, getWritingFilepath, renameWritingToFinalPath
+from meshroom.core.prefetch import inputsPrefetcher
 import meshroom.core.graph
 
 
@@ -19,75 +25,174 @@ class State(Enum):
     ERROR = 4
 
 
+def queueFilepath(cacheDir):
+    """ Return the file describing the compute queue of a cache folder, for external tools (see meshroom_status). """
+    return os.path.join(cacheDir, 'computeQueue.json')
+
+
+class ComputeJob(object):
+    """
+    A compute request: nodes to compute in order, with a priority.
+    Jobs are processed by decreasing priority, then by submission order.
+    """
+    def __init__(self, jobId, nodes, priority=0, forceCompute=False, preempt=False):
+        """
+        Args:
+            jobId (int): the job identifier, increasing with the submission order
+            nodes (list of Node): the nodes to compute, each one after its dependencies
+            priority (int): the job priority, higher first
+            forceCompute (bool): compute the nodes even if already computed
+            preempt (bool): stop the running chunk of a lower-priority job to start this one; it is computed again later
+        """
+        self.id = jobId
+        self.nodes = nodes
+        self.priority = priority
+        self.forceCompute = forceCompute
+        self.preempt = preempt
+        self.submitDateTime = datetime.datetime.now().strftime(StatusData.dateTimeFormatting)
+
+    def sortKey(self):
+        return -self.priority, self.id
+
+    def remainingNodes(self):
+        """ Return the nodes which are not computed yet. """
+        nodes = []
+        for node in self.nodes:
+            # if a node does not exist anymore, node.chunks becomes a PySide property
+            try:
+                if not node.isFinishedOrRunning() or node.getGlobalStatus() == Status.RUNNING:
+                    nodes.append(node)
+            except TypeError:
+                pass
+        return nodes
+
+    def toDict(self):
+        return {
+            'id': self.id,
+            'priority': self.priority,
+            'forceCompute': self.forceCompute,
+            'preempt': self.preempt,
+            'submitDateTime': self.submitDateTime,
+            'nodes': [node.name for node in self.remainingNodes()],
+        }
+
+
 class TaskThread(Thread):
     """
-    A thread with a pile of nodes to compute
+    A thread consuming the chunks of the compute jobs, by priority.
+    Chunks computed in worker processes are computed in background threads, concurrently with the next chunks
+    whose dependencies are computed (see meshroom.core.outOfProcess).
     """
-    def __init__(self, manager):
+    def __init__(self, manager, previous=None):
+        """
+        Args:
+            manager (TaskManager): the task manager owning the compute jobs
+            previous (TaskThread): a stopped thread still terminating its running chunk, to wait for before starting
+        """
         Thread.__init__(self, target=self.run)
         self._state = State.IDLE
         self._manager = manager
-        self.forceCompute = False
+        self._previous = previous
+        # the computation has been stopped by the user: the thread ends once its running chunk is terminated
+        self.stopRequested = False
+        # chunks computed in background threads
+        self._backgroundChunks = {}
+        self._wakeEvent = threading.Event()
+        # chunks which failed during this run, not computed again
+        self._failedChunks = set()
+        self._stopAndRestart = False
 
     def isRunning(self):
         return self._state == State.RUNNING
 
-    def run(self):
-        """ Consume compute tasks. """
+    def start(self):
+        # running as soon as started: TaskManager.compute must not start it again before run() is called
         self._state = State.RUNNING
+        Thread.start(self)
 
-        stopAndRestart = False
-
-        for nId, node in enumerate(self._manager._nodesToProcess):
+    def wake(self):
+        """ Wake the thread waiting for the end of a background chunk, to look for a chunk to compute. """
+        self._wakeEvent.set()
 
-            # skip already finished/running nodes
-            if node.isFinishedOrRunning():
+    def run(self):
+        """ Consume compute tasks. """
+        self._state = State.RUNNING
+        if self._previous:
+            # the nodes of the new jobs may depend on the chunk the previous thread is terminating
+            self._previous.join()
+            self._previous = None
+
+        while self.isRunning() and not self._stopAndRestart:
+            self._wakeEvent.clear()
+            backgroundChunks = set(self._backgroundChunks)
+            job, node, chunk = self._manager._nextChunk(exclude=self._failedChunks | backgroundChunks, stopThread=self,
+                                                        canEnd=not backgroundChunks)
+            if chunk is None:
+                if not backgroundChunks:
+                    break
+                # the remaining chunks depend on the background chunks
+                self._wakeEvent.wait()
                 continue
-
-            # if a node does not exist anymore, node.chunks becomes a PySide property
-            try:
-                multiChunks = len(node.chunks) > 1
-            except TypeError:
+            background = outOfProcess.isOutOfProcess(chunk)
+            if background and len(backgroundChunks) >= max(1, outOfProcess.maxWorkers):
+                self._wakeEvent.wait()
                 continue
 
-            for cId, chunk in enumerate(node.chunks):
-                if chunk.isFinishedOrRunning() or not self.isRunning():
-                    continue
+            nodes = self._manager._nodesToProcess
+            nId = nodes.index(node) if node in nodes else 0
+            if len(node.chunks) > 1:
+                logging.info('[{node}/{nbNodes}]({chunk}/{nbChunks}) {nodeName}'.format(
+                    node=nId+1, nbNodes=len(nodes),
+                    chunk=chunk.index+1, nbChunks=len(node.chunks), nodeName=node.nodeType))
+            else:
+                logging.info('[{node}/{nbNodes}] {nodeName}'.format(
+                    node=nId+1, nbNodes=len(nodes), nodeName=node.nodeType))
+            _, _, nextChunk = self._manager._nextChunk(exclude=self._failedChunks | backgroundChunks | {chunk})
+            inputsPrefetcher.prefetch(nextChunk)
+            self._manager._chunkStarted(job, chunk)
+            if background:
+                thread = Thread(target=self._processChunk, args=(job, node, chunk))
+                thread.daemon = True
+                self._backgroundChunks[chunk] = thread
+                thread.start()
+            else:
+                self._processChunk(job, node, chunk)
 
-                if multiChunks:
-                    logging.info('[{node}/{nbNodes}]({chunk}/{nbChunks}) {nodeName}'.format(
-                        node=nId+1, nbNodes=len(self._manager._nodesToProcess),
-                        chunk=cId+1, nbChunks=len(node.chunks), nodeName=node.nodeType))
-                else:
-                    logging.info('[{node}/{nbNodes}] {nodeName}'.format(
-                        node=nId+1, nbNodes=len(self._manager._nodesToProcess), nodeName=node.nodeType))
-                try:
-                    chunk.process(self.forceCompute)
-                except Exception as e:
-                    if chunk.isStopped():
-                        stopAndRestart = True
-                        break
-                    else:
-                        logging.error("Error on node computation: {}".format(e))
-                        nodesToRemove, _ = self._manager._graph.dfsOnDiscover(startNodes=[node], reverse=True)
-                        # remove following nodes from the task queue
-                        for n in nodesToRemove[1:]:  # exclude current node
-                            try:
-                                self._manager._nodesToProcess.remove(n)
-                            except ValueError:
-                                # Node already removed (for instance a global clear of _nodesToProcess)
-                                pass
-                            n.clearSubmittedChunks()
-
-            if stopAndRestart:
-                break
-
-        if stopAndRestart:
+        for thread in list(self._backgroundChunks.values()):
+            thread.join()
+        inputsPrefetcher.stop()
+
+        if self.stopRequested:
+            # the queue has already been reset by TaskManager.requestBlockRestart
+            self._state = State.DEAD
+        elif self._stopAndRestart:
             self._state = State.STOPPED
             self._manager.restartRequested.emit()
-        else:
-            self._manager._nodesToProcess = []
-            self._state = State.DEAD
+        # otherwise, the thread has been set DEAD by _nextChunk when there was nothing left to compute
+
+    def _processChunk(self, job, node, chunk):
+        """ Compute a chunk, in this thread or in a background thread. """
+        try:
+            chunk.process(job.forceCompute)
+        except Exception as e:
+            if self._manager._wasPreempted(chunk):
+                # computed again once the higher-priority jobs are done
+                logging.info('Chunk "{}" preempted by a higher-priority job.'.format(chunk.name))
+                chunk.upgradeStatusTo(Status.SUBMITTED, ExecMode.LOCAL)
+            elif chunk.isStopped():
+                self._stopAndRestart = True
+            else:
+                logging.error("Error on node computation: {}".format(e))
+                self._failedChunks.add(chunk)
+                nodesToRemove, _ = self._manager._graph.dfsOnDiscover(startNodes=[node], reverse=True)
+                # remove following nodes from the task queue
+                for n in nodesToRemove[1:]:  # exclude current node
+                    self._manager.removeNode(n, displayList=False, processList=True)
+                    n.clearSubmittedChunks()
+        finally:
+            self._backgroundChunks.pop(chunk, None)
+            self._manager._chunkEnded(chunk)
+            self.wake()
 
 
 class TaskManager(BaseObject):
@@ -98,35 +203,194 @@ class TaskManager(BaseObject):
         super(TaskManager, self).__init__(parent)
         self._graph = None
         self._nodes = DictModel(keyAttrName='_name', parent=self)
-        self._nodesToProcess = []
         self._nodesExtern = []
+        # compute jobs, and the lock protecting them from the concurrent accesses of the task thread
+        self._jobs = []
+        self._jobsLock = threading.RLock()
+        self._lastJobId = 0
+        # running chunks and their jobs
+        self._runningChunks = {}
+        self._preemptedChunks = set()
         # internal thread in which local tasks are executed
         self._thread = TaskThread(self)
 
-        self._blockRestart = False
         self.restartRequested.connect(self.restart)
 
+    @property
+    def _nodesToProcess(self):
+        """ The nodes to compute, in the order of the jobs. """
+        with self._jobsLock:
+            nodes = []
+            for job in sorted(self._jobs, key=ComputeJob.sortKey):
+                nodes.extend(n for n in job.nodes if n not in nodes)
+            return nodes
+
+    def _nextChunk(self, exclude=(), stopThread=None, canEnd=True):
+        """
+        Return the next chunk to compute: the first chunk to compute of the highest-priority job,
+        whose node does not depend on a queued node which is not computed yet.
+
+        Args:
+            exclude (set): chunks not to return
+            stopThread (TaskThread): the thread asking for a chunk to start computing it;
+                it is stopped if there is nothing left to compute and 'canEnd' is True
+
+        Returns:
+            tuple: (job, node, chunk), with None values if there is no chunk to compute
+        """
+        with self._jobsLock:
+            if stopThread and stopThread.stopRequested:
+                # the jobs submitted after the stop request are computed by a new thread
+                return None, None, None
+            queuedNodes = set(self._nodesToProcess)
+            for job in sorted(self._jobs, key=ComputeJob.sortKey):
+                for node in job.nodes:
+                    # if a node does not exist anymore, node.chunks becomes a PySide property
+                    try:
+                        if node.isFinishedOrRunning():
+                            continue
+                        chunks = list(node.chunks)
+                    except TypeError:
+                        continue
+                    if any(n in queuedNodes and n.getGlobalStatus() != Status.SUCCESS
+                           for n in node.getInputNodes(recursive=False, dependenciesOnly=True)):
+                        # computed once its dependencies are
+                        continue
+                    for chunk in chunks:
+                        if chunk not in exclude and not chunk.isFinishedOrRunning():
+                            return job, node, chunk
+            if stopThread and canEnd:
+                self._jobs = []
+                stopThread._state = State.DEAD
+                self._saveQueue()
+            return None, None, None
+
+    def _chunkStarted(self, job, chunk):
+        with self._jobsLock:
+            self._runningChunks[chunk] = job
+            self._saveQueue()
+
+    def _chunkEnded(self, chunk):
+        with self._jobsLock:
+            self._runningChunks.pop(chunk, None)
+            self._preemptedChunks.discard(chunk)
+            # remove the finished jobs
+            self._jobs = [job for job in self._jobs if job.remainingNodes()]
+            self._saveQueue()
+        self.jobsChanged.emit()
+
+    def _wasPreempted(self, chunk):
+        with self._jobsLock:
+            return chunk in self._preemptedChunks
+
+    def _preempt(self, job):
+        """ Stop the running chunks which belong to a job with a lower priority than 'job'. """
+        with self._jobsLock:
+            # the running chunks cannot end meanwhile: _chunkEnded needs the lock
+            for chunk, runningJob in list(self._runningChunks.items()):
+                if runningJob.priority >= job.priority:
+                    continue
+                if not chunk.isStoppable():
+                    # chunks computed in this process cannot be stopped
+                    continue
+                self._preemptedChunks.add(chunk)
+                # does nothing if the chunk has just finished (see NodeChunk.stopProcess)
+                chunk.stopProcess()
+
+    def _saveQueue(self):
+        """ Write the compute queue in the cache folder of the graph. """
+        if self._graph is None:
+            return
+        filepath = queueFilepath(self._graph.cacheDir)
+        data = {
+            'running': sorted(chunk.name for chunk in self._runningChunks),
+            'jobs': self.getJobs(),
+        }
+        try:
+            if not os.path.exists(self._graph.cacheDir):
+                os.makedirs(self._graph.cacheDir)
+            writingFilepath = getWritingFilepath(filepath)
+            with open(writingFilepath, 'w') as f:
+                json.dump(data, f, indent=4)
+            renameWritingToFinalPath(writingFilepath, filepath)
+        except (IOError, OSError) as e:
+            logging.warning('Cannot save the compute queue: {}'.format(str(e)))
+
+    def getJobs(self):
+        """ Return the description of the compute jobs, in processing order. """
+        with self._jobsLock:
+            return [job.toDict() for job in sorted(self._jobs, key=ComputeJob.sortKey)]
+
+    @Slot(int, int)
+    def setJobPriority(self, jobId, priority):
+        """ Change the priority of a job, preempting the running chunk if needed. """
+        with self._jobsLock:
+            jobs = [job for job in self._jobs if job.id == jobId]
+            if not jobs:
+                return
+            jobs[0].priority = priority
+            self._saveQueue()
+        if jobs[0].preempt:
+            self._preempt(jobs[0])
+        self.jobsChanged.emit()
+
+    @Slot(int)
+    def cancelJob(self, jobId):
+        """ Remove a job from the queue; its nodes queued by no other job are reset. """
+        with self._jobsLock:
+            jobs = [job for job in self._jobs if job.id == jobId]
+            if not jobs:
+                return
+            self._jobs.remove(jobs[0])
+            otherNodes = set(n for job in self._jobs for n in job.nodes)
+            self._saveQueue()
+        for node in jobs[0].nodes:
+            if node in otherNodes:
+                continue
+            if node.getGlobalStatus() == Status.RUNNING:
+                node.stopComputation()
+            else:
+                node.clearSubmittedChunks()
+                self.removeNode(node, displayList=True)
+        self.jobsChanged.emit()
+
     def requestBlockRestart(self):
         """
-        Block computing.
+        Block computing: the queued jobs are removed and their queued chunks reset, and the task thread ends
+        once its running chunk is terminated, without restarting.
+        Jobs submitted from then on are computed by a new thread.
         Note: should only be used to completely stop computing.
         """
-        self._blockRestart = True
+        with self._jobsLock:
+            self._thread.stopRequested = True
+            self._thread.wake()
+            stoppedJobs = self._jobs
+            self._jobs = []
+            self._saveQueue()
+        nodes = []
+        for job in stoppedJobs:
+            nodes.extend(n for n in job.nodes if n not in nodes)
+        for node in self.resetQueuedChunks(nodes):
+            self.removeNode(node, displayList=True)
+        self.jobsChanged.emit()
+
+    def resetQueuedChunks(self, nodes):
+        """
+        Reset the status of the queued chunks of the given nodes.
 
-    def blockRestart(self):
-        """ Avoid the automatic restart of computing. """
-        for node in self._nodesToProcess:
+        Returns:
+            list: the nodes whose chunks have all been reset
+        """
+        resetNodes = []
+        for node in nodes:
             chunkCount = 0
             for chunk in node.chunks:
                 if chunk.status.status in (Status.SUBMITTED, Status.ERROR):
                     chunk.upgradeStatusTo(Status.NONE)
                     chunkCount += 1
             if chunkCount == len(node.chunks):
-                self.removeNode(node, displayList=True)
-
-        self._blockRestart = False
-        self._nodesToProcess = []
-        self._thread._state = State.DEAD
+                resetNodes.append(node)
+        return resetNodes
 
     @Slot()
     def restart(self):
@@ -134,14 +398,9 @@ class TaskManager(BaseObject):
         Restart computing when thread has been stopped.
         Note: this is done like this to avoid app freezing.
         """
-        # Make sure to wait the end of the current thread
-        self._thread.join()
-
-        # Avoid restart if thread was globally stopped
-        if self._blockRestart:
-            self.blockRestart()
-            return
+        # Called by the thread as its last action: do not wait for its end, which would block the UI thread
 
+        # the thread has been globally stopped, or replaced by a new one
         if self._thread._state != State.STOPPED:
             return
 
@@ -161,15 +420,18 @@ class TaskManager(BaseObject):
         self._thread = TaskThread(self)
         self._thread.start()
 
-    def compute(self, graph=None, toNodes=None, forceCompute=False, forceStatus=False):
+    def compute(self, graph=None, toNodes=None, forceCompute=False, forceStatus=False, priority=0, preempt=False):
         """
         Start graph computation, from root nodes to leaves - or nodes in 'toNodes' if specified.
         Computation tasks (NodeChunk) happen in a separate thread (see TaskThread).
+        Each call adds a job to the compute queue, processed by priority.
 
         :param graph: the graph to consider.
         :param toNodes: specific leaves, all graph leaves if None.
         :param forceCompute: force the computation despite nodes status.
         :param forceStatus: force the computation even if some nodes are submitted externally.
+        :param priority: the priority of the job, higher first.
+        :param preempt: stop the running chunk of a lower-priority job, to compute it again later.
         """
         self._graph = graph
 
@@ -198,6 +460,7 @@ class TaskManager(BaseObject):
             self.checkCompatibilityNodes(graph, nodes, "COMPUTATION")  # name of the context is important for QML
             self.checkDuplicates(nodes, "COMPUTATION")  # name of the context is important for QML
 
+            jobNodes = nodes
             nodes = [node for node in nodes if not self.contains(node)]  # be sure to avoid non-real conflicts
             chunksInConflict = self.getAlreadySubmittedChunks(nodes)
 
@@ -222,13 +485,29 @@ class TaskManager(BaseObject):
             node.beginSequence(forceCompute)
 
         self._nodes.update(nodes)
-        self._nodesToProcess.extend(nodes)
 
-        if self._thread._state == State.IDLE:
-            self._thread.start()
-        elif self._thread._state in (State.DEAD, State.ERROR):
-            self._thread = TaskThread(self)
-            self._thread.start()
+        with self._jobsLock:
+            self._lastJobId += 1
+            # the job also refers to its nodes already queued by other jobs, to compute them first if needed
+            job = ComputeJob(self._lastJobId, nodes if forceCompute else jobNodes, priority, forceCompute, preempt)
+            self._jobs.append(job)
+            self._saveQueue()
+
+            if self._thread._state == State.IDLE:
+                self._thread.start()
+            elif self._thread._state in (State.DEAD, State.ERROR):
+                self._thread = TaskThread(self)
+                self._thread.start()
+            elif self._thread.stopRequested:
+                # the stopped thread is still terminating its running chunk
+                self._thread = TaskThread(self, previous=self._thread)
+                self._thread.start()
+            else:
+                # the running thread may wait for the end of its background chunks
+                self._thread.wake()
+        if preempt:
+            self._preempt(job)
+        self.jobsChanged.emit()
 
         # At the end because it raises a WarningError but should not stop processing
         if not allReady:
@@ -264,8 +543,11 @@ class TaskManager(BaseObject):
         """
         if displayList and self._nodes.contains(node):
             self._nodes.pop(node.name)
-        if processList and node in self._nodesToProcess:
-            self._nodesToProcess.remove(node)
+        if processList:
+            with self._jobsLock:
+                for job in self._jobs:
+                    if node in job.nodes:
+                        job.nodes.remove(node)
         if externList and node in self._nodesExtern:
             self._nodesExtern.remove(node)
 
@@ -276,7 +558,8 @@ class TaskManager(BaseObject):
         """
         self._nodes.clear()
         self._nodesExtern = []
-        self._nodesToProcess = []
+        with self._jobsLock:
+            self._jobs = []
 
     def updateNodes(self):
         """
@@ -367,12 +650,13 @@ class TaskManager(BaseObject):
         raise RuntimeError("[{}] Impossible Process:\n"
                            "There is no node able to be processed.".format(context))
 
-    def submit(self, graph, submitter=None, toNodes=None):
+    def submit(self, graph, submitter=None, toNodes=None, failedOnly=False):
         """
         Nodes are send to the renderfarm
         :param graph:
         :param submitter:
         :param toNodes:
+        :param failedOnly: resubmit only the failed or stopped chunks and their downstream nodes
         :return:
         """
 
@@ -408,7 +692,11 @@ class TaskManager(BaseObject):
         if not toNodes:
             self.raiseImpossibleProcess("SUBMITTING")
 
-        nodesToProcess, edgesToProcess = graph.dfsToProcess(startNodes=toNodes)
+        iterations = None
+        if failedOnly:
+            nodesToProcess, edgesToProcess, iterations = graph.dfsFailedToProcess(startNodes=toNodes)
+        else:
+            nodesToProcess, edgesToProcess = graph.dfsToProcess(startNodes=toNodes)
         if not nodesToProcess:
             logging.warning('Nothing to compute')
             return
@@ -422,11 +710,14 @@ class TaskManager(BaseObject):
         logging.info("Edges to process: {}".format(edgesToProcess))
 
         try:
-            res = sub.submit(nodesToProcess, edgesToProcess, graph.filepath)
+            if iterations is not None:
+                res = sub.submit(nodesToProcess, edgesToProcess, graph.filepath, iterations=iterations)
+            else:
+                res = sub.submit(nodesToProcess, edgesToProcess, graph.filepath)
             if res:
                 for node in nodesToProcess:
                     node.destroyed.connect(lambda obj=None, name=node.name: self.onNodeDestroyed(obj, name))
-                    node.submit()  # update node status
+                    node.submit(iterations=iterations.get(node.name) if iterations else None)  # update node status
             self._nodes.update(nodesToProcess)
             self._nodesExtern.extend(nodesToProcess)
 
@@ -458,4 +749,6 @@ class TaskManager(BaseObject):
         return out
 
     nodes = Property(BaseObject, lambda self: self._nodes, constant=True)
+    jobsChanged = Signal()
+    jobs = Property(Variant, getJobs, notify=jobsChanged)
     restartRequested = Signal()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Advisory locks on node uids, shared by all processes computing in the same cache folder.
+
+Duplicate nodes are only detected inside a loaded graph. These locks prevent several processes
+(e.g. the UI and a render farm job) from computing the same node chunk at the same time:
+the second process waits for the end of the computation and reuses its result.
+
+Locks rely on flock when available. As flock may not be shared between hosts on network
+filesystems, the lock owner also refreshes a heartbeat (the lock file modification time):
+a lock whose heartbeat is older than the lease duration is considered as released.
+"""
+import errno
+import json
+import logging
+import os
+import platform
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+
+class UidLock(object):
+    """
+    Inter-process lock on a file path, with a heartbeat lease.
+    """
+    heartbeatInterval = 10.0
+    leaseDuration = 60.0
+    pollInterval = 1.0
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.owner = {'host': platform.node(), 'pid': os.getpid(), 'thread': threading.current_thread().ident}
+        self._fd = None
+        self._heartbeatThread = None
+        self._stopHeartbeat = threading.Event()
+
+    def _readOwner(self):
+        try:
+            with open(self.filepath, 'r') as f:
+                content = f.read()
+            return json.loads(content) if content else None
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _isOwnerAlive(self, owner):
+        """ Whether the process of the given owner still holds the lock. """
+        try:
+            age = time.time() - os.path.getmtime(self.filepath)
+        except OSError:
+            return False
+        if age > self.leaseDuration:
+            return False
+        if owner.get('host') == self.owner['host']:
+            if owner.get('pid') == self.owner['pid']:
+                # another thread of this process
+                return owner.get('thread') != self.owner['thread']
+            try:
+                os.kill(owner.get('pid'), 0)
+            except OSError as e:
+                return e.errno == errno.EPERM
+            except (TypeError, ValueError):
+                return False
+        return True
+
+    def _tryAcquire(self):
+        parentFolder = os.path.dirname(self.filepath)
+        if parentFolder and not os.path.exists(parentFolder):
+            try:
+                os.makedirs(parentFolder)
+            except OSError:
+                pass
+        if fcntl is None:
+            try:
+                fd = os.open(self.filepath, os.O_RDWR | os.O_CREAT | os.O_EXCL)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                owner = self._readOwner()
+                if owner is None or not self._isOwnerAlive(owner):
+                    # expired lease: release the lock for the next attempt
+                    try:
+                        os.remove(self.filepath)
+                    except OSError:
+                        pass
+                return False
+        else:
+            fd = os.open(self.filepath, os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                os.close(fd)
+                return False
+            try:
+                # the lock file has been removed by its previous owner after we opened it
+                if os.fstat(fd).st_ino != os.stat(self.filepath).st_ino:
+                    os.close(fd)
+                    return False
+            except OSError:
+                os.close(fd)
+                return False
+            owner = self._readOwner()
+            if owner is not None and owner != self.owner and self._isOwnerAlive(owner):
+                # flock is not shared with the owner host
+                os.close(fd)
+                return False
+        os.ftruncate(fd, 0)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, json.dumps(self.owner).encode('utf-8'))
+        os.fsync(fd)
+        self._fd = fd
+        return True
+
+    def acquire(self, blocking=True, timeout=None, waitCallback=None, stopEvent=None):
+        """
+        Acquire the lock.
+
+        Args:
+            blocking (bool): whether to wait until the lock is released by its owner
+            timeout (float): maximum waiting time in seconds, None to wait indefinitely
+            waitCallback (callable): called once if the lock is held by another owner
+            stopEvent (threading.Event): interrupts the wait when set
+
+        Returns:
+            bool: whether the lock has been acquired
+        """
+        startTime = time.time()
+        waiting = False
+        while not self._tryAcquire():
+            if not blocking or (timeout is not None and time.time() - startTime > timeout):
+                return False
+            if not waiting and waitCallback:
+                waitCallback(self._readOwner())
+            waiting = True
+            if stopEvent is not None:
+                if stopEvent.wait(self.pollInterval):
+                    return False
+            else:
+                time.sleep(self.pollInterval)
+        self._stopHeartbeat.clear()
+        self._heartbeatThread = threading.Thread(target=self._heartbeat)
+        self._heartbeatThread.daemon = True
+        self._heartbeatThread.start()
+        return True
+
+    def _heartbeat(self):
+        while not self._stopHeartbeat.wait(self.heartbeatInterval):
+            try:
+                os.utime(self.filepath, None)
+            except OSError as e:
+                logging.debug('Failed to refresh lock "{}": {}'.format(self.filepath, str(e)))
+
+    def release(self):
+        if self._fd is None:
+            return
+        self._stopHeartbeat.set()
+        self._heartbeatThread.join()
+        try:
+            os.remove(self.filepath)
+        except OSError:
+            pass
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    @property
+    def locked(self):
+        return self._fd is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+def chunkLockFilepath(chunk):
+    """ Return the lock file of a node chunk, next to the node internal folder ('{nodeType}/{uid}[.{i}].lock'). """
+    folder = chunk.node.internalFolder.rstrip('/\\')
+    if chunk.range.blockSize == 0:
+        return folder + '.lock'
+    return '{}.{}.lock'.format(folder, chunk.index)
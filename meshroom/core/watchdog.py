@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Watchdog of the processes of running chunks.
+
+A chunk process is considered hung when neither its CPU time (including its child processes)
+nor its log file grow during an inactivity window (stuck I/O, deadlock...). The watchdog then
+kills its process tree, so that the chunk fails with an explicit reason instead of staying
+RUNNING forever, and lets the caller restart it a limited number of times.
+"""
+import logging
+import os
+import threading
+import time
+
+from meshroom.core.lazyImport import psutil
+
+# Inactivity window (in seconds) after which a chunk process is killed, 0 to disable the watchdog
+inactivityTimeout = float(os.environ.get('MESHROOM_WATCHDOG_TIMEOUT', '0'))
+# Number of times a hung chunk process is restarted
+maxRestarts = int(os.environ.get('MESHROOM_WATCHDOG_RESTARTS', '0'))
+
+
+class ChunkWatchdog(threading.Thread):
+    """
+    Kill the process tree of a chunk when it shows no activity during 'timeout' seconds.
+    """
+    # CPU time (in seconds) below which a process is considered idle between two checks
+    minCpuTime = 0.01
+
+    def __init__(self, name, process, logFile, timeout, pollInterval=None):
+        """
+        Args:
+            name (str): the chunk name
+            process (psutil.Popen): the chunk process
+            logFile (str): the chunk log file, whose growth is an activity
+            timeout (float): the inactivity window, in seconds
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.name = name
+        self.process = process
+        self.logFile = logFile
+        self.timeout = timeout
+        self.pollInterval = pollInterval or min(10.0, timeout / 4.0)
+        self.hung = False
+        self._stopFlag = threading.Event()
+
+    def _processTree(self):
+        try:
+            return [self.process] + self.process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def _activity(self):
+        """ Return the CPU time of the process tree and the size of the log file. """
+        cpuTime = 0.0
+        for p in self._processTree():
+            try:
+                times = p.cpu_times()
+                cpuTime += times.user + times.system
+            except psutil.NoSuchProcess:
+                pass
+        try:
+            logSize = os.path.getsize(self.logFile)
+        except OSError:
+            logSize = 0
+        return cpuTime, logSize
+
+    def run(self):
+        try:
+            lastCpuTime, lastLogSize = self._activity()
+            lastActivityTime = time.time()
+            while not self._stopFlag.wait(self.pollInterval):
+                cpuTime, logSize = self._activity()
+                if cpuTime - lastCpuTime > self.minCpuTime or logSize != lastLogSize:
+                    lastActivityTime = time.time()
+                lastCpuTime, lastLogSize = cpuTime, logSize
+                if time.time() - lastActivityTime > self.timeout:
+                    self.hung = True
+                    logging.warning('Chunk "{}" has been inactive for {}s: kill it.'.format(self.name, self.timeout))
+                    self.killProcessTree()
+                    return
+        except psutil.NoSuchProcess:
+            pass
+
+    def killProcessTree(self):
+        """ Kill the process tree, like CommandLineNode.stopProcess. """
+        for p in self._processTree():
+            try:
+                p.kill()
+            except psutil.NoSuchProcess:
+                pass
+
+    @property
+    def reason(self):
+        return 'No activity during {}s (hung process killed by the watchdog).'.format(self.timeout) if self.hung else ''
+
+    def stopRequest(self):
+        self._stopFlag.set()
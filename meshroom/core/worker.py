@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# coding:utf-8
+"""
+Distributed computation with workers sharing a job queue on the filesystem.
+
+Jobs (see meshroom.core.localFarm.Job) are saved in sub-folders of a queue folder, shared by
+all the hosts running a Worker. Workers pull the tasks whose dependencies are computed and
+claim them atomically with a lease file ('{job}/leases/{task}.lease', created with O_EXCL).
+The lease owner refreshes its modification time while the task is running: the lease of a
+crashed worker expires and the task is retried by another worker. A lease records the id of the
+claim: a worker whose lease has been re-claimed by another worker (e.g. after a long freeze)
+aborts the task and neither refreshes nor removes the lease of the new owner.
+
+Task states are stored in the job folder:
+ - '{task}.done': the task succeeded
+ - '{task}.error': the task failed (or reached the maximum number of attempts)
+ - '{task}.attempts': one line per started attempt
+"""
+import errno
+import json
+import logging
+import os
+import platform
+import signal
+import subprocess
+import threading
+import time
+import uuid
+
+from meshroom.core.localFarm import Job
+
+# Default queue folder, shared between the submitting application and the workers
+defaultQueueFolder = os.environ.get('MESHROOM_WORKER_QUEUE', '')
+
+
+def submitJob(job, queueFolder=None):
+    """ Save the given job in the queue folder, to be computed by workers. """
+    queueFolder = queueFolder or defaultQueueFolder
+    if not queueFolder:
+        raise RuntimeError('No worker queue folder (see MESHROOM_WORKER_QUEUE).')
+    job.folder = os.path.join(queueFolder, os.path.basename(job.folder))
+    job.save()
+    logging.info('Job "{}" submitted to worker queue: {}'.format(job.name, job.folder))
+    return job
+
+
+class Worker(object):
+    """
+    Compute the ready tasks of the jobs in a queue folder.
+    """
+    heartbeatInterval = 10.0
+    leaseDuration = 60.0
+    pollInterval = 2.0
+    maxAttempts = 3
+
+    def __init__(self, queueFolder, name=None):
+        self.queueFolder = queueFolder
+        self.name = name or '{}_{}_{}'.format(platform.node(), os.getpid(), uuid.uuid4().hex[:6])
+        self._jobs = {}  # job folder: (mtime, Job)
+        self._process = None
+        self._stopRequested = False
+        # id of the lease of the claimed task
+        self._leaseId = None
+        self._leaseLost = False
+
+    # Task state files
+    @staticmethod
+    def _stateFile(job, task, state):
+        return os.path.join(job.folder, '{}.{}'.format(task.name, state))
+
+    @staticmethod
+    def _leaseFile(job, task):
+        return os.path.join(job.folder, 'leases', '{}.lease'.format(task.name))
+
+    def _taskState(self, job, task):
+        for state in ('done', 'error'):
+            if os.path.exists(self._stateFile(job, task, state)):
+                return state
+        return None
+
+    def _nbAttempts(self, job, task):
+        try:
+            with open(self._stateFile(job, task, 'attempts'), 'r') as f:
+                return len(f.readlines())
+        except (IOError, OSError):
+            return 0
+
+    def _setTaskState(self, job, task, state, info=None):
+        with open(self._stateFile(job, task, state), 'w') as f:
+            json.dump(dict(info or {}, worker=self.name), f)
+
+    def jobs(self):
+        """ Return the jobs of the queue, in submission order. """
+        if not os.path.isdir(self.queueFolder):
+            return []
+        jobs = []
+        for entry in sorted(os.listdir(self.queueFolder)):
+            folder = os.path.join(self.queueFolder, entry)
+            filepath = os.path.join(folder, Job.jobFilename)
+            try:
+                mtime = os.path.getmtime(filepath)
+            except OSError:
+                continue
+            cached = self._jobs.get(folder)
+            if not cached or cached[0] != mtime:
+                try:
+                    cached = (mtime, Job.load(folder))
+                except (IOError, OSError, ValueError) as e:
+                    logging.warning('Invalid job "{}": {}'.format(folder, str(e)))
+                    continue
+                self._jobs[folder] = cached
+            jobs.append(cached[1])
+        return jobs
+
+    def _isReady(self, job, task):
+        """ Whether all the dependencies of the task are computed; None if one of them failed. """
+        for dependencyName in task.dependencies:
+            dependency = job.task(dependencyName)
+            if dependency is None:
+                continue
+            state = self._taskState(job, dependency)
+            if state == 'error':
+                return None
+            if state != 'done':
+                return False
+        return True
+
+    def _claim(self, job, task):
+        """ Try to create the lease of the given task. Return whether it is owned by this worker. """
+        leaseFile = self._leaseFile(job, task)
+        leaseFolder = os.path.dirname(leaseFile)
+        if not os.path.exists(leaseFolder):
+            try:
+                os.makedirs(leaseFolder)
+            except OSError:
+                pass
+        try:
+            fd = os.open(leaseFile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            try:
+                expired = time.time() - os.path.getmtime(leaseFile) > self.leaseDuration
+            except OSError:
+                # released in the meantime
+                return False
+            if expired:
+                # only one worker succeeds to rename the expired lease
+                expiredFile = '{}.expired.{}'.format(leaseFile, uuid.uuid4().hex)
+                try:
+                    os.rename(leaseFile, expiredFile)
+                    os.remove(expiredFile)
+                    logging.warning('Lease of task "{}" expired, retry it.'.format(task.name))
+                except OSError:
+                    pass
+            return False
+        self._leaseId = uuid.uuid4().hex
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'worker': self.name, 'host': platform.node(), 'pid': os.getpid(), 'id': self._leaseId}, f)
+        # a concurrent worker may have completed the task since our state check
+        if self._taskState(job, task):
+            self._release(job, task)
+            return False
+        return True
+
+    def _ownsLease(self, leaseFile):
+        """ Whether the lease file is the one created by the last claim of this worker. """
+        try:
+            with open(leaseFile, 'r') as f:
+                return json.load(f).get('id') == self._leaseId
+        except (IOError, OSError, ValueError):
+            return False
+
+    def _release(self, job, task):
+        """ Remove the lease of the task if it is still owned by this worker. """
+        leaseFile = self._leaseFile(job, task)
+        # move the lease away first, so that the owner check and the removal are not interleaved with a new claim
+        releasedFile = '{}.released.{}'.format(leaseFile, uuid.uuid4().hex)
+        try:
+            os.rename(leaseFile, releasedFile)
+        except OSError:
+            return
+        if not self._ownsLease(releasedFile):
+            logging.warning('Lease of task "{}" is owned by another worker, keep it.'.format(task.name))
+            try:
+                # put it back, unless the task has been claimed again in the meantime
+                os.link(releasedFile, leaseFile)
+            except (OSError, AttributeError):
+                pass
+        try:
+            os.remove(releasedFile)
+        except OSError:
+            pass
+
+    def claimNextTask(self):
+        """
+        Claim the first ready task of the queue.
+
+        Returns:
+            tuple: the (job, task) claimed by this worker, or (None, None)
+        """
+        for job in self.jobs():
+            for task in job.tasks:
+                if self._taskState(job, task):
+                    continue
+                ready = self._isReady(job, task)
+                if ready is None:
+                    # dependency failed
+                    self._setTaskState(job, task, 'error', {'canceled': True})
+                    continue
+                if not ready or not self._claim(job, task):
+                    continue
+                if self._nbAttempts(job, task) >= self.maxAttempts:
+                    logging.error('Task "{}" reached the maximum number of attempts.'.format(task.name))
+                    self._setTaskState(job, task, 'error', {'attempts': self.maxAttempts})
+                    self._release(job, task)
+                    continue
+                return job, task
+        return None, None
+
+    def _heartbeat(self, job, task, stopEvent):
+        leaseFile = self._leaseFile(job, task)
+        while not stopEvent.wait(self.heartbeatInterval):
+            if not self._ownsLease(leaseFile):
+                # the lease expired and the task has been claimed by another worker: abort it
+                logging.error('[{}] Lease of task "{}" lost, abort it.'.format(self.name, task.name))
+                self._leaseLost = True
+                if self._process:
+                    self._process.terminate()
+                return
+            try:
+                os.utime(leaseFile, None)
+            except OSError as e:
+                logging.warning('Failed to refresh lease of task "{}": {}'.format(task.name, str(e)))
+
+    def runTask(self, job, task):
+        """
+        Execute a claimed task and release its lease.
+
+        Returns:
+            bool: whether the task succeeded
+        """
+        with open(self._stateFile(job, task, 'attempts'), 'a') as f:
+            f.write('{} {}\n'.format(self.name, time.time()))
+        self._leaseLost = False
+        stopEvent = threading.Event()
+        heartbeatThread = threading.Thread(target=self._heartbeat, args=(job, task, stopEvent))
+        heartbeatThread.daemon = True
+        heartbeatThread.start()
+        logging.info('[{}] Start task "{}": {}'.format(self.name, task.name, ' '.join(task.command)))
+        env = os.environ.copy()
+        env.update(job.environment)
+        try:
+            with open(job.taskLogFile(task), 'a') as logFile:
+                self._process = subprocess.Popen(task.command, stdout=logFile, stderr=subprocess.STDOUT, env=env)
+                returnCode = self._process.wait()
+            self._process = None
+            if self._stopRequested or self._leaseLost or not self._ownsLease(self._leaseFile(job, task)):
+                # interrupted, or computed by another worker: let it retry the task
+                return False
+            state = 'done' if returnCode == 0 else 'error'
+            self._setTaskState(job, task, state, {'returnCode': returnCode})
+            logging.info('[{}] Task "{}" finished: {}.'.format(self.name, task.name, state))
+            return returnCode == 0
+        finally:
+            stopEvent.set()
+            heartbeatThread.join()
+            self._release(job, task)
+
+    def stop(self, *args):
+        """ Stop the worker, interrupting the running task. """
+        self._stopRequested = True
+        if self._process:
+            self._process.terminate()
+
+    def run(self, exitWhenIdle=False):
+        """
+        Compute tasks until stopped.
+
+        Args:
+            exitWhenIdle (bool): return when no task is ready nor running in the queue
+        """
+        logging.info('Worker "{}" started on queue "{}".'.format(self.name, self.queueFolder))
+        while not self._stopRequested:
+            job, task = self.claimNextTask()
+            if task:
+                self.runTask(job, task)
+                continue
+            if exitWhenIdle and not self.hasPendingTasks():
+                break
+            time.sleep(self.pollInterval)
+        logging.info('Worker "{}" stopped.'.format(self.name))
+
+    def hasPendingTasks(self):
+        """ Whether some tasks of the queue are not finished. """
+        return any(not self._taskState(job, task) for job in self.jobs() for task in job.tasks)
+
+
+def runWorker(queueFolder, exitWhenIdle=False):
+    worker = Worker(queueFolder)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run(exitWhenIdle=exitWhenIdle)
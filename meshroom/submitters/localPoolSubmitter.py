@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+from meshroom.core import localFarm
+from meshroom.core.submitter import BaseSubmitter
+
+
+class LocalPoolSubmitter(BaseSubmitter):
+    """
+    Submit graphs to a pool of processes on the local machine (see meshroom.core.localFarm).
+    """
+    def __init__(self, parent=None):
+        super(LocalPoolSubmitter, self).__init__(name='LocalPool', parent=parent)
+
+    def submit(self, nodes, edges, filepath, iterations=None):
+        job = localFarm.createGraphJob(nodes, edges, filepath, iterations=iterations)
+        job.submit()
+        return True
@@ -7,7 +7,7 @@ import logging
 
 import simpleFarm
 from meshroom.core.desc import Level
-from meshroom.core.submitter import BaseSubmitter
+from meshroom.core.submitter import BaseSubmitter, coalesceNodes
 
 currentDir = os.path.dirname(os.path.realpath(__file__))
 binDir = os.path.dirname(os.path.dirname(os.path.dirname(currentDir)))
@@ -15,7 +15,7 @@ binDir = os.path.dirname(os.path.dirname(os.path.dirname(currentDir)))
 class SimpleFarmSubmitter(BaseSubmitter):
 
     filepath = os.environ.get('SIMPLEFARMCONFIG', os.path.join(currentDir, 'simpleFarmConfig.json'))
-    config = json.load(open(filepath))
+    _config = None
 
     reqPackages = []
     environment = {}
@@ -54,26 +54,43 @@ class SimpleFarmSubmitter(BaseSubmitter):
         if 'REZ_DEV_PACKAGES_ROOT' in os.environ:
             self.environment['REZ_DEV_PACKAGES_ROOT'] = os.environ['REZ_DEV_PACKAGES_ROOT']
 
-    def createTask(self, meshroomFile, node):
+    @property
+    def config(self):
+        """ Farm requirements configuration, read on first use. """
+        if SimpleFarmSubmitter._config is None:
+            with open(self.filepath) as configFile:
+                SimpleFarmSubmitter._config = json.load(configFile)
+        return SimpleFarmSubmitter._config
+
+    def createTask(self, meshroomFile, node, chainedNodes=None, iterationRange=None):
+        """ Create the task computing 'node', followed by the (non parallelized) 'chainedNodes' if any.
+        'iterationRange' restricts the task to the (start, end) chunks of a parallelized node.
+        """
         tags = self.DEFAULT_TAGS.copy()  # copy to not modify default tags
         nbFrames = node.size
         arguments = {}
         parallelArgs = ''
+        chainedNodes = chainedNodes or []
         print('node: ', node.name)
-        if node.isParallelized:
+        if chainedNodes:
+            # each node keeps its own status
+            parallelArgs = ''.join([' --node {}'.format(n.name) for n in chainedNodes])
+        elif node.isParallelized:
             blockSize, fullSize, nbBlocks = node.nodeDesc.parallelization.getSizes(node)
+            start, end = iterationRange or (0, nbBlocks - 1)
             parallelArgs = ' --iteration @start'
-            arguments.update({'start': 0, 'end': nbBlocks - 1, 'step': 1})
+            arguments.update({'start': start, 'end': end, 'step': 1})
 
         tags['nbFrames'] = nbFrames
         tags['prod'] = self.prod
+        taskNodes = [node] + chainedNodes
         allRequirements = list()
-        allRequirements.extend(self.config['CPU'].get(node.nodeDesc.cpu.name, []))
-        allRequirements.extend(self.config['RAM'].get(node.nodeDesc.ram.name, []))
-        allRequirements.extend(self.config['GPU'].get(node.nodeDesc.gpu.name, []))
+        allRequirements.extend(self.config['CPU'].get(max([n.nodeDesc.cpu for n in taskNodes], key=lambda l: l.value).name, []))
+        allRequirements.extend(self.config['RAM'].get(max([n.nodeDesc.ram for n in taskNodes], key=lambda l: l.value).name, []))
+        allRequirements.extend(self.config['GPU'].get(max([n.nodeDesc.gpu for n in taskNodes], key=lambda l: l.value).name, []))
 
         task = simpleFarm.Task(
-            name=node.nodeType,
+            name='+'.join([n.nodeType for n in taskNodes]),
             command='{exe} --node {nodeName} "{meshroomFile}" {parallelArgs} --extern'.format(
                 exe='meshroom_compute' if self.reqPackages else os.path.join(binDir, 'meshroom_compute'),
                 nodeName=node.name, meshroomFile=meshroomFile, parallelArgs=parallelArgs),
@@ -83,7 +100,18 @@ class SimpleFarmSubmitter(BaseSubmitter):
             **arguments)
         return task
 
-    def submit(self, nodes, edges, filepath):
+    @staticmethod
+    def iterationRanges(iterations):
+        """ Return the (start, end) ranges of consecutive chunk indices. """
+        ranges = []
+        for i in sorted(iterations):
+            if ranges and ranges[-1][1] == i - 1:
+                ranges[-1][1] = i
+            else:
+                ranges.append([i, i])
+        return [tuple(r) for r in ranges]
+
+    def submit(self, nodes, edges, filepath, iterations=None):
         name = os.path.splitext(os.path.basename(filepath))[0] + ' [Meshroom]'
         comment = filepath
         nbFrames = max([node.size for node in nodes])
@@ -102,15 +130,27 @@ class SimpleFarmSubmitter(BaseSubmitter):
                 environment=self.environment,
                 )
 
-        nodeNameToTask = {}
-
-        for node in nodes:
-            task = self.createTask(filepath, node)
-            job.addTask(task)
-            nodeNameToTask[node.name] = task
+        nodeNameToTasks = {}
+
+        iterations = iterations or {}
+        # only coalesce nodes computed entirely
+        groups = coalesceNodes(nodes, edges) if not any(iterations.values()) else [[node] for node in nodes]
+        for group in groups:
+            node = group[0]
+            if iterations.get(node.name) is not None and node.isParallelized:
+                tasks = [self.createTask(filepath, node, iterationRange=r) for r in self.iterationRanges(iterations[node.name])]
+            else:
+                tasks = [self.createTask(filepath, node, group[1:])]
+            for task in tasks:
+                job.addTask(task)
+            for node in group:
+                nodeNameToTasks[node.name] = tasks
 
         for u, v in edges:
-            nodeNameToTask[u.name].dependsOn(nodeNameToTask[v.name])
+            if nodeNameToTasks[u.name] is not nodeNameToTasks[v.name]:
+                for task in nodeNameToTasks[u.name]:
+                    for dependency in nodeNameToTasks[v.name]:
+                        task.dependsOn(dependency)
 
         if self.engine == 'tractor-dummy':
             job.submit(share=self.share, engine='tractor', execute=True)
@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+from meshroom.core import localFarm, worker
+from meshroom.core.submitter import BaseSubmitter
+
+
+class WorkerQueueSubmitter(BaseSubmitter):
+    """
+    Submit graphs to the queue folder shared by meshroom_worker processes (see meshroom.core.worker).
+    """
+    def __init__(self, parent=None):
+        super(WorkerQueueSubmitter, self).__init__(name='WorkerQueue', parent=parent)
+
+    def submit(self, nodes, edges, filepath, iterations=None):
+        job = localFarm.createGraphJob(nodes, edges, filepath, iterations=iterations)
+        worker.submitJob(job)
+        return True
@@ -278,6 +278,7 @@ class UIGraph(QObject):
         self._hoveredNode = None
 
         self.computeStatusChanged.connect(self.updateLockedUndoStack)
+        self._taskManager.jobsChanged.connect(self.computeJobsChanged)
 
     def setGraph(self, g):
         """ Set the internal graph. """
@@ -407,13 +408,28 @@ class UIGraph(QObject):
         self._taskManager.compute(self._graph, nodes)
         self.updateLockedUndoStack()  # explicitly call the update while it is already computing
 
+    @Slot(Node, int, bool)
+    def executeWithPriority(self, node, priority, preempt):
+        """ Compute the node and its dependencies in a new job of the given priority (see TaskManager.compute). """
+        self._taskManager.compute(self._graph, [node], priority=priority, preempt=preempt)
+        self.updateLockedUndoStack()
+
+    @Slot(int, int)
+    def setComputeJobPriority(self, jobId, priority):
+        self._taskManager.setJobPriority(jobId, priority)
+
+    @Slot(int)
+    def cancelComputeJob(self, jobId):
+        self._taskManager.cancelJob(jobId)
+
     @Slot()
     def stopExecution(self):
         if not self.isComputingLocally():
             return
+        # the queue is reset now, running chunks are terminated asynchronously and the task thread ends on its own;
+        # nodes computed from then on are processed by a new thread
         self._taskManager.requestBlockRestart()
         self._graph.stopExecution()
-        self._taskManager._thread.join()
 
     @Slot(Node)
     def stopNodeComputation(self, node):
@@ -421,9 +437,8 @@ class UIGraph(QObject):
         if not self.isComputingLocally():
             return
 
-        # Stop the node and wait Task Manager
+        # Stop the node, the Task Manager restarts on its own once the chunks are terminated
         node.stopComputation()
-        self._taskManager._thread.join()
 
     @Slot(Node)
     def cancelNodeComputation(self, node):
@@ -452,6 +467,16 @@ class UIGraph(QObject):
         node = [node] if node else None
         self._taskManager.submit(self._graph, os.environ.get('MESHROOM_DEFAULT_SUBMITTER', ''), node)
 
+    @Slot(Node)
+    def resubmitFailed(self, node=None):
+        """ Resubmit only the failed or stopped chunks of the graph (or of a node and its predecessors),
+        with their downstream nodes that have not run yet.
+        """
+        self.save()  # graph must be saved before being submitted
+        self._undoStack.clear()  # the undo stack must be cleared
+        node = [node] if node else None
+        self._taskManager.submit(self._graph, os.environ.get('MESHROOM_DEFAULT_SUBMITTER', ''), node, failedOnly=True)
+
     def updateGraphComputingStatus(self):
         # update graph computing status
         computingLocally = any([ch.status.execMode == ExecMode.LOCAL and ch.status.status in (Status.RUNNING, Status.SUBMITTED) for ch in self._sortedDFSChunks])
@@ -918,6 +943,9 @@ class UIGraph(QObject):
     computing = Property(bool, isComputing, notify=computeStatusChanged)
     computingExternally = Property(bool, isComputingExternally, notify=computeStatusChanged)
     computingLocally = Property(bool, isComputingLocally, notify=computeStatusChanged)
+    computeJobsChanged = Signal()
+    # compute queue of the task manager, in processing order (see TaskManager.getJobs)
+    computeJobs = Property("QVariant", lambda self: self._taskManager.getJobs(), notify=computeJobsChanged)
     canSubmit = Property(bool, lambda self: len(submitters), constant=True)
 
     sortedDFSChunks = Property(QObject, lambda self: self._sortedDFSChunks, constant=True)
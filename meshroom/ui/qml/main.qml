@@ -203,6 +203,17 @@ ApplicationWindow {
             }
         }
 
+        function resubmitFailed(node) {
+            try {
+                _reconstruction.resubmitFailed(node)
+            }
+            catch (error) {
+                const data = ErrorHandler.analyseError(error)
+                if(data.context === "SUBMITTING")
+                    computeSubmitErrorDialog.openError(data.type, data.msg, node)
+            }
+        }
+
         MessageDialog {
             id: computeSubmitErrorDialog
 
@@ -818,6 +829,13 @@ ApplicationWindow {
                         text: "Submit"
                         onClicked: computeManager.submit(null)
                     }
+                    Button {
+                        visible: _reconstruction.canSubmit
+                        text: "Resubmit Failed"
+                        ToolTip.text: "Resubmit only the failed or stopped chunks and the nodes depending on them"
+                        ToolTip.visible: hovered
+                        onClicked: computeManager.resubmitFailed(null)
+                    }
                 }
                 Item { Layout.fillWidth: true; Layout.fillHeight: true }
 
@@ -465,7 +465,7 @@ class Reconstruction(UIGraph):
         # Create all possible entries
         for category, _ in self.activeNodeCategories.items():
             self._activeNodes.add(ActiveNode(category, self))
-        for nodeType, _ in meshroom.core.nodesDesc.items():
+        for nodeType in meshroom.core.nodesDesc.keys():
             self._activeNodes.add(ActiveNode(nodeType, self))
 
     def clearActiveNodes(self):
@@ -122,9 +122,13 @@ executables = [
     PlatformExecutable("bin/meshroom_batch"),
     PlatformExecutable("bin/meshroom_compute"),
     PlatformExecutable("bin/meshroom_newNodeType"),
+    PlatformExecutable("bin/meshroom_relocate"),
+    PlatformExecutable("bin/meshroom_server"),
+    PlatformExecutable("bin/meshroom_archive"),
     PlatformExecutable("bin/meshroom_statistics"),
     PlatformExecutable("bin/meshroom_status"),
     PlatformExecutable("bin/meshroom_submit"),
+    PlatformExecutable("bin/meshroom_worker"),
 ]
 
 setup(
@@ -1,5 +1,8 @@
 import os
 
+# keep the nodes manifest of the tests out of the user folder, in this process and its children
+os.environ["MESHROOM_NODES_MANIFEST"] = ""
+
 from meshroom.core import loadAllNodes
 
 loadAllNodes(os.path.join(os.path.dirname(__file__), "nodes"))
@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+# coding:utf-8
+import pytest
+
+from meshroom.core import stats
+
+
+@pytest.fixture(autouse=True)
+def nodeTypesHistory(monkeypatch, tmp_path):
+    """ Keep the node types history of the tests out of the user folder, in this process and its children. """
+    filepath = str(tmp_path / "nodeTypesHistory.json")
+    monkeypatch.setattr(stats.nodeTypesHistory, "filepath", filepath)
+    monkeypatch.setenv("MESHROOM_NODE_TYPES_HISTORY", filepath)
+    return stats.nodeTypesHistory
@@ -0,0 +1,32 @@
+import os
+import shutil
+
+from meshroom.core import desc
+
+
+class PythonCopy(desc.Node):
+    inputs = [
+        desc.File(
+            name='input',
+            label='Input',
+            description='''''',
+            value='',
+            uid=[0],
+        )
+    ]
+
+    outputs = [
+        desc.File(
+            name='output',
+            label='Output',
+            description='''''',
+            value=desc.Node.internalFolder + 'copy.txt',
+            uid=[],
+        )
+    ]
+
+    def processChunk(self, chunk):
+        chunk.logManager.start('info')
+        chunk.logger.info('pid: {}'.format(os.getpid()))
+        shutil.copy(chunk.node.input.value, chunk.node.output.value)
+        chunk.logManager.end()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# coding:utf-8
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from meshroom.core import cache
+from meshroom.core.cache import CacheLayout
+from meshroom.core.graph import Graph
+from meshroom.core.node import Status
+from meshroom.core.stats import NodeTypesHistory
+
+
+# creating symbolic links requires privileges on Windows
+requiresSymlinks = pytest.mark.skipif(sys.platform == "win32", reason="requires symbolic links")
+
+
+def _writeFile(path, content="data"):
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def _makeChain(cacheDir, inputFile):
+    graph = Graph("")
+    graph.cacheDir = cacheDir
+    lsNode = graph.addNewNode("Ls", input=inputFile)
+    appendNode = graph.addNewNode("AppendText", inputText=inputFile)
+    graph.addEdges((lsNode.output, appendNode.input))
+    return graph, lsNode, appendNode
+
+
+def test_reconcileStatusFromOutputs(tmp_path):
+    tmpDir = str(tmp_path)
+    inputFile = os.path.join(tmpDir, "input.txt")
+    _writeFile(inputFile)
+    graph, lsNode, appendNode = _makeChain(os.path.join(tmpDir, "cache"), inputFile)
+
+    # no outputs: nothing to restore
+    assert graph.reconcileStatusFromOutputs() == []
+    assert lsNode.getGlobalStatus() == Status.NONE
+
+    # outputs older than the input: nothing to restore
+    _writeFile(lsNode.output.value)
+    _writeFile(appendNode.output.value)
+    past = time.time() - 100
+    os.utime(lsNode.output.value, (past, past))
+    assert graph.reconcileStatusFromOutputs() == []
+
+    # up-to-date outputs: both nodes are restored, the dependency first
+    _writeFile(lsNode.output.value)
+    _writeFile(appendNode.output.value)
+    assert graph.reconcileStatusFromOutputs() == [lsNode, appendNode]
+    assert lsNode.getGlobalStatus() == Status.SUCCESS
+    assert appendNode.getGlobalStatus() == Status.SUCCESS
+    # status has been written on disk
+    graph.updateStatusFromCache(force=True)
+    assert appendNode.getGlobalStatus() == Status.SUCCESS
+
+
+def test_reconcileStatusRequiresComputedDependencies(tmp_path):
+    tmpDir = str(tmp_path)
+    inputFile = os.path.join(tmpDir, "input.txt")
+    _writeFile(inputFile)
+    graph, lsNode, appendNode = _makeChain(os.path.join(tmpDir, "cache"), inputFile)
+
+    # only the downstream node has outputs: it depends on a node to recompute
+    _writeFile(appendNode.output.value)
+    assert graph.reconcileStatusFromOutputs() == []
+    assert appendNode.getGlobalStatus() == Status.NONE
+
+    # empty outputs are not considered as complete
+    _writeFile(lsNode.output.value, content="")
+    assert graph.reconcileStatusFromOutputs() == []
+
+
+@requiresSymlinks
+def test_relocateCache(tmp_path):
+    tmpDir = str(tmp_path)
+    inputFile = os.path.join(tmpDir, "input.txt")
+    _writeFile(inputFile)
+    srcCacheDir = os.path.join(tmpDir, "cache")
+    graph, lsNode, appendNode = _makeChain(srcCacheDir, inputFile)
+    for node in (lsNode, appendNode):
+        node.upgradeStatusTo(Status.SUCCESS)
+    # text output embedding a path to the cache folder
+    _writeFile(appendNode.output.value, content=lsNode.output.value)
+    mtime = os.path.getmtime(appendNode.output.value)
+
+    dstCacheDir = os.path.join(tmpDir, "volume", "cache")
+    graph.relocateCache(dstCacheDir, link=True)
+
+    assert graph.cacheDir == dstCacheDir
+    assert os.path.islink(srcCacheDir)
+    assert lsNode.output.value.startswith(dstCacheDir)
+    # uids do not depend on the cache folder: nodes are still computed
+    assert lsNode.getGlobalStatus() == Status.SUCCESS
+    assert appendNode.getGlobalStatus() == Status.SUCCESS
+    # cache paths have been rewritten, modification time is preserved
+    with open(appendNode.output.value) as f:
+        assert f.read() == lsNode.output.value
+    assert abs(os.path.getmtime(appendNode.output.value) - mtime) < 1e-3
+
+
+@requiresSymlinks
+def test_cacheLayout(tmp_path):
+    tmpDir = str(tmp_path)
+    inputFile = os.path.join(tmpDir, "input.txt")
+    _writeFile(inputFile)
+    cacheDir = os.path.join(tmpDir, "cache")
+    graph, lsNode, appendNode = _makeChain(cacheDir, inputFile)
+    volumes = [os.path.join(tmpDir, "volume{}".format(i)) for i in range(3)]
+    for volume in volumes:
+        os.makedirs(volume)
+    history = NodeTypesHistory(os.path.join(tmpDir, "history.json"))
+    layout = CacheLayout(volumes, history=history)
+
+    # the selection is stable for a given key
+    assert layout.selectVolume("Ls/abc") == layout.selectVolume("Ls/abc")
+
+    target = layout.createNodeFolder(lsNode)
+    folder = lsNode.internalFolder.rstrip("/")
+    assert os.path.islink(folder)
+    assert os.path.dirname(os.path.dirname(os.path.dirname(target))) in volumes
+    assert layout.createNodeFolder(lsNode) == os.path.realpath(folder)
+
+    # a lost link is restored to the same volume
+    _writeFile(lsNode.output.value)
+    os.remove(folder)
+    assert layout.createNodeFolder(lsNode) == target
+    assert os.path.exists(lsNode.output.value)
+
+    layout.recordOutputSize(lsNode)
+    assert layout.predictedOutputSize("Ls") == len("data")
+
+    # data on the volume is removed with the node folder
+    lsNode.clearData()
+    assert not os.path.lexists(folder)
+    assert not os.path.exists(target)
+
+
+def test_archiveNode(tmp_path):
+    tmpDir = str(tmp_path)
+    inputFile = os.path.join(tmpDir, "input.txt")
+    _writeFile(inputFile)
+    graph, lsNode, appendNode = _makeChain(os.path.join(tmpDir, "cache"), inputFile)
+    _writeFile(lsNode.output.value)
+    _writeFile(os.path.join(lsNode.internalFolder, "data", "file.txt"))
+    mtime = os.path.getmtime(lsNode.output.value)
+    lsNode.upgradeStatusTo(Status.SUCCESS)
+
+    assert cache.archiveNode(lsNode)
+    assert cache.isArchived(lsNode)
+    assert not os.path.exists(lsNode.output.value)
+    # status is still available without restoring the data
+    graph.updateStatusFromCache(force=True)
+    assert lsNode.getGlobalStatus() == Status.SUCCESS
+
+    # data is restored before computing a node depending on it
+    appendNode.getChunks()[0].restoreArchivedInputs()
+    assert not cache.isArchived(lsNode)
+    assert int(os.path.getmtime(lsNode.output.value)) == int(mtime)
+    assert os.path.exists(os.path.join(lsNode.internalFolder, "data", "file.txt"))
+    assert cache.restoreNodes([lsNode]) == []
+
+
+def test_nodeTypesHistoryConcurrentUpdates(tmp_path):
+    import threading
+    history = NodeTypesHistory(str(tmp_path / "history.json"))
+    threads = [threading.Thread(target=lambda: [history.addValue("Ls", "chunkDuration", 2.0) for _ in range(10)])
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # no update is lost
+    assert history.load()["Ls"]["chunkDuration"] == [2.0, 40]
+
+    # an empty filepath disables the history
+    history = NodeTypesHistory("")
+    history.addValue("Ls", "chunkDuration", 2.0)
+    assert history.getValue("Ls", "chunkDuration") is None
+
+
+def test_nodeTypesHistoryOptIn(tmp_path):
+    code = "from meshroom.core import stats; print(repr(stats.nodeTypesHistory.filepath))"
+    env = dict(os.environ, HOME=str(tmp_path), USERPROFILE=str(tmp_path))
+    env.pop("MESHROOM_NODE_TYPES_HISTORY", None)
+    # disabled by default
+    output = subprocess.check_output([sys.executable, "-c", code], env=env)
+    assert output.decode("utf-8").strip().splitlines()[-1] in ("''", "u''")
+    env["MESHROOM_NODE_TYPES_HISTORY"] = os.path.join("~", "history.json")
+    output = subprocess.check_output([sys.executable, "-c", code], env=env)
+    assert os.path.join(str(tmp_path), "history.json") in output.decode("utf-8")
+
+
+def test_relocateCacheWithoutLink(tmp_path):
+    tmpDir = str(tmp_path)
+    inputFile = os.path.join(tmpDir, "input.txt")
+    _writeFile(inputFile)
+    graph, lsNode, appendNode = _makeChain(os.path.join(tmpDir, "project", "MeshroomCache"), inputFile)
+    projectFile = os.path.join(tmpDir, "project", "project.mg")
+    os.makedirs(os.path.dirname(projectFile))
+    graph.save(projectFile)
+    for node in (lsNode, appendNode):
+        node.upgradeStatusTo(Status.SUCCESS)
+    # a sibling folder sharing the cache folder as prefix is left unchanged
+    otherPath = graph.cacheDir + "2/data.txt"
+    _writeFile(appendNode.output.value, content="{}\n{}".format(lsNode.output.value, otherPath))
+
+    dstCacheDir = os.path.join(tmpDir, "volume", "cache")
+    graph.relocateCache(dstCacheDir, link=False)
+    with open(appendNode.output.value) as f:
+        assert f.read() == "{}\n{}".format(lsNode.output.value, otherPath)
+
+    # the project uses the new location once reopened
+    graph = Graph("")
+    graph.load(projectFile)
+    graph.update()
+    assert graph.cacheDir == dstCacheDir
+    assert all(node.getGlobalStatus() == Status.SUCCESS for node in graph.nodes)
+
+
+@requiresSymlinks
+def test_cacheLayoutRestoredOnStatusUpdate(tmp_path, monkeypatch):
+    tmpDir = str(tmp_path)
+    inputFile = os.path.join(tmpDir, "input.txt")
+    _writeFile(inputFile)
+    graph, lsNode, appendNode = _makeChain(os.path.join(tmpDir, "cache"), inputFile)
+    volumes = [os.path.join(tmpDir, "volume{}".format(i)) for i in range(2)]
+    for volume in volumes:
+        os.makedirs(volume)
+    layout = CacheLayout(volumes, history=NodeTypesHistory(os.path.join(tmpDir, "history.json")))
+    monkeypatch.setattr(cache, "cacheLayout", layout)
+
+    target = layout.createNodeFolder(lsNode)
+    chunk = lsNode.chunks[0]
+    chunk.status.status = Status.SUCCESS
+    chunk.saveStatusFile()
+    chunk.status.status = Status.NONE
+
+    # a lost link is restored when reading the node status
+    folder = lsNode.internalFolder.rstrip("/")
+    os.remove(folder)
+    lsNode.updateStatusFromCache()
+    assert os.path.realpath(folder) == os.path.realpath(target)
+    assert chunk.status.status == Status.SUCCESS
+    # nodes never stored on a volume are left untouched
+    appendNode.updateStatusFromCache()
+    assert not os.path.lexists(appendNode.internalFolder.rstrip("/"))
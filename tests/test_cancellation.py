@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# coding:utf-8
+import os
+import sys
+import time
+
+import psutil
+import pytest
+
+from meshroom.core.cancellation import cancelProcessTree, isAlive, terminateProcessTree
+
+
+# parent process starting a child ignoring SIGTERM
+_treeCode = """
+import subprocess, sys, time
+subprocess.Popen([sys.executable, "-c", "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(60)"])
+time.sleep(60)
+"""
+
+
+@pytest.mark.skipif(os.name != "posix", reason="requires signals")
+def test_terminateProcessTree():
+    process = psutil.Popen([sys.executable, "-c", _treeCode])
+    # wait for the child to start
+    for i in range(100):
+        if process.children():
+            break
+        time.sleep(0.05)
+    time.sleep(0.5)
+    child = process.children()[0]
+
+    startTime = time.time()
+    thread = cancelProcessTree(process, timeout=1.0)
+    # returns immediately
+    assert time.time() - startTime < 0.5
+    thread.join()
+    # the parent terminated on SIGTERM, the child has been killed after the grace period
+    assert 1.0 <= time.time() - startTime < 5
+    assert not isAlive(process)
+    assert not isAlive(child)
+
+    # nothing to do on finished processes
+    assert terminateProcessTree(process, timeout=1.0) == []
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding:utf-8
+import io
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from meshroom import computeServer
+from meshroom.core.graph import Graph
+from meshroom.core.node import Status
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="requires unix sockets")
+
+
+def test_computeServer(tmp_path):
+    tmpDir = str(tmp_path)
+    socketPath = os.path.join(tmpDir, "server.sock")
+    graphFile = os.path.join(tmpDir, "graph.mg")
+    graph = Graph("")
+    graph.cacheDir = os.path.join(tmpDir, "cache")
+    ls = graph.addNewNode("Ls", input=tmpDir)
+    graph.save(graphFile)
+
+    try:
+        computeServer.sendRequest({"command": "ping"}, socketPath)
+        assert False, "no server should be running"
+    except computeServer.ServerUnavailableError:
+        pass
+
+    server = computeServer.ComputeServer(socketPath)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        assert computeServer.sendRequest({"command": "ping"}, socketPath)["success"]
+
+        response = computeServer.sendRequest({"command": "status", "graphFile": graphFile}, socketPath)
+        assert response["status"] == {ls.name: ["NONE"]}
+
+        # status computed by another process
+        ls.chunks[0].upgradeStatusTo(Status.SUCCESS)
+        response = computeServer.sendRequest({"command": "status", "graphFile": graphFile}, socketPath)
+        assert response["status"] == {ls.name: ["SUCCESS"]}
+        response = computeServer.sendRequest({"command": "compute", "graphFile": graphFile, "nodes": [ls.name]}, socketPath)
+        assert response["success"]
+
+        # the graph is reloaded when its file changes
+        append = graph.addNewNode("AppendText", input=ls.output, inputText="a")
+        time.sleep(0.01)
+        graph.save(graphFile)
+        os.utime(graphFile, (time.time() + 1, time.time() + 1))
+        response = computeServer.sendRequest({"command": "status", "graphFile": graphFile}, socketPath)
+        assert response["status"] == {ls.name: ["SUCCESS"], append.name: ["NONE"]}
+
+        response = computeServer.sendRequest({"command": "compute", "graphFile": graphFile, "nodes": ["Unknown"]}, socketPath)
+        assert not response["success"] and "Unknown" in response["error"]
+    finally:
+        computeServer.sendRequest({"command": "shutdown"}, socketPath)
+        thread.join()
+        server.server_close()
+    assert not os.path.exists(socketPath)
+
+
+def test_computeServerConcurrentRequests(monkeypatch, tmp_path):
+    tmpDir = str(tmp_path)
+    socketPath = os.path.join(tmpDir, "server.sock")
+    graphFile = os.path.join(tmpDir, "graph.mg")
+    graph = Graph("")
+    graph.cacheDir = os.path.join(tmpDir, "cache")
+    nodes = [graph.addNewNode("PythonCopy", input=os.path.join(tmpDir, str(i))) for i in range(2)]
+    graph.save(graphFile)
+    events = []
+    started = threading.Event()
+
+    def processChunk(nodeDesc, chunk):
+        events.append(("start", chunk.node.name))
+        started.set()
+        time.sleep(0.2)
+        events.append(("end", chunk.node.name))
+    # the server loads its own instances of the nodes
+    monkeypatch.setattr(type(nodes[0].nodeDesc), "processChunk", processChunk)
+
+    server = computeServer.ComputeServer(socketPath)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        outputs = [io.StringIO() for _ in nodes]
+        requests = [threading.Thread(target=computeServer.sendRequest, args=(
+            {"command": "compute", "graphFile": graphFile, "toNode": node.name}, socketPath), kwargs={"output": output})
+            for node, output in zip(nodes, outputs)]
+        for request in requests:
+            request.start()
+        # status requests are served during the computations, from the cache
+        assert started.wait(10)
+        response = computeServer.sendRequest({"command": "status", "graphFile": graphFile}, socketPath)
+        assert "RUNNING" in [s for statuses in response["status"].values() for s in statuses]
+        for request in requests:
+            request.join()
+        # computations of the same server do not overlap
+        assert [e[0] for e in events] == ["start", "end", "start", "end"]
+        # the output of each computation is streamed to its client
+        for node, output in zip(nodes, outputs):
+            assert "Nodes to execute:" in output.getvalue() and node.name in output.getvalue()
+    finally:
+        computeServer.sendRequest({"command": "shutdown"}, socketPath)
+        thread.join()
+        server.server_close()
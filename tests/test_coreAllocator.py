@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding:utf-8
+import os
+import subprocess
+import sys
+
+import pytest
+
+import meshroom
+from meshroom.core import coreAllocator
+from meshroom.core.desc import Level
+from meshroom.core.graph import Graph
+from meshroom.core.coreAllocator import CoreAllocator, _parseCpuList
+
+
+def test_parseCpuList():
+    assert _parseCpuList("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="requires sched_setaffinity")
+def test_coreAllocator(monkeypatch, tmp_path):
+    # two NUMA nodes of 4 cores
+    monkeypatch.setattr(coreAllocator, "numaNodes", lambda: [[0, 1, 2, 3], [4, 5, 6, 7]])
+    tmpDir = str(tmp_path)
+    allocator = CoreAllocator(tmpDir)
+    a = allocator.allocate(3)
+    b = allocator.allocate(3)
+    # disjoint sets, each one in a single NUMA node
+    assert a.cores == [0, 1, 2]
+    assert b.cores == [4, 5, 6]
+    # no node with enough free cores: span nodes
+    c = allocator.allocate(2)
+    assert sorted(c.cores) == [3, 7]
+    assert allocator.allocate(1) is None
+    # released cores are available again
+    a.release()
+    assert allocator.allocate(4).cores == [0, 1, 2]
+    b.release()
+    c.release()
+
+    # the chunk process is pinned and its thread pools sized accordingly
+    core = sorted(os.sched_getaffinity(0))[0]
+    coreSet = coreAllocator.CoreSet([core], [])
+    code = "import os; print(sorted(os.sched_getaffinity(0)), os.environ['OMP_NUM_THREADS'])"
+    output = subprocess.check_output(coreSet.command([sys.executable, "-c", code]), env=coreSet.environment(os.environ.copy()))
+    assert output.decode().strip() == "[{}] 1".format(core)
+
+    # without taskset, the process is pinned by the parent
+    monkeypatch.setattr(coreAllocator, "_tasksetExecutable", lambda: None)
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(10)"])
+    try:
+        coreSet.pin(process)
+        assert sorted(os.sched_getaffinity(process.pid)) == [core]
+    finally:
+        process.kill()
+        process.wait()
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="requires sched_setaffinity")
+def test_concurrentIntensiveChunks(monkeypatch, tmp_path):
+    monkeypatch.setattr(meshroom, "useCoreAllocation", True)
+    monkeypatch.setattr(coreAllocator, "availableCores", lambda: list(range(8)))
+    monkeypatch.setattr(coreAllocator, "numaNodes", lambda: [list(range(8))])
+    monkeypatch.setattr(coreAllocator, "coreAllocator", CoreAllocator(str(tmp_path)))
+    g = Graph('')
+    g.cacheDir = str(tmp_path)
+    node = g.addNewNode('Ls', input='/tmp')
+    monkeypatch.setattr(node.nodeDesc, "cpu", Level.INTENSIVE)
+    # two intensive chunks are pinned to disjoint halves of the host
+    a = coreAllocator.chunkCores(node.chunks[0])
+    b = coreAllocator.chunkCores(node.chunks[0])
+    assert a.cores == [0, 1, 2, 3]
+    assert b.cores == [4, 5, 6, 7]
+    a.release()
+    # fewer cores than requested when the other ones are taken
+    c = coreAllocator.coreAllocator.allocate(6)
+    assert c.cores == [0, 1, 2, 3]
+    b.release()
+    c.release()
+
+
+def test_findExecutable(monkeypatch, tmp_path):
+    folder = str(tmp_path)
+    path = os.path.join(folder, "taskset")
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\n")
+    os.chmod(path, 0o755)
+    monkeypatch.setattr(coreAllocator, "_executables", {})
+    monkeypatch.setenv("PATH", folder)
+    assert coreAllocator._tasksetExecutable() == path
+    # the lookup is cached
+    monkeypatch.setenv("PATH", "")
+    assert coreAllocator._tasksetExecutable() == path
@@ -1,4 +1,7 @@
-from meshroom.core.graph import Graph
+import os
+
+from meshroom.core.graph import Graph, loadGraph
+from meshroom.core.node import Status
 
 
 def test_depth():
@@ -279,3 +282,56 @@ def test_duplicate_nodes():
     assert nMap[n2][0].input.getLinkParam() == nMap[n1][0].output
     assert nMap[n3][0].input.getLinkParam() == nMap[n1][0].output
     assert nMap[n3][0].input2.getLinkParam() == nMap[n2][0].output
+
+
+def test_dfsFailedToProcess(tmp_path):
+    # n0 -- n1 -- n2
+    #  \
+    #   -- n3
+    cacheDir = str(tmp_path)
+    g = Graph('')
+    g.cacheDir = cacheDir
+    n0 = g.addNewNode('Ls', input='/tmp')
+    n1 = g.addNewNode('Ls', input=n0.output)
+    n2 = g.addNewNode('Ls', input=n1.output)
+    n3 = g.addNewNode('AppendText', input=n0.output, inputText='n3')
+
+    # nothing has failed
+    assert g.dfsFailedToProcess() == ([], [], {})
+
+    n0.chunks[0].upgradeStatusTo(Status.SUCCESS)
+    n1.chunks[0].upgradeStatusTo(Status.ERROR)
+    # downstream node blocked in the failed job
+    n2.chunks[0].upgradeStatusTo(Status.SUBMITTED)
+    # node still pending in another job
+    n3.chunks[0].upgradeStatusTo(Status.SUBMITTED)
+
+    nodes, edges, iterations = g.dfsFailedToProcess()
+    assert nodes == [n1, n2]
+    assert edges == [(n2, n1)]
+    assert iterations == {n1.name: None, n2.name: None}
+
+
+def test_loadSubgraph(tmp_path):
+    # n0 -- n1 -- n2
+    #  \
+    #   -- n3
+    tmpDir = str(tmp_path)
+    g = Graph('')
+    n0 = g.addNewNode('Ls', input='/tmp')
+    n1 = g.addNewNode('AppendFiles', input=n0.output, input2=n0.output)
+    n2 = g.addNewNode('Ls', input=n1.output)
+    n3 = g.addNewNode('AppendText', input=n0.output, inputText='n3')
+    filepath = os.path.join(tmpDir, 'graph.mg')
+    g.save(filepath)
+
+    fullGraph = loadGraph(filepath)
+    subGraph = loadGraph(filepath, nodeNames=[n1.name])
+    assert sorted(subGraph.nodes.keys()) == sorted([n0.name, n1.name])
+    # same uids, cache folders and output paths as in the full graph
+    for nodeName in (n0.name, n1.name):
+        fullNode, subNode = fullGraph.node(nodeName), subGraph.node(nodeName)
+        assert subNode._uids == fullNode._uids
+        assert subNode.internalFolder == fullNode.internalFolder
+        assert subNode.output.value == fullNode.output.value
+        assert subNode.input.value == fullNode.input.value
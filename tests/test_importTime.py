@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# coding:utf-8
+import json
+import os
+import subprocess
+import sys
+import time
+
+import meshroom.core
+
+# Maximum duration of "import meshroom.core.graph", in number of plain interpreter starts
+# (a relative budget, so that it holds on slow or loaded machines), enforced by test_importTimeBudget
+importTimeBudget = float(os.environ.get("MESHROOM_IMPORT_TIME_BUDGET", "30"))
+
+# Modules that are only needed to submit or compute, and must not be imported with meshroom.core
+deferredModules = ["psutil", "distutils", "tarfile", "multiprocessing.pool",
+                   "meshroom.core.submitter", "meshroom.core.localFarm", "meshroom.core.worker"]
+
+importCode = '''
+import json, sys
+import meshroom.core.graph
+# modules using psutil during computations
+import meshroom.core.cancellation, meshroom.core.stats, meshroom.core.watchdog
+print(json.dumps(sorted(sys.modules.keys())))
+'''
+
+benchmarkCode = '''
+import time
+startTime = time.time()
+import meshroom.core.graph
+print(time.time() - startTime)
+'''
+
+
+def _importMeshroom(env):
+    output = subprocess.check_output([sys.executable, "-c", importCode], env=env)
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def test_deferredImports(tmp_path):
+    env = dict(os.environ, MESHROOM_NODES_MANIFEST=str(tmp_path / "manifest.json"),
+               MESHROOM_USE_LAZY_NODES="1")
+    # first import fills the nodes manifest
+    _importMeshroom(env)
+    modules = _importMeshroom(env)
+    for moduleName in deferredModules:
+        assert moduleName not in modules
+    # node plugin modules and submitters are not imported
+    assert not [m for m in modules if m.startswith("meshroom.nodes.") or m.startswith("meshroom.submitters")]
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def test_importTimeBudget(tmp_path):
+    env = dict(os.environ, MESHROOM_NODES_MANIFEST=str(tmp_path / "manifest.json"),
+               MESHROOM_USE_LAZY_NODES="1")
+    # first import fills the nodes manifest
+    _importMeshroom(env)
+    importTimes = []
+    startTimes = []
+    # interleaved runs, so that the machine load affects both measures alike
+    for _ in range(5):
+        output = subprocess.check_output([sys.executable, "-c", benchmarkCode], env=env)
+        importTimes.append(float(output.decode("utf-8").strip().splitlines()[-1]))
+        startTime = time.time()
+        subprocess.check_call([sys.executable, "-c", "pass"], env=env)
+        startTimes.append(time.time() - startTime)
+    assert _median(importTimes) < importTimeBudget * _median(startTimes)
+
+
+def test_lazyModule():
+    from meshroom.core.lazyImport import LazyModule
+    module = LazyModule("colorsys")
+    assert module._module is None
+    assert module.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert module._module is sys.modules["colorsys"]
+
+
+def test_lazyRegistries():
+    assert "LocalPool" in meshroom.core.submitters
+    assert meshroom.core.submitters.isLoaded()
+    assert "photogrammetry" in meshroom.core.pipelineTemplates.keys()
+    assert meshroom.core.loadingTimes["nodes"] > 0.0
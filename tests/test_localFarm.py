@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# coding:utf-8
+import os
+import sys
+import time
+
+import pytest
+
+import meshroom
+import meshroom.core
+from meshroom.core import stats
+from meshroom.core.graph import Graph
+from meshroom.core.localFarm import Job, Scheduler, Task, TaskStatus, createGraphJob
+from meshroom.core.resourceLimits import ResourceLimits
+from meshroom.core.stats import NodeTypesHistory
+from meshroom.core.submitter import coalesceNodes
+
+
+def _appendCommand(filepath, text, returnCode=0):
+    code = "open({!r}, 'a').write({!r}); raise SystemExit({})".format(filepath, text + "\n", returnCode)
+    return [sys.executable, "-c", code]
+
+
+def test_localFarmScheduler(tmp_path):
+    tmpDir = str(tmp_path)
+    outputFile = os.path.join(tmpDir, "output.txt")
+    job = Job("test", folder=os.path.join(tmpDir, "job"))
+    a = job.addTask(Task("a", _appendCommand(outputFile, "a")))
+    b = job.addTask(Task("b", _appendCommand(outputFile, "b"), requirements={"cpu": 0.5}))
+    c = job.addTask(Task("c", _appendCommand(outputFile, "c"), requirements={"cpu": 0.5}))
+    d = job.addTask(Task("d", _appendCommand(outputFile, "d")))
+    for task in (b, c):
+        task.dependsOn(a)
+        d.dependsOn(task)
+    job.save()
+
+    job = Job.load(job.folder)
+    assert Scheduler(job, maxTasks=2).run()
+    with open(outputFile) as f:
+        lines = f.read().split()
+    assert lines[0] == "a" and lines[-1] == "d" and sorted(lines[1:3]) == ["b", "c"]
+    # task statuses are saved with the job
+    assert all(t.status == TaskStatus.SUCCESS for t in Job.load(job.folder).tasks)
+
+
+def test_localFarmSchedulerError(tmp_path):
+    tmpDir = str(tmp_path)
+    outputFile = os.path.join(tmpDir, "output.txt")
+    job = Job("test", folder=os.path.join(tmpDir, "job"))
+    a = job.addTask(Task("a", _appendCommand(outputFile, "a", returnCode=1)))
+    b = job.addTask(Task("b", _appendCommand(outputFile, "b"), dependencies=["a"]))
+    c = job.addTask(Task("c", _appendCommand(outputFile, "c"), dependencies=["b"]))
+    job.save()
+    assert not Scheduler(job).run()
+    assert [t.status for t in (a, b, c)] == [TaskStatus.ERROR, TaskStatus.CANCELED, TaskStatus.CANCELED]
+
+
+@pytest.mark.skipif(os.name != "posix", reason="resource limits are only enforced on posix systems")
+def test_localFarmTaskLimits(monkeypatch, tmp_path):
+    monkeypatch.setattr(meshroom, "useResourceLimits", True)
+    tmpDir = str(tmp_path)
+    job = Job("test", folder=os.path.join(tmpDir, "job"))
+    job.addTask(Task("a", [sys.executable, "-c", "import time; time.sleep(30)"], limits=ResourceLimits(runtime=0.5)))
+    job.save()
+    job = Job.load(job.folder)
+    assert job.task("a").limits.runtime == 0.5
+    startTime = time.time()
+    assert not Scheduler(job).run()
+    assert time.time() - startTime < 20
+    task = Job.load(job.folder).task("a")
+    assert task.status == TaskStatus.ERROR
+    assert task.statusReason == "Maximum runtime exceeded (0.5s)."
+
+    # tasks get the limits of the nodes they compute
+    graph = Graph("")
+    graph.cacheDir = tmpDir
+    ls = graph.addNewNode("Ls", input=tmpDir)
+    monkeypatch.setattr(ls.nodeDesc, "resourceLimits", {"runtime": 60})
+    nodes, edges = graph.dfsToProcess()
+    job = createGraphJob(nodes, edges, os.path.join(tmpDir, "graph.mg"))
+    assert job.task(ls.name).limits.runtime == 60
+    # nodes computed in a single task: the largest limits, the sum of the runtimes
+    limits = ResourceLimits.combine([ResourceLimits(memory=1, cpus=2, runtime=3), ResourceLimits(memory=4, runtime=5)])
+    assert (limits.memory, limits.cpus, limits.runtime) == (4, None, 8)
+
+
+def test_localPoolSubmitterRegistered():
+    assert "LocalPool" in meshroom.core.submitters
+
+
+def test_coalesceNodes(monkeypatch, tmp_path):
+    tmpDir = str(tmp_path)
+    history = NodeTypesHistory(os.path.join(tmpDir, "history.json"))
+    monkeypatch.setattr(stats, "nodeTypesHistory", history)
+    graph = Graph("")
+    graph.cacheDir = tmpDir
+    ls = graph.addNewNode("Ls", input=tmpDir)
+    append1 = graph.addNewNode("AppendText", inputText="a")
+    append2 = graph.addNewNode("AppendText", inputText="b")
+    graph.addEdges((ls.output, append1.input), (append1.output, append2.input))
+    nodes, edges = graph.dfsToProcess()
+
+    # unknown durations
+    assert coalesceNodes(nodes, edges) == [[ls], [append1], [append2]]
+
+    history.addValue("Ls", "chunkDuration", 1.0)
+    history.addValue("AppendText", "chunkDuration", 2.0)
+    assert coalesceNodes(nodes, edges) == [[ls, append1, append2]]
+    assert coalesceNodes(nodes, edges, maxDuration=1.5) == [[ls], [append1], [append2]]
+
+    # a node with several dependents ends a chain
+    append3 = graph.addNewNode("AppendText", inputText="c")
+    graph.addEdges((append1.output, append3.input))
+    nodes, edges = graph.dfsToProcess()
+    groups = coalesceNodes(nodes, edges)
+    assert [ls, append1] in groups and [append2] in groups and [append3] in groups
+
+    # chained nodes are computed in a single task, after their dependencies
+    job = createGraphJob(nodes, edges, os.path.join(tmpDir, "graph.mg"))
+    assert len(job.tasks) == 3
+    task = job.task("{}_{}".format(ls.name, append1.name))
+    assert task.command[-4:] == ["--node", ls.name, "--node", append1.name]
+    assert job.task(append2.name).dependencies == [task.name]
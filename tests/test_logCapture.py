@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding:utf-8
+import gzip
+import os
+import subprocess
+import sys
+
+from meshroom.core.logCapture import LogCapture, backupFilepath, readLog
+
+
+def test_logCapture(tmp_path):
+    tmpDir = str(tmp_path)
+    logFile = os.path.join(tmpDir, 'log')
+    with LogCapture(logFile, maxSize=1000, backups=2, maxRate=0, nbTailLines=5) as logCapture:
+        process = subprocess.Popen([sys.executable, '-c', 'for i in range(300): print("line {:03d}".format(i))'],
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        logCapture.read(process.stdout)
+        process.wait()
+        logCapture.wait()
+        # last lines kept in memory
+        assert logCapture.tailText().split() == ['line', '295', 'line', '296', 'line', '297', 'line', '298', 'line', '299']
+
+    # rotated into compressed backups
+    assert os.path.getsize(logFile) <= 1000
+    with open(logFile) as f:
+        assert f.read().endswith('line 299\n')
+    with gzip.open(backupFilepath(logFile, 1), 'rb') as f:
+        first = f.read().decode('utf-8')
+    with open(logFile) as f:
+        assert int(f.readline().split()[1]) == int(first.splitlines()[-1].split()[1]) + 1
+    assert os.path.exists(backupFilepath(logFile, 2))
+    assert not os.path.exists(backupFilepath(logFile, 3))
+
+    # rate limit: output is dropped and counted
+    with LogCapture(logFile, maxSize=0, maxRate=100) as logCapture:
+        for i in range(100):
+            logCapture.write('0123456789\n')
+    assert not os.path.exists(backupFilepath(logFile, 1))
+    with open(logFile) as f:
+        lines = f.read().splitlines()
+    assert len(lines) < 20
+    assert lines[-1].endswith('bytes dropped (log rate limit exceeded)')
+
+
+def test_readLog(tmp_path):
+    tmpDir = str(tmp_path)
+    logFile = os.path.join(tmpDir, 'log')
+    assert readLog(logFile) == ('', 0, False)
+    with open(logFile, 'w') as f:
+        f.write('a\nb\nincomplete')
+    text, offset, reset = readLog(logFile)
+    assert (text, offset, reset) == ('a\nb\n', 4, False)
+    with open(logFile, 'a') as f:
+        f.write(' line\nc\n')
+    assert readLog(logFile, offset) == ('incomplete line\nc\n', 22, False)
+    # truncated file is read from the beginning
+    with open(logFile, 'w') as f:
+        f.write('new\n')
+    assert readLog(logFile, 22) == ('new\n', 4, True)
+
+
+def test_readLogLongLine(tmp_path):
+    logFile = str(tmp_path / 'log')
+    with open(logFile, 'wb') as f:
+        f.write(u'0123456é789\nend'.encode('utf-8'))
+    # line longer than maxSize: read in parts, without splitting a character
+    assert readLog(logFile, 0, maxSize=8) == ('0123456', 7, False)
+    assert readLog(logFile, 7, maxSize=8) == (u'é789\n', 13, False)
+    assert readLog(logFile, 13, maxSize=8) == ('', 13, False)
+
+
+def test_logCaptureOutlivedByProcess(tmp_path):
+    logFile = str(tmp_path / 'log')
+    # the child process keeps the pipe open and writes after the end of the capture
+    code = 'import sys, time\nfor i in range(20):\n    sys.stdout.write("line\\n")\n    sys.stdout.flush()\n    time.sleep(0.1)\n'
+    process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        logCapture = LogCapture(logFile, maxSize=0, maxRate=0)
+        logCapture.read(process.stdout)
+        thread = logCapture._thread
+        logCapture.wait(timeout=0.3)
+        logCapture.close()
+        # late output is ignored
+        logCapture.write('late\n')
+        size = os.path.getsize(logFile)
+        process.wait()
+        thread.join(5)
+        # the reader stopped without writing to the closed file
+        assert not thread.is_alive()
+        assert os.path.getsize(logFile) == size
+    finally:
+        if process.poll() is None:
+            process.kill()
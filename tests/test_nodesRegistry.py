@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# coding:utf-8
+import importlib
+import os
+import sys
+import time
+
+import meshroom.core
+from meshroom.core import NodesManifest, loadNodesLazily
+
+nodeModuleContent = '''
+__version__ = "1.2"
+
+from meshroom.core import desc
+
+
+class LazyTestNode(desc.Node):
+    category = "Test"
+    inputs = []
+    outputs = []
+'''
+
+
+def _forgetModules():
+    for name in [n for n in sys.modules if n.startswith("lazyTestNodes")]:
+        del sys.modules[name]
+    if hasattr(importlib, "invalidate_caches"):
+        # python 3
+        importlib.invalidate_caches()
+
+
+def test_lazyNodesRegistry(tmp_path):
+    nodesDesc = meshroom.core.nodesDesc
+    tmpDir = str(tmp_path)
+    packageFolder = os.path.join(tmpDir, "lazyTestNodes")
+    os.makedirs(packageFolder)
+    open(os.path.join(packageFolder, "__init__.py"), "w").close()
+    moduleFile = os.path.join(packageFolder, "lazyTestNode.py")
+    with open(moduleFile, "w") as f:
+        f.write(nodeModuleContent)
+    manifestFile = os.path.join(tmpDir, "manifest.json")
+
+    try:
+        # unknown module: imported and recorded in the manifest
+        manifest = NodesManifest(manifestFile)
+        assert loadNodesLazily(tmpDir, "lazyTestNodes", manifest) == ["LazyTestNode"]
+        assert nodesDesc.isLoaded("LazyTestNode")
+        manifest.save()
+        del nodesDesc["LazyTestNode"]
+        _forgetModules()
+
+        # known module: registered without being imported
+        assert loadNodesLazily(tmpDir, "lazyTestNodes", NodesManifest(manifestFile)) == ["LazyTestNode"]
+        assert "lazyTestNodes.lazyTestNode" not in sys.modules
+        assert "LazyTestNode" in nodesDesc.keys()
+        assert nodesDesc.nodeTypeInfo("LazyTestNode") == {"category": "Test", "version": "1.2"}
+        assert not nodesDesc.isLoaded("LazyTestNode")
+        # imported on first use
+        assert nodesDesc["LazyTestNode"].__name__ == "LazyTestNode"
+        assert nodesDesc.isLoaded("LazyTestNode")
+        assert nodesDesc["LazyTestNode"].packageName == "lazyTestNodes"
+
+        # modified module: the manifest entry is outdated
+        later = time.time() + 10
+        os.utime(moduleFile, (later, later))
+        package = importlib.import_module("lazyTestNodes")
+        assert NodesManifest(manifestFile).nodeTypes(package, "lazyTestNode") is None
+
+        # no manifest file: node types are only recorded in memory
+        manifest = NodesManifest("")
+        manifest.record(package, "lazyTestNode", [nodesDesc["LazyTestNode"]])
+        manifest.save()
+        assert manifest.nodeTypes(package, "lazyTestNode") is not None
+        assert meshroom.core.nodesManifestFile == ""
+    finally:
+        if "LazyTestNode" in nodesDesc.keys():
+            del nodesDesc["LazyTestNode"]
+        _forgetModules()
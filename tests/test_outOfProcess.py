@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# coding:utf-8
+import os
+import time
+
+import meshroom
+from meshroom.core.graph import Graph
+from meshroom.core.node import Status
+
+
+def test_outOfProcessNodes(monkeypatch, tmp_path):
+    monkeypatch.setattr(meshroom, "useOutOfProcessNodes", True)
+    monkeypatch.setenv("MESHROOM_NODES_PATH", os.path.join(os.path.dirname(__file__), "nodes"))
+    tmpDir = str(tmp_path)
+    inputFile = os.path.join(tmpDir, "input.txt")
+    with open(inputFile, "w") as f:
+        f.write("data")
+    g = Graph("")
+    g.cacheDir = os.path.join(tmpDir, "cache")
+    node = g.addNewNode("PythonCopy", input=inputFile)
+    node.process()
+
+    # computed by a worker process
+    assert node.chunks[0].status.status == Status.SUCCESS
+    with open(node.output.value) as f:
+        assert f.read() == "data"
+    with open(node.chunks[0].logFile) as f:
+        assert "pid: {}".format(os.getpid()) not in f.read()
+    # unsaved graph is left unchanged
+    assert g.filepath == ""
+
+    # errors of the worker are reported
+    os.remove(inputFile)
+    node = g.addNewNode("PythonCopy", input=inputFile + "2")
+    try:
+        node.process()
+    except RuntimeError as e:
+        assert "No such file" in str(e)
+    else:
+        assert False, "worker error not reported"
+    assert node.chunks[0].status.status == Status.ERROR
+
+
+def test_forwardProgress(tmp_path):
+    from meshroom.core.outOfProcess import forwardProgress
+    g = Graph("")
+    g.cacheDir = str(tmp_path)
+    chunk = g.addNewNode("PythonCopy", input=str(tmp_path)).chunks[0]
+    chunk.upgradeStatusTo(Status.RUNNING)
+
+    # progress written by the worker in the status file
+    worker = Graph("")
+    worker.cacheDir = str(tmp_path)
+    workerChunk = worker.addNewNode("PythonCopy", input=str(tmp_path)).chunks[0]
+    workerChunk.updateStatusFromCache()
+    workerChunk.status.progress = 0.5
+    workerChunk.status.processedItems = 3
+    workerChunk.saveStatusFile()
+
+    forwardProgress(chunk)
+    assert chunk.status.progress == 0.5
+    assert chunk.status.processedItems == 3
+
+    # the progress of a worker does not change a chunk which is not running anymore
+    chunk.upgradeStatusTo(Status.STOPPED)
+    workerChunk.status.progress = 0.75
+    workerChunk.saveStatusFile()
+    forwardProgress(chunk)
+    assert chunk.status.status == Status.STOPPED
+    assert chunk.status.progress == 0.5
+
+
+def test_concurrentOutOfProcessChunks(monkeypatch, tmp_path):
+    from meshroom.core.taskManager import TaskManager
+    monkeypatch.setattr(meshroom, "useOutOfProcessNodes", True)
+    monkeypatch.setenv("MESHROOM_NODES_PATH", os.path.join(os.path.dirname(__file__), "nodes"))
+    tmpDir = str(tmp_path)
+    for name in ("a", "b"):
+        with open(os.path.join(tmpDir, name), "w") as f:
+            f.write(name)
+    g = Graph("")
+    g.cacheDir = os.path.join(tmpDir, "cache")
+    a = g.addNewNode("PythonCopy", input=os.path.join(tmpDir, "a"))
+    b = g.addNewNode("PythonCopy", input=os.path.join(tmpDir, "b"))
+    c = g.addNewNode("PythonCopy", input=a.output)
+
+    taskManager = TaskManager()
+    taskManager.compute(g, [b, c])
+    maxRunning = 0
+    startTime = time.time()
+    while taskManager._thread.is_alive():
+        assert time.time() - startTime < 60
+        running = [n for n in (a, b, c) if n.getGlobalStatus() == Status.RUNNING]
+        maxRunning = max(maxRunning, len(running))
+        # the dependent node waits for its input node
+        if c in running:
+            assert a.getGlobalStatus() == Status.SUCCESS
+        time.sleep(0.02)
+
+    # the worker processes of independent nodes run concurrently
+    assert maxRunning >= 2
+    for node in (a, b, c):
+        assert node.getGlobalStatus() == Status.SUCCESS
+    with open(c.output.value) as f:
+        assert f.read() == "a"
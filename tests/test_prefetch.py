@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# coding:utf-8
+import os
+import time
+
+import meshroom
+from meshroom.core.graph import Graph
+from meshroom.core.prefetch import InputsPrefetcher, inputFiles
+
+
+def test_inputsPrefetch(monkeypatch, tmp_path):
+    monkeypatch.setattr(meshroom, "useInputsPrefetch", True)
+    tmpDir = str(tmp_path)
+    inputFolder = os.path.join(tmpDir, "inputs")
+    os.makedirs(os.path.join(inputFolder, "sub"))
+    for i, path in enumerate(["a.txt", os.path.join("sub", "b.txt")]):
+        with open(os.path.join(inputFolder, path), "wb") as f:
+            f.write(b"x" * (i + 1) * 1024)
+    g = Graph("")
+    n0 = g.addNewNode("AppendFiles", input=os.path.join(inputFolder, "a.txt"), input2=inputFolder)
+    n1 = g.addNewNode("AppendText", input=n0.output, inputText="text")
+
+    # folders are expanded, missing files (not computed outputs) are ignored
+    assert sorted(inputFiles(n0)) == sorted([os.path.join(inputFolder, "a.txt"),
+                                             os.path.join(inputFolder, "a.txt"),
+                                             os.path.join(inputFolder, "sub", "b.txt")])
+    assert inputFiles(n1) == []
+
+    # bandwidth cap: 3KB at 6KB/s takes about 0.5s
+    prefetcher = InputsPrefetcher(bandwidth=6 * 1024)
+    prefetcher.blockSize = 1024
+    startTime = time.time()
+    prefetcher.prefetch(n0.chunks[0])
+    prefetcher._thread.join()
+    assert time.time() - startTime >= 0.4
+    assert sorted(prefetcher._warmFiles.keys()) == sorted(set(inputFiles(n0)))
+
+    # unmodified files are not prefetched again
+    prefetcher.prefetch(n0.chunks[0])
+    prefetcher._thread.join()
+    assert time.time() - startTime < 1.0
+
+    # the prefetch is interrupted by the next one
+    prefetcher = InputsPrefetcher(bandwidth=1)
+    prefetcher.prefetch(n0.chunks[0])
+    prefetcher.prefetch(None)
+    assert prefetcher._thread is None
+    assert not prefetcher._warmFiles
+
+
+def test_inputFilesPlaceholders(tmp_path):
+    tmpDir = str(tmp_path)
+    for viewId in ("1", "2"):
+        with open(os.path.join(tmpDir, viewId + ".txt"), "w") as f:
+            f.write(viewId)
+    g = Graph("")
+    node = g.addNewNode("AppendFiles", input=os.path.join(tmpDir, "<VIEW_ID>.txt"))
+    # per-view placeholders are resolved to the existing files
+    assert sorted(inputFiles(node)) == [os.path.join(tmpDir, "1.txt"), os.path.join(tmpDir, "2.txt")]
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# coding:utf-8
+import json
+
+from meshroom.core import desc
+from meshroom.core.graph import Graph
+from meshroom.core.node import Status
+from meshroom.core.progress import ChunkProgress
+
+
+def test_chunkProgress(tmp_path):
+    tmpDir = str(tmp_path)
+    g = Graph('')
+    g.cacheDir = tmpDir
+    chunk = g.addNewNode('Ls', input='/tmp').chunks[0]
+    chunk.status.initStartCompute()
+    chunk.upgradeStatusTo(Status.RUNNING)
+
+    # textual progress bar, written progressively
+    progress = ChunkProgress(chunk, interval=0)
+    progress.feed('0%   10   20   30   40   50   60   70   80   90   100%\n')
+    progress.feed('|----|----|----|----|----|----|----|----|----|----|\n')
+    assert progress.progress is None
+    progress.feed('*' * 17)
+    assert abs(progress.progress - 1.0 / 3) < 1e-6
+    with open(chunk.statusFile) as f:
+        assert abs(json.load(f)['progress'] - 1.0 / 3) < 1e-6
+    assert chunk.status.remainingTime is not None
+    progress.feed('*' * 34 + '\n')
+    assert progress.progress == 1.0
+
+    # progress patterns of the node type
+    progress = ChunkProgress(chunk, [desc.ProgressPattern(r'Processing view (?P<done>\d+)/(?P<total>\d+)'),
+                                     desc.ProgressPattern(r'Features extracted', total=4)], interval=0)
+    progress.feed('Processing view 5/20\nother line\n')
+    assert progress.progress == 0.25
+    assert progress.items == 5
+    progress.feed('Features extracted\nFeatures extracted\n')
+    assert progress.items == 7
+    assert progress.progress == 1.0
+    assert chunk.status.processedItems == 7
+    assert chunk.status.throughput > 0
+
+    # output read after the end of the chunk does not overwrite its final status
+    chunk.upgradeStatusTo(Status.SUCCESS)
+    progress.feed('Processing view 10/20\n')
+    with open(chunk.statusFile) as f:
+        assert json.load(f)['status'] == 'SUCCESS'
+    assert chunk.status.processedItems == 7
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# coding:utf-8
+import os
+import sys
+import time
+
+import psutil
+import pytest
+
+from meshroom.core import desc
+from meshroom.core.resourceLimits import ChunkLimiter, ResourceLimits
+
+
+def _run(limits, code):
+    limiter = ChunkLimiter("test", limits)
+    process = psutil.Popen([sys.executable, "-c", code])
+    limiter.attach(process)
+    limiter.start(process)
+    process.wait()
+    return process.returncode, limiter.finish(process.returncode)
+
+
+def test_resourceLimitsFromNodeDesc():
+    class LimitedNode(desc.Node):
+        ram = desc.Level.INTENSIVE
+        cpu = desc.Level.NONE
+        resourceLimits = {"runtime": 60}
+
+    limits = ResourceLimits.fromNodeDesc(LimitedNode)
+    assert limits.memory > 0
+    assert limits.cpus is None
+    assert limits.runtime == 60
+    assert not ResourceLimits()
+
+
+@pytest.mark.skipif(os.name != "posix", reason="requires setrlimit")
+def test_chunkLimiter():
+    # maximum runtime
+    startTime = time.time()
+    returnCode, reason = _run(ResourceLimits(runtime=0.5), "import time; time.sleep(10)")
+    assert time.time() - startTime < 5
+    assert returnCode != 0
+    assert reason.startswith("Maximum runtime exceeded")
+
+    # memory limit without cgroup: the resident memory is watched
+    returnCode, reason = _run(ResourceLimits(memory=64 * 1024 * 1024),
+                              "import time; b = b'x' * (256 * 1024 * 1024); time.sleep(10)")
+    assert returnCode != 0
+    assert reason.startswith("Memory limit exceeded")
+
+    # the address space is not limited unless explicitly requested
+    code = "import mmap; m = mmap.mmap(-1, 1024 * 1024 * 1024)"
+    assert _run(ResourceLimits(memory=64 * 1024 * 1024), code) == (0, None)
+    returnCode, reason = _run(ResourceLimits(addressSpace=512 * 1024 * 1024), code)
+    assert returnCode != 0
+    assert "address space" in reason
+
+    # within the limits
+    assert _run(ResourceLimits(memory=512 * 1024 * 1024, runtime=30), "pass") == (0, None)
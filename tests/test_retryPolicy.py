@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding:utf-8
+import os
+import threading
+import time
+
+import pytest
+
+from meshroom.core import desc
+from meshroom.core.graph import Graph
+from meshroom.core.node import Status
+
+
+def test_retryPolicyDelay():
+    policy = desc.RetryPolicy(maxAttempts=5, backoff=1.0, backoffFactor=2.0, maxDelay=3.0)
+    assert [policy.delay(i) for i in range(1, 5)] == [1.0, 2.0, 3.0, 3.0]
+    assert policy.getMaxAttempts() == 5
+
+
+def test_retryPolicyIsTransient(tmp_path):
+    policy = desc.RetryPolicy()
+    tmpDir = str(tmp_path)
+    g = Graph('')
+    g.cacheDir = tmpDir
+    chunk = g.addNewNode('Ls', input='/tmp').chunks[0]
+    assert not policy.isTransient(chunk)
+    chunk.status.statusReason = 'Memory limit exceeded (1.0G).'
+    assert policy.isTransient(chunk)
+    chunk.status.statusReason = ''
+    chunk.status.returnCode = -9
+    assert policy.isTransient(chunk)
+    chunk.status.returnCode = 1
+    assert not policy.isTransient(chunk)
+    # errors found at the end of the log
+    os.makedirs(os.path.dirname(chunk.logFile))
+    with open(chunk.logFile, 'w') as f:
+        f.write('Error: cannot read file: Stale file handle\n')
+    assert policy.isTransient(chunk)
+
+
+def test_retryTransientFailures(monkeypatch, tmp_path):
+    tmpDir = str(tmp_path)
+    g = Graph('')
+    g.cacheDir = tmpDir
+    node = g.addNewNode('Ls', input='/tmp')
+    chunk = node.chunks[0]
+    failures = ['Stale file handle', 'Stale file handle']
+
+    def processChunk(c):
+        if failures:
+            raise RuntimeError(failures.pop(0))
+
+    monkeypatch.setattr(node.nodeDesc, 'processChunk', processChunk)
+    monkeypatch.setattr(node.nodeDesc, 'retryPolicy', desc.RetryPolicy(maxAttempts=3, backoff=0.0))
+
+    # transient failures: computed again until success
+    monkeypatch.setattr(node.nodeDesc.retryPolicy, 'isTransient', lambda c: True)
+    chunk.process()
+    assert chunk.status.status == Status.SUCCESS
+    assert [a['status'] for a in chunk.status.attempts] == ['ERROR', 'ERROR', 'SUCCESS']
+
+    # attempts are recorded in the status file
+    chunk.updateStatusFromCache()
+    assert len(chunk.status.attempts) == 3
+
+    # non-transient failure: no retry
+    failures.append('Invalid input')
+    monkeypatch.setattr(node.nodeDesc.retryPolicy, 'isTransient', lambda c: False)
+    with pytest.raises(RuntimeError):
+        chunk.process(forceCompute=True)
+    assert chunk.status.status == Status.ERROR
+    assert [a['status'] for a in chunk.status.attempts] == ['ERROR']
+
+
+def test_stopDuringRetryBackoff(monkeypatch, tmp_path):
+    tmpDir = str(tmp_path)
+    g = Graph('')
+    g.cacheDir = tmpDir
+    node = g.addNewNode('Ls', input='/tmp')
+    chunk = node.chunks[0]
+    calls = []
+
+    def processChunk(c):
+        calls.append(c)
+        raise RuntimeError('Stale file handle')
+
+    monkeypatch.setattr(node.nodeDesc, 'processChunk', processChunk)
+    monkeypatch.setattr(node.nodeDesc, 'retryPolicy', desc.RetryPolicy(maxAttempts=3, backoff=60.0))
+    monkeypatch.setattr(node.nodeDesc.retryPolicy, 'isTransient', lambda c: True)
+
+    errors = []
+
+    def compute():
+        try:
+            chunk.process()
+        except RuntimeError as e:
+            errors.append(e)
+
+    t = threading.Thread(target=compute)
+    t.start()
+    # wait for the first failure: the chunk waits 60s before its next attempt
+    deadline = time.time() + 10
+    while not (chunk._waiting and chunk.status.status == Status.ERROR) and time.time() < deadline:
+        time.sleep(0.01)
+    assert chunk.status.status == Status.ERROR
+    node.stopComputation()
+    t.join(10)
+    assert not t.is_alive()
+    # stopped without any other attempt
+    assert len(calls) == 1
+    assert errors
+    assert chunk.status.status == Status.STOPPED
+    chunk.updateStatusFromCache()
+    assert chunk.status.status == Status.STOPPED
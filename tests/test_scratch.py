@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# coding:utf-8
+import os
+
+import pytest
+
+from meshroom.core import scratch
+from meshroom.core.graph import Graph
+from meshroom.core.node import Status
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def test_chunkStaging(monkeypatch, tmp_path):
+    tmpDir = str(tmp_path)
+    scratchDir = os.path.join(tmpDir, 'scratch')
+    monkeypatch.setattr(scratch, 'scratchDir', scratchDir)
+    inputFile = os.path.join(tmpDir, 'data', 'input.txt')
+    os.makedirs(os.path.dirname(inputFile))
+    with open(inputFile, 'w') as f:
+        f.write('data')
+
+    g = Graph('')
+    g.cacheDir = os.path.join(tmpDir, 'cache')
+    node = g.addNewNode('Ls', input=inputFile)
+    monkeypatch.setattr(node.nodeDesc, 'commandLine', 'cp {inputValue} {outputValue}')
+    chunk = node.chunks[0]
+
+    # paths are mapped to the scratch folder, without matching path prefixes
+    staging = scratch.ChunkStaging(chunk, os.path.join(scratchDir, 'chunk'))
+    staging.stageInputs()
+    assert staging.stagedValue('"{}"'.format(inputFile)) == '"{}/inputs/1/input.txt"'.format(staging.folder)
+    assert staging.stagedValue(inputFile + '2') == inputFile + '2'
+    assert staging.cmdVars()['outputValue'] == '"{}/ls.txt"'.format(staging.outputFolder)
+    staging.cleanup()
+
+    # the command line runs on the scratch folder and outputs are moved to the cache
+    chunk.process()
+    assert chunk.status.status == Status.SUCCESS
+    assert scratchDir in chunk.status.commandLine
+    with open(node.output.value) as f:
+        assert f.read() == 'data'
+    # only the lock file of the shared inputs is left
+    assert os.listdir(scratchDir) == ['inputs']
+    assert [f for f in os.listdir(os.path.join(scratchDir, 'inputs')) if not f.endswith('.lock')] == []
+    assert not [f for f in os.listdir(node.internalFolder) if '.writing.' in f]
+
+
+@pytest.mark.skipif(fcntl is None, reason="requires flock to share the staged inputs")
+def test_sharedInputsStaging(monkeypatch, tmp_path):
+    scratchDir = str(tmp_path / 'scratch')
+    monkeypatch.setattr(scratch, 'scratchDir', scratchDir)
+    inputFolder = str(tmp_path / 'data')
+    os.makedirs(os.path.join(inputFolder, 'sub'))
+    with open(os.path.join(inputFolder, 'sub', 'input.txt'), 'w') as f:
+        f.write('data')
+    g = Graph('')
+    g.cacheDir = str(tmp_path / 'cache')
+    chunk = g.addNewNode('Ls', input=inputFolder).chunks[0]
+
+    # the chunks of a node computed on the host stage its inputs once
+    first = scratch.chunkStaging(chunk)
+    second = scratch.chunkStaging(chunk)
+    assert first.folder != second.folder
+    assert first.inputsFolder == second.inputsFolder
+    stagedFolder = first.stagedValue(inputFolder)
+    assert stagedFolder == second.stagedValue(inputFolder)
+    with open(os.path.join(stagedFolder, 'sub', 'input.txt')) as f:
+        assert f.read() == 'data'
+
+    # the last chunk using the inputs removes them
+    first.cleanup()
+    assert os.path.exists(stagedFolder)
+    second.cleanup()
+    assert not os.path.exists(first.inputsFolder)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# coding:utf-8
+import json
+import os
+
+from meshroom.core import snapshot
+from meshroom.core.graph import Graph, loadGraph
+from meshroom.core.node import Status
+
+
+def test_graphSnapshot(tmp_path):
+    # n0 -- n1
+    #  \
+    #   -- n2
+    tmpDir = str(tmp_path)
+    g = Graph('')
+    n0 = g.addNewNode('Ls', input='/tmp')
+    n1 = g.addNewNode('AppendFiles', input=n0.output, input2=n0.output)
+    n2 = g.addNewNode('AppendText', input=n0.output, inputText='n2')
+    filepath = os.path.join(tmpDir, 'graph.mg')
+    g.save(filepath)
+    graph = loadGraph(filepath)
+
+    s = snapshot.loadSnapshot(filepath)
+    assert os.path.exists(snapshot.snapshotFilepath(filepath))
+    # plain json data, reloaded from the file
+    with open(snapshot.snapshotFilepath(filepath), 'r') as f:
+        assert json.load(f)['name'] == s.name
+    s = snapshot.loadSnapshot(filepath, create=False)
+    assert sorted(n.name for n in s.nodes) == sorted(graph.nodes.keys())
+    for node in graph.nodes:
+        nodeSnapshot = s.node(node.name)
+        assert nodeSnapshot.uids == node._uids
+        assert nodeSnapshot.internalFolder == node.internalFolder
+        assert nodeSnapshot.outputs['output'] == node.output.value
+        assert [c.statusFile for c in nodeSnapshot.chunks] == [c.statusFile for c in node.chunks]
+    assert s.node(n1.name).dependencies == [n0.name]
+    assert [n.name for n in s.dfsOnFinish([s.node(n1.name)])] == [n0.name, n1.name]
+
+    # statuses are read from the cache
+    chunk = graph.node(n0.name).chunks[0]
+    chunk.status.status = Status.SUCCESS
+    chunk.saveStatusFile()
+    assert s.node(n0.name).chunks[0].status.status == Status.SUCCESS
+    assert s.node(n2.name).chunks[0].status.status == Status.NONE
+
+    # valid snapshot is reused without loading the graph
+    assert snapshot.loadSnapshot(filepath, create=False) is not None
+
+    # snapshot is invalidated by any change of the graph file
+    with open(filepath, 'r') as f:
+        content = f.read()
+    with open(filepath, 'w') as f:
+        f.write(content + '\n')
+    assert snapshot.loadSnapshot(filepath, create=False) is None
+    # and by a different cache folder
+    otherCache = os.path.join(tmpDir, 'otherCache')
+    s = snapshot.loadSnapshot(filepath, cacheDir=otherCache)
+    assert s.node(n0.name).internalFolder.startswith(otherCache)
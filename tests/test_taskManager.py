@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# coding:utf-8
+import json
+import os
+import sys
+import threading
+import time
+
+from meshroom.core.graph import Graph
+from meshroom.core.node import Status
+from meshroom.core.taskManager import TaskManager, queueFilepath
+
+
+def _wait(condition, timeout=30):
+    startTime = time.time()
+    while not condition():
+        assert time.time() - startTime < timeout
+        time.sleep(0.05)
+
+
+def test_computeJobsPriority(monkeypatch, tmp_path):
+    tmpDir = str(tmp_path)
+    g = Graph('')
+    g.cacheDir = tmpDir
+    computed = []
+    release = threading.Event()
+
+    def addNode(name):
+        node = g.addNewNode('PythonCopy', input=os.path.join(tmpDir, name))
+
+        def processChunk(chunk):
+            if not computed:
+                release.wait(30)
+            computed.append(name)
+        monkeypatch.setattr(node.nodeDesc, 'processChunk', processChunk)
+        return node
+
+    a, b, c = addNode('a'), addNode('b'), addNode('c')
+    taskManager = TaskManager()
+    taskManager.compute(g, [a])
+    _wait(lambda: a.getGlobalStatus() == Status.RUNNING)
+    taskManager.compute(g, [b])
+    taskManager.compute(g, [c], priority=5)
+
+    # queue introspection
+    assert [(job['priority'], job['nodes']) for job in taskManager.getJobs()] == [
+        (5, [c.name]), (0, [a.name]), (0, [b.name])]
+    with open(queueFilepath(tmpDir)) as f:
+        queue = json.load(f)
+    assert queue['running'] == [a.chunks[0].name]
+    assert len(queue['jobs']) == 3
+
+    release.set()
+    _wait(lambda: len(computed) == 3)
+    taskManager._thread.join()
+    assert computed == ['a', 'c', 'b']
+    assert taskManager.getJobs() == []
+
+
+def test_computeJobsPreemption(monkeypatch, tmp_path):
+    tmpDir = str(tmp_path)
+    g = Graph('')
+    g.cacheDir = tmpDir
+    low = g.addNewNode('Ls', input=tmpDir)
+    monkeypatch.setattr(low.nodeDesc, 'commandLine', '{} -c "import time; time.sleep(30)"'.format(sys.executable))
+    high = g.addNewNode('PythonCopy', input=tmpDir)
+
+    def processChunk(chunk):
+        # the preempted chunk is computed again afterwards, quickly this time
+        low.nodeDesc.commandLine = '{} -c "pass"'.format(sys.executable)
+    monkeypatch.setattr(high.nodeDesc, 'processChunk', processChunk)
+
+    taskManager = TaskManager()
+    taskManager.compute(g, [low])
+    _wait(lambda: getattr(low.chunks[0], 'subprocess', None) is not None)
+    startTime = time.time()
+    taskManager.compute(g, [high], priority=1, preempt=True)
+    _wait(lambda: low.getGlobalStatus() == Status.SUCCESS)
+    taskManager._thread.join()
+    assert time.time() - startTime < 20
+    assert high.getGlobalStatus() == Status.SUCCESS
+    assert [a['status'] for a in low.chunks[0].status.attempts] == ['SUCCESS']
+
+
+def test_computeAfterStop(monkeypatch, tmp_path):
+    from meshroom.core import cancellation
+    monkeypatch.setattr(cancellation, 'gracePeriod', 1)
+    tmpDir = str(tmp_path)
+    g = Graph('')
+    g.cacheDir = tmpDir
+    running = g.addNewNode('Ls', input=tmpDir)
+    # ignore SIGTERM: the chunk is only terminated after the grace period
+    monkeypatch.setattr(running.nodeDesc, 'commandLine', '{} -c "import signal, time; '
+                        'signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(30)"'.format(sys.executable))
+    queued = g.addNewNode('PythonCopy', input=tmpDir + '/queued')
+    new = g.addNewNode('PythonCopy', input=tmpDir + '/new')
+    computed = []
+    monkeypatch.setattr(new.nodeDesc, 'processChunk', lambda chunk: computed.append(chunk.node.name))
+
+    taskManager = TaskManager()
+    taskManager.compute(g, [running])
+    taskManager.compute(g, [queued])
+    _wait(lambda: getattr(running.chunks[0], 'subprocess', None) is not None)
+    stoppedThread = taskManager._thread
+    taskManager.requestBlockRestart()
+    g.stopExecution()
+    assert queued.getGlobalStatus() == Status.NONE
+    assert taskManager.getJobs() == []
+
+    # computing again while the stopped chunk is still being terminated
+    assert stoppedThread.is_alive()
+    taskManager.compute(g, [new])
+    assert taskManager._thread is not stoppedThread
+    taskManager._thread.join(30)
+    assert computed == [new.name]
+    assert queued.getGlobalStatus() == Status.NONE
+    assert running.getGlobalStatus() == Status.STOPPED
+
+
+def test_preemptionOfInProcessChunk(monkeypatch, tmp_path):
+    tmpDir = str(tmp_path)
+    g = Graph('')
+    g.cacheDir = tmpDir
+    release = threading.Event()
+    low = g.addNewNode('PythonCopy', input=os.path.join(tmpDir, 'low'))
+    monkeypatch.setattr(low.nodeDesc, 'processChunk', lambda chunk: release.wait(30))
+    high = g.addNewNode('PythonCopy', input=os.path.join(tmpDir, 'high'))
+    monkeypatch.setattr(high.nodeDesc, 'processChunk', lambda chunk: None)
+
+    taskManager = TaskManager()
+    taskManager.compute(g, [low])
+    _wait(lambda: low.getGlobalStatus() == Status.RUNNING)
+    # a chunk computed in this process cannot be stopped: it is left running
+    taskManager.compute(g, [high], priority=1, preempt=True)
+    assert low.getGlobalStatus() == Status.RUNNING
+    release.set()
+    taskManager._thread.join(30)
+    assert low.getGlobalStatus() == Status.SUCCESS
+    assert high.getGlobalStatus() == Status.SUCCESS
+    assert [a['status'] for a in low.chunks[0].status.attempts] == ['SUCCESS']
+
+    # stopping a chunk which has already ended keeps its status
+    low.chunks[0].stopProcess()
+    assert low.getGlobalStatus() == Status.SUCCESS
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding:utf-8
+import json
+import os
+import threading
+import time
+
+from meshroom.core.graph import Graph
+from meshroom.core.node import Status
+from meshroom.core.uidLock import UidLock, chunkLockFilepath
+
+
+def test_uidLock(tmp_path):
+    tmpDir = str(tmp_path)
+    filepath = os.path.join(tmpDir, "Ls", "abc.lock")
+    lock = UidLock(filepath)
+    assert lock.acquire(blocking=False)
+
+    # the lock is exclusive, even between threads of the same process
+    result = []
+    thread = threading.Thread(target=lambda: result.append(UidLock(filepath).acquire(blocking=False)))
+    thread.start()
+    thread.join()
+    assert result == [False]
+
+    lock.release()
+    assert not os.path.exists(filepath)
+    otherLock = UidLock(filepath)
+    assert otherLock.acquire(blocking=False)
+    otherLock.release()
+
+
+def test_uidLockExpiredLease(tmp_path):
+    tmpDir = str(tmp_path)
+    filepath = os.path.join(tmpDir, "abc.lock")
+    # lock left by a process on another host, without heartbeat for a while
+    with open(filepath, "w") as f:
+        json.dump({"host": "otherHost", "pid": 1, "thread": 1}, f)
+    assert not UidLock(filepath).acquire(blocking=False)
+    past = time.time() - 2 * UidLock.leaseDuration
+    os.utime(filepath, (past, past))
+    lock = UidLock(filepath)
+    assert lock.acquire(blocking=False)
+    lock.release()
+
+
+def test_processReusesLockedResult(tmp_path):
+    tmpDir = str(tmp_path)
+    graph = Graph("")
+    graph.cacheDir = tmpDir
+    node = graph.addNewNode("Ls", input=tmpDir)
+    chunk = node.chunks[0]
+    lock = UidLock(chunkLockFilepath(chunk))
+    assert lock.acquire(blocking=False)
+
+    UidLock.pollInterval, pollInterval = 0.1, UidLock.pollInterval
+    try:
+        thread = threading.Thread(target=chunk.process)
+        thread.start()
+        time.sleep(0.3)
+        assert thread.is_alive()
+        # another owner computes the chunk
+        chunk.upgradeStatusTo(Status.SUCCESS)
+        chunk._status.status = Status.NONE
+        lock.release()
+        thread.join()
+    finally:
+        UidLock.pollInterval = pollInterval
+    # the chunk has not been computed again
+    assert chunk.status.status == Status.SUCCESS
+    assert not os.path.exists(chunk.logFile)
+
+
+def test_stopWhileWaitingForLock(tmp_path):
+    tmpDir = str(tmp_path)
+    graph = Graph("")
+    graph.cacheDir = tmpDir
+    node = graph.addNewNode("Ls", input=tmpDir)
+    chunk = node.chunks[0]
+    lock = UidLock(chunkLockFilepath(chunk))
+    assert lock.acquire(blocking=False)
+    errors = []
+
+    def compute():
+        try:
+            chunk.process()
+        except RuntimeError as e:
+            errors.append(e)
+
+    try:
+        thread = threading.Thread(target=compute)
+        thread.start()
+        deadline = time.time() + 10
+        while not chunk._waiting and time.time() < deadline:
+            time.sleep(0.01)
+        # the chunk is not computed by this process, but it can be stopped
+        node.stopComputation()
+        thread.join(10)
+        assert not thread.is_alive()
+    finally:
+        lock.release()
+    assert errors
+    assert chunk.status.status == Status.STOPPED
+    assert not os.path.exists(chunk.logFile)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# coding:utf-8
+import os
+import sys
+import time
+
+import psutil
+
+from meshroom.core.watchdog import ChunkWatchdog
+
+
+def _watch(code, logFile, timeout, duration):
+    with open(logFile, "w") as logF:
+        process = psutil.Popen([sys.executable, "-u", "-c", code], stdout=logF, stderr=logF)
+        watchdog = ChunkWatchdog("test", process, logFile, timeout, pollInterval=0.1)
+        watchdog.start()
+        try:
+            process.wait(duration)
+        except psutil.TimeoutExpired:
+            pass
+        watchdog.stopRequest()
+        watchdog.join()
+        if process.is_running():
+            process.kill()
+            process.wait()
+    return watchdog
+
+
+def test_chunkWatchdog(tmp_path):
+    tmpDir = str(tmp_path)
+    logFile = os.path.join(tmpDir, "log")
+
+    # inactive process is killed
+    startTime = time.time()
+    watchdog = _watch("import time; time.sleep(30)", logFile, timeout=1.0, duration=10)
+    assert watchdog.hung
+    assert time.time() - startTime < 5
+    assert "No activity" in watchdog.reason
+
+    # process writing its log is not killed
+    watchdog = _watch("import time\nfor i in range(20):\n    print(i)\n    time.sleep(0.1)", logFile,
+                      timeout=1.0, duration=10)
+    assert not watchdog.hung
+    assert watchdog.reason == ""
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# coding:utf-8
+import os
+import sys
+import time
+
+import psutil
+
+from meshroom.core.localFarm import Job, Task
+from meshroom.core.worker import Worker, submitJob
+
+workerCode = "import sys; from meshroom.core.worker import Worker; w = Worker(sys.argv[1]); w.pollInterval = 0.1; w.run(exitWhenIdle=True)"
+
+
+def _appendCommand(filepath, text):
+    code = "import time; open({!r}, 'a').write({!r}); time.sleep(0.2)".format(filepath, text + "\n")
+    return [sys.executable, "-c", code]
+
+
+def test_workers(tmp_path):
+    tmpDir = str(tmp_path)
+    queueFolder = os.path.join(tmpDir, "queue")
+    outputFile = os.path.join(tmpDir, "output.txt")
+    job = Job("test")
+    a = job.addTask(Task("a", _appendCommand(outputFile, "a")))
+    middleTasks = [job.addTask(Task("b{}".format(i), _appendCommand(outputFile, "b"), dependencies=["a"])) for i in range(4)]
+    job.addTask(Task("c", _appendCommand(outputFile, "c"), dependencies=[t.name for t in middleTasks]))
+    submitJob(job, queueFolder)
+
+    # psutil.Popen.wait supports a timeout on python 2
+    workers = [psutil.Popen([sys.executable, "-c", workerCode, queueFolder]) for _ in range(3)]
+    for w in workers:
+        assert w.wait(timeout=60) == 0
+    with open(outputFile) as f:
+        assert f.read().split() == ["a", "b", "b", "b", "b", "c"]
+    # each task has been computed once
+    for task in job.tasks:
+        assert os.path.exists(os.path.join(job.folder, task.name + ".done"))
+        with open(os.path.join(job.folder, task.name + ".attempts")) as f:
+            assert len(f.readlines()) == 1
+
+
+def test_workerExpiredLease(tmp_path):
+    tmpDir = str(tmp_path)
+    queueFolder = os.path.join(tmpDir, "queue")
+    outputFile = os.path.join(tmpDir, "output.txt")
+    job = submitJob(Job("test"), queueFolder)
+    job.addTask(Task("a", _appendCommand(outputFile, "a")))
+    job.save()
+
+    # task claimed by a worker which crashed
+    crashedWorker = Worker(queueFolder)
+    job, task = crashedWorker.claimNextTask()
+    worker = Worker(queueFolder)
+    assert worker.claimNextTask() == (None, None)
+    past = time.time() - 2 * Worker.leaseDuration
+    os.utime(worker._leaseFile(job, task), (past, past))
+    # the expired lease is released, the task is claimed again
+    assert worker.claimNextTask() == (None, None)
+    job, task = worker.claimNextTask()
+    assert task.name == "a"
+    assert worker.runTask(job, task)
+    assert not worker.hasPendingTasks()
+
+
+def test_workerLostLease(tmp_path):
+    queueFolder = str(tmp_path / "queue")
+    job = submitJob(Job("test"), queueFolder)
+    job.addTask(Task("a", [sys.executable, "-c", "import time; time.sleep(30)"]))
+    job.save()
+
+    # a frozen worker whose lease expired and has been claimed by another worker
+    slowWorker = Worker(queueFolder)
+    slowWorker.heartbeatInterval = 0.1
+    job, task = slowWorker.claimNextTask()
+    past = time.time() - 2 * Worker.leaseDuration
+    os.utime(slowWorker._leaseFile(job, task), (past, past))
+    worker = Worker(queueFolder)
+    assert worker.claimNextTask() == (None, None)
+    assert worker.claimNextTask()[1].name == "a"
+
+    # the slow worker aborts the task and keeps the lease of the new owner
+    startTime = time.time()
+    assert not slowWorker.runTask(job, task)
+    assert time.time() - startTime < 20
+    assert worker._ownsLease(worker._leaseFile(job, task))
+    assert not os.path.exists(os.path.join(job.folder, "a.error"))